@@ -7,9 +7,14 @@
 # ----------------------------------------------------------------------------
 
 from .provenance import (ImportProvenanceCapture, ActionProvenanceCapture,
-                         PipelineProvenanceCapture)
-from .archiver import Archiver
+                         PipelineProvenanceCapture, ProvenanceDumper,
+                         ProvenanceLoader)
+from .archiver import Archiver, ArchiveHandle
+from .blobs import BlobStore
+from .provenance_graph import ProvenanceGraph, ProvenanceNode
 
 
-__all__ = ['Archiver', 'ImportProvenanceCapture', 'ActionProvenanceCapture',
-           'PipelineProvenanceCapture']
+__all__ = ['Archiver', 'ArchiveHandle', 'BlobStore', 'ImportProvenanceCapture',
+           'ActionProvenanceCapture', 'PipelineProvenanceCapture',
+           'ProvenanceDumper', 'ProvenanceLoader', 'ProvenanceGraph',
+           'ProvenanceNode']
@@ -6,18 +6,31 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import bisect
 import collections
+import hashlib
+import concurrent.futures
+import contextlib
+import fnmatch
 import uuid as _uuid
 import pathlib
 import zipfile
+import zlib
 import importlib
 import os
 import io
+import shutil
+import struct
+import threading
+import time
 
 import qiime2
 import qiime2.core.cite as cite
+from qiime2.core.archive.blobs import BlobStore
+from qiime2.core.archive.cache import ArchiveCache
 
-from qiime2.core.util import md5sum_directory, from_checksum_format
+from qiime2.core.util import (checksum_directory, read_checksum_file,
+                              write_checksum_file)
 
 _VERSION_TEMPLATE = """\
 QIIME 2
@@ -32,6 +45,69 @@ ArchiveRecord = collections.namedtuple(
 ChecksumDiff = collections.namedtuple(
     'ChecksumDiff', ['added', 'removed', 'changed'])
 
+# Refers to an extracted archive by where it is on disk, so that it can be
+# handed to another process on the same machine without copying it.
+ArchiveHandle = collections.namedtuple('ArchiveHandle', ['path', 'uuid'])
+
+# Where the (possibly compressed) data of a member is in the archive file
+MemberRange = collections.namedtuple(
+    'MemberRange', ['offset', 'size', 'compress_type'])
+
+# Where a member is in the archive file, as recorded by the member index
+IndexEntry = collections.namedtuple(
+    'IndexEntry', ['header_offset', 'offset', 'compress_size', 'file_size',
+                   'crc', 'compress_type'])
+
+_INDEX_MAGIC = b'Q2IX'
+_INDEX_VERSION = 1
+# magic, version, offset of the central directory, number of entries
+_INDEX_HEADER = struct.Struct('<4sHQI')
+# header offset, data offset, compressed size, size, CRC-32, compression,
+# length of the (UTF-8) name which follows
+_INDEX_ENTRY = struct.Struct('<QQQQIHH')
+
+
+def _index_size(names):
+    return _INDEX_HEADER.size + sum(_INDEX_ENTRY.size + len(name.encode())
+                                    for name in names)
+
+
+def _pack_index(entries, cd_offset):
+    parts = [_INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, cd_offset,
+                                len(entries))]
+    for name, entry in entries.items():
+        name = name.encode()
+        parts.append(_INDEX_ENTRY.pack(*entry, len(name)))
+        parts.append(name)
+    return b''.join(parts)
+
+
+def _unpack_index(data):
+    magic, version, cd_offset, count = _INDEX_HEADER.unpack_from(data)
+    if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+        raise ValueError("Unrecognized member index.")
+
+    entries = collections.OrderedDict()
+    pos = _INDEX_HEADER.size
+    for _ in range(count):
+        *fields, name_len = _INDEX_ENTRY.unpack_from(data, pos)
+        pos += _INDEX_ENTRY.size
+        entries[data[pos:pos + name_len].decode()] = IndexEntry(*fields)
+        pos += name_len
+    return cd_offset, entries
+
+
+def _diff_checksums(exp, obs):
+    obs_keys = set(obs)
+    exp_keys = set(exp)
+
+    added = {x: obs[x] for x in obs_keys - exp_keys}
+    removed = {x: exp[x] for x in exp_keys - obs_keys}
+    changed = {x: (exp[x], obs[x]) for x in exp_keys & obs_keys
+               if exp[x] != obs[x]}
+
+    return ChecksumDiff(added=added, removed=removed, changed=changed)
+
 
 class _Archive:
     """Abstraction layer over the archive filesystem.
@@ -97,7 +173,8 @@ class _Archive:
                              framework_version)
 
     @classmethod
-    def save(cls, source, destination):
+    def save(cls, source, destination, workers=1, policy=None, index=False,
+             exclude=(), extra=None):
         raise NotImplementedError
 
     def __init__(self, path):
@@ -131,8 +208,17 @@ class _Archive:
     def _get_versions(self):
         try:
             with self.open(self.VERSION_FILE) as fh:
-                header, version_line, framework_version_line, eof = \
-                    fh.read().split('\n')
+                text = fh.read()
+        except Exception:
+            # Reported as a malformed VERSION file below
+            text = ''
+        return self._parse_versions(text)
+
+    @classmethod
+    def _parse_versions(cls, text):
+        try:
+            header, version_line, framework_version_line, eof = \
+                text.split('\n')
             if header.strip() != 'QIIME 2':
                 raise Exception()  # GOTO except Exception
             version = version_line.split(':')[1].strip()
@@ -149,40 +235,585 @@ class _Archive:
     def open(self, relpath):
         raise NotImplementedError
 
-    def mount(self, filepath):
+    def checksum_members(self, algorithm='md5', workers=1):
         raise NotImplementedError
 
+    def mount(self, filepath, lazy=False):
+        raise NotImplementedError
+
+    def materialize(self, filepath, relpath):
+        raise NotImplementedError
+
+
+# Deflate can only look back this many bytes, so a larger dictionary is a
+# waste of time.
+_DEFLATE_WINDOW = 2 ** 15
+
+
+def _deflate(data, zdict, final, level):
+    # Negative window bits produce a raw deflate stream, which is what zip
+    # files store.
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    mode = zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+    return compressor.compress(data) + compressor.flush(mode)
+
+
+# Header ID and size of the extra field used to pad local file headers
+_ALIGN_FIELD_ID = 0xD935
+_ALIGN_FIELD_SIZE = 4
+
+
+class _ZipWriter:
+    """Writes a zip file whose members may already be deflated.
+
+    zipfile has no API for writing data which was compressed elsewhere (e.g.
+    in chunks on a thread pool), so the local headers, member data, and
+    central directory are written here, using ZipInfo for the header layout.
+    Members are written one at a time to a seekable `fh`: the local header is
+    written with placeholder sizes, which are filled in once the member is
+    finished.
+
+    """
+    def __init__(self, fh):
+        self._fh = fh
+        self._current = None
+        self.infolist = []
+
+    def start(self, zinfo):
+        """Begin writing the member `zinfo` at the current position."""
+        if self._current is not None:
+            raise ValueError("Cannot start %r while %r is being written."
+                             % (zinfo.filename, self._current[0].filename))
+        if not hasattr(zinfo, 'file_size'):
+            zinfo.file_size = 0
+        zinfo.CRC = zinfo.compress_size = 0
+        zinfo.flag_bits = 0x00
+        if not zinfo.external_attr:
+            zinfo.external_attr = 0o600 << 16  # permissions: ?rw-------
+        # Compressed data can be larger than the uncompressed data
+        zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        zinfo.header_offset = self._fh.tell()
+        self._fh.write(zinfo.FileHeader(zip64))
+        self._current = (zinfo, zip64, 0)
+
+    def write(self, data, compressed=None):
+        """Add `data` to the current member.
+
+        `compressed` is `data` as a raw deflate stream, which is required for
+        deflated members and is written in place of `data`.
+
+        """
+        zinfo, zip64, size = self._current
+        if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+            if compressed is None:
+                raise ValueError("Data for the deflated member %r must "
+                                 "already be compressed." % zinfo.filename)
+        else:
+            compressed = data
+        zinfo.CRC = zlib.crc32(data, zinfo.CRC) & 0xffffffff
+        zinfo.compress_size += len(compressed)
+        self._fh.write(compressed)
+        self._current = (zinfo, zip64, size + len(data))
+
+    def finish(self):
+        """Fill in the local header of the current member."""
+        zinfo, zip64, size = self._current
+        self._current = None
+        zinfo.file_size = size
+        if not zip64 and max(size, zinfo.compress_size) > zipfile.ZIP64_LIMIT:
+            raise zipfile.LargeZipFile(
+                "%r grew too large to be written." % zinfo.filename)
+        end = self._fh.tell()
+        self._fh.seek(zinfo.header_offset)
+        self._fh.write(zinfo.FileHeader(zip64))
+        self._fh.seek(end)
+        self.infolist.append(zinfo)
+        return zinfo
+
+    def writestr(self, zinfo_or_arcname, data, level=None):
+        """Write a whole member from `data`, compressing it if needed."""
+        if isinstance(zinfo_or_arcname, zipfile.ZipInfo):
+            zinfo = zinfo_or_arcname
+        else:
+            zinfo = zipfile.ZipInfo(zinfo_or_arcname,
+                                    time.localtime(time.time())[:6])
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if level is None:
+            level = zlib.Z_DEFAULT_COMPRESSION
+        zinfo.file_size = len(data)
+        self.start(zinfo)
+        compressed = None
+        if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+            compressed = _deflate(data, None, True, level)
+        self.write(data, compressed)
+        return self.finish()
+
+    def close(self):
+        """Write the central directory and the end of central directory."""
+        start = self._fh.tell()
+        for zinfo in self.infolist:
+            self._fh.write(self._central_directory_entry(zinfo))
+
+        end = self._fh.tell()
+        count, size, offset = len(self.infolist), end - start, start
+        if (count > zipfile.ZIP_FILECOUNT_LIMIT or
+                offset > zipfile.ZIP64_LIMIT or size > zipfile.ZIP64_LIMIT):
+            self._fh.write(struct.pack(
+                zipfile.structEndArchive64, zipfile.stringEndArchive64,
+                44, 45, 45, 0, 0, count, count, size, offset))
+            self._fh.write(struct.pack(
+                zipfile.structEndArchive64Locator,
+                zipfile.stringEndArchive64Locator, 0, end, 1))
+            count = min(count, 0xFFFF)
+            size = min(size, 0xFFFFFFFF)
+            offset = min(offset, 0xFFFFFFFF)
+        self._fh.write(struct.pack(
+            zipfile.structEndArchive, zipfile.stringEndArchive,
+            0, 0, count, count, size, offset, 0))
+
+    @classmethod
+    def _central_directory_entry(cls, zinfo):
+        # The same record ZipFile writes when it is closed
+        dt = zinfo.date_time
+        dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
+        dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
+
+        zip64 = []
+        file_size, compress_size = zinfo.file_size, zinfo.compress_size
+        if max(file_size, compress_size) > zipfile.ZIP64_LIMIT:
+            zip64.extend([file_size, compress_size])
+            file_size = compress_size = 0xffffffff
+        header_offset = zinfo.header_offset
+        if header_offset > zipfile.ZIP64_LIMIT:
+            zip64.append(header_offset)
+            header_offset = 0xffffffff
+
+        extra = zinfo.extra
+        min_version = 0
+        if zip64:
+            extra = struct.pack('<HH' + 'Q' * len(zip64),
+                                1, 8 * len(zip64), *zip64) + extra
+            min_version = zipfile.ZIP64_VERSION
+
+        try:
+            filename = zinfo.filename.encode('ascii')
+            flag_bits = zinfo.flag_bits
+        except UnicodeEncodeError:
+            filename = zinfo.filename.encode('utf-8')
+            flag_bits = zinfo.flag_bits | 0x800
+
+        record = struct.pack(
+            zipfile.structCentralDir, zipfile.stringCentralDir,
+            max(min_version, zinfo.create_version), zinfo.create_system,
+            max(min_version, zinfo.extract_version), zinfo.reserved,
+            flag_bits, zinfo.compress_type, dostime, dosdate, zinfo.CRC,
+            compress_size, file_size, len(filename), len(extra),
+            len(zinfo.comment), 0, zinfo.internal_attr, zinfo.external_attr,
+            header_offset)
+        return record + filename + extra + zinfo.comment
+
+
+class _SerialExecutor(concurrent.futures.Executor):
+    """Runs work immediately in the calling thread."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+class CompressionPolicy:
+    """Decides how each member of an archive is compressed.
+
+    Parameters
+    ----------
+    level : int
+        The deflate level (0-9, or -1 for zlib's default) used for members.
+    store_compressed : bool
+        Whether to store members which are already compressed (e.g. gzip
+        or bzip2 files) instead of deflating them a second time.
+    fast_threshold : int, optional
+        Members of at least this many bytes use `fast_level` instead of
+        `level`.
+    fast_level : int
+        The deflate level used for members above `fast_threshold`.
+    align : iterable of str
+        Globs (relative to the archive's root directory) of members which
+        are stored uncompressed with their data aligned to ALIGNMENT bytes in
+        the zip file, so that they can be memory-mapped from the archive.
+
+    """
+    # Leading bytes of gzip, bzip2, xz, zip, and zstd data respectively.
+    COMPRESSED_SIGNATURES = (b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00',
+                             b'PK\x03\x04', b'\x28\xb5\x2f\xfd')
+
+    # The page size of nearly every platform
+    ALIGNMENT = 4096
+
+    def __init__(self, level=zlib.Z_DEFAULT_COMPRESSION, store_compressed=True,
+                 fast_threshold=None, fast_level=1, align=()):
+        if level is None:
+            level = zlib.Z_DEFAULT_COMPRESSION
+        if not -1 <= level <= 9:
+            raise ValueError("Compression level must be between -1 and 9, "
+                             "not %r." % level)
+        self.level = level
+        self.store_compressed = store_compressed
+        self.fast_threshold = fast_threshold
+        self.fast_level = fast_level
+        self.align = tuple(align)
+
+    def is_compressed(self, head):
+        return head.startswith(self.COMPRESSED_SIGNATURES)
+
+    def is_aligned(self, relpath):
+        return any(fnmatch.fnmatchcase(relpath, pattern)
+                   for pattern in self.align)
+
+    def choose(self, head, size, relpath=''):
+        """Return (compress_type, level) for a member.
+
+        `head` is the first chunk of the member, `size` is its total size
+        in bytes, and `relpath` is its path relative to the root directory.
+
+        """
+        if self.is_aligned(relpath):
+            return zipfile.ZIP_STORED, None
+        if self.level == 0 or (self.store_compressed and
+                               self.is_compressed(head)):
+            return zipfile.ZIP_STORED, None
+        if self.fast_threshold is not None and size >= self.fast_threshold:
+            return zipfile.ZIP_DEFLATED, self.fast_level
+        return zipfile.ZIP_DEFLATED, self.level
+
 
 class _ZipArchive(_Archive):
     """A specific variant of Archive which deals with ZIP64 files."""
+    # Amount of uncompressed data in each unit of work given to an executor
+    CHUNK_SIZE = 2 ** 20
+    # Hidden, so it is never mistaken for the root directory
+    INDEX_FILE = '.qiime2-index'
 
     @classmethod
     def is_archive_type(cls, path):
         return zipfile.is_zipfile(str(path))
 
     @classmethod
-    def save(cls, source, destination):
-        with zipfile.ZipFile(str(destination), mode='w',
-                             compression=zipfile.ZIP_DEFLATED,
-                             allowZip64=True) as zf:
-            for root, dirs, files in os.walk(str(source)):
-                # Prune hidden directories from traversal. Strategy modified
-                # from http://stackoverflow.com/a/13454267/3776794
-                dirs[:] = [d for d in dirs if not d.startswith('.')]
+    def save(cls, source, destination, workers=1, policy=None, index=False,
+             exclude=(), extra=None):
+        """Write `source` to a zip file at `destination`.
+
+        When `workers` is greater than one (or None, meaning the number of
+        CPUs), members are compressed concurrently on that many threads.
+        `policy` is a CompressionPolicy deciding how each member is stored.
+        When `index` is true, the first member of the zip file is an index of
+        where every other member is (see `INDEX_FILE`). Files in `exclude` are
+        left out and `extra` maps the names of additional files to their
+        text, both relative to the root (which `source` must then be the only
+        one of).
+
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if policy is None:
+            policy = CompressionPolicy()
+
+        exclude = set(exclude)
+        members = [(abspath, arcname)
+                   for abspath, arcname in cls._iter_members(source)
+                   if cls._root_relpath(arcname) not in exclude]
+        root = members[0][1].split('/', 1)[0] if members else None
+        if extra is None:
+            extra = {}
+        if workers == 1:
+            executor = _SerialExecutor()
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers)
+
+        entries = collections.OrderedDict()
+        with open(str(destination), 'w+b') as fh, executor:
+            zf = _ZipWriter(fh)
+            if index:
+                names = [arcname for _, arcname in members]
+                names.extend('%s/%s' % (root, relpath) for relpath in extra)
+                # The offsets aren't known until everything is written, so
+                # reserve the space now and fill it in at the end.
+                index_info = zipfile.ZipInfo(cls.INDEX_FILE)
+                index_info.compress_type = zipfile.ZIP_STORED
+                zf.writestr(index_info, bytes(_index_size(names)))
+
+            chunks = cls._compress_chunks(executor, members, policy,
+                                          backlog=2 * workers)
+            zinfo = None
+            for idx, compress_type, data, compressed, final in chunks:
+                if zinfo is None:
+                    abspath, arcname = members[idx]
+                    zinfo = zipfile.ZipInfo.from_file(abspath, arcname)
+                    zinfo.compress_type = compress_type
+                    aligned = policy.is_aligned(cls._root_relpath(arcname))
+                    if aligned:
+                        cls._align(fh, zinfo, policy.ALIGNMENT)
+                    zf.start(zinfo)
+
+                zf.write(data, compressed)
+                if final:
+                    zf.finish()
+                    if aligned:
+                        # The padding only matters in the local header, so
+                        # keep it out of the central directory.
+                        zinfo.extra = b''
+                    entries[arcname] = cls._index_entry(fh, zinfo)
+                    zinfo = None
+
+            for relpath, text in extra.items():
+                zinfo = zf.writestr('%s/%s' % (root, relpath), text)
+                entries[zinfo.filename] = cls._index_entry(fh, zinfo)
+
+            if index:
+                cls._write_index(fh, index_info, entries)
+            zf.close()
 
-                for file in files:
-                    if file.startswith('.'):
-                        continue
+    @classmethod
+    def _index_entry(cls, fh, zinfo):
+        # Members are written one after another, so the data of the member
+        # which was just closed ends where the next one will begin.
+        return IndexEntry(zinfo.header_offset,
+                          fh.tell() - zinfo.compress_size,
+                          zinfo.compress_size, zinfo.file_size, zinfo.CRC,
+                          zinfo.compress_type)
+
+    @classmethod
+    def _write_index(cls, fh, index_info, entries):
+        end = fh.tell()
+        data = _pack_index(entries, end)
+        crc = zlib.crc32(data) & 0xffffffff
+        fh.seek(index_info.header_offset)
+        header = fh.read(zipfile.sizeFileHeader)
+        _, _, _, _, _, _, _, _, _, _, name_len, extra_len = struct.unpack(
+            zipfile.structFileHeader, header)
+        # Patch the CRC-32 of the local header and then the placeholder data.
+        # The central directory is written from `index_info` afterwards.
+        fh.seek(index_info.header_offset + 14)
+        fh.write(struct.pack('<L', crc))
+        fh.seek(index_info.header_offset + zipfile.sizeFileHeader +
+                name_len + extra_len)
+        fh.write(data)
+        fh.seek(end)
+        index_info.CRC = crc
+
+    @classmethod
+    def _root_relpath(cls, arcname):
+        return arcname.split('/', 1)[1] if '/' in arcname else ''
+
+    @classmethod
+    def _align(cls, fh, zinfo, alignment):
+        """Pad the local header of `zinfo` so its data starts on a boundary.
+
+        The padding is an extra field using the same header ID as Android's
+        zipalign, which every reader skips.
+
+        """
+        zinfo.CRC = zinfo.compress_size = 0
+        zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        end = fh.tell() + len(zinfo.FileHeader(zip64)) + _ALIGN_FIELD_SIZE
+        padding = -end % alignment
+        zinfo.extra += struct.pack('<HH', _ALIGN_FIELD_ID, padding)
+        zinfo.extra += b'\0' * padding
+
+    @classmethod
+    def _iter_members(cls, source):
+        """Yield (abspath, arcname) of everything to save in a stable order."""
+        for root, dirs, files in os.walk(str(source)):
+            # Prune hidden directories from traversal. Strategy modified
+            # from http://stackoverflow.com/a/13454267/3776794
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+
+            for file in sorted(files):
+                if file.startswith('.'):
+                    continue
+
+                abspath = pathlib.Path(root) / file
+                relpath = abspath.relative_to(source)
 
-                    abspath = pathlib.Path(root) / file
-                    relpath = abspath.relative_to(source)
+                yield str(abspath), cls._as_zip_path(relpath)
 
-                    zf.write(str(abspath), arcname=cls._as_zip_path(relpath))
+    @classmethod
+    def _compress_chunks(cls, executor, members, policy, backlog):
+        """Compress members on `executor`, yielding chunks in order.
+
+        Each file is split into chunks which are deflated independently (using
+        the tail of the previous chunk as a dictionary so the ratio doesn't
+        suffer). The raw deflate streams of every chunk but the last end on a
+        byte boundary and are not marked final, so concatenating them in
+        order produces a valid stream for the whole file. This is the same
+        strategy as pigz.
+
+        Yields (member index, compress type, data, compressed data or None if
+        stored, is final chunk). At most `backlog` chunks are in flight at a
+        time, which bounds memory use.
+
+        """
+        pending = collections.deque()
+        for idx, (abspath, _) in enumerate(members):
+            with open(abspath, 'rb') as fh:
+                zdict = None
+                data = fh.read(cls.CHUNK_SIZE)
+                compress_type, level = policy.choose(
+                    data, os.fstat(fh.fileno()).st_size,
+                    cls._root_relpath(members[idx][1]))
+                while True:
+                    next_data = fh.read(cls.CHUNK_SIZE)
+                    final = not next_data
+                    if compress_type == zipfile.ZIP_STORED:
+                        future = None
+                    else:
+                        future = executor.submit(_deflate, data, zdict, final,
+                                                 level)
+                    pending.append((idx, compress_type, data, future, final))
+
+                    while len(pending) > backlog:
+                        yield cls._resolve_chunk(*pending.popleft())
+
+                    if final:
+                        break
+                    zdict = data[-_DEFLATE_WINDOW:]
+                    data = next_data
+
+        while pending:
+            yield cls._resolve_chunk(*pending.popleft())
+
+    @classmethod
+    def _resolve_chunk(cls, idx, compress_type, data, future, final):
+        compressed = None if future is None else future.result()
+        return idx, compress_type, data, compressed, final
+
+    def __init__(self, path, keep_open=False):
+        # With `keep_open`, the ZipFile is opened (and its central directory
+        # parsed) at most once and then reused by everything that reads from
+        # the archive until `close` is called, after which the file is
+        # reopened as needed.
+        self._zf = None
+        self._keep_open = keep_open
+        self._index = None
+        self._index_read = False
+        try:
+            super().__init__(path)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_zf'] = None
+        state['_keep_open'] = False
+        return state
+
+    def close(self):
+        self._keep_open = False
+        if self._zf is not None:
+            self._zf.close()
+            self._zf = None
+
+    @contextlib.contextmanager
+    def _zipfile(self):
+        if self._zf is None and self._keep_open:
+            self._zf = zipfile.ZipFile(str(self.path), mode='r')
+
+        if self._zf is not None:
+            yield self._zf
+        else:
+            with zipfile.ZipFile(str(self.path), mode='r') as zf:
+                yield zf
+
+    def _get_index(self):
+        """Return the member index as an OrderedDict, or None without one.
+
+        Only the first member and the start of the central directory are
+        read, so this doesn't depend on the number of members.
+
+        """
+        if not self._index_read:
+            try:
+                self._index = self._read_index()
+            except (ValueError, struct.error):
+                # A damaged index isn't fatal, the central directory can
+                # still be used.
+                self._index = None
+            self._index_read = True
+        return self._index
+
+    def _read_index(self):
+        with open(str(self.path), 'rb') as fh:
+            header = fh.read(zipfile.sizeFileHeader)
+            if len(header) < zipfile.sizeFileHeader:
+                return None
+            (signature, _, _, _, compress_type, _, _, crc, compress_size, _,
+             name_len, extra_len) = struct.unpack(zipfile.structFileHeader,
+                                                  header)
+            if signature != zipfile.stringFileHeader or \
+                    fh.read(name_len) != self.INDEX_FILE.encode():
+                return None
+            if compress_type != zipfile.ZIP_STORED:
+                raise ValueError("Member index is compressed.")
+
+            fh.seek(extra_len, io.SEEK_CUR)
+            data = fh.read(compress_size)
+            if zlib.crc32(data) & 0xffffffff != crc:
+                raise ValueError("Bad CRC-32 for the member index.")
+
+            # If the zip file was rewritten by another tool, the index will
+            # no longer point at the central directory.
+            cd_offset, entries = _unpack_index(data)
+            fh.seek(cd_offset)
+            if fh.read(4) != zipfile.stringCentralDir:
+                raise ValueError("Member index is out of date.")
+
+        self._index_names = sorted(entries)
+        return entries
+
+    def _read_member(self, name, entry):
+        with open(str(self.path), 'rb') as fh:
+            fh.seek(entry.header_offset)
+            header = fh.read(zipfile.sizeFileHeader)
+            fields = struct.unpack(zipfile.structFileHeader, header)
+            name_len = fields[10]
+            if (fields[0] != zipfile.stringFileHeader or
+                    fh.read(name_len) != name.encode()):
+                raise zipfile.BadZipFile(
+                    "Bad local header for member %r." % name)
+
+            fh.seek(entry.offset)
+            data = fh.read(entry.compress_size)
+
+        if entry.compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        elif entry.compress_type != zipfile.ZIP_STORED:
+            raise NotImplementedError("Unsupported compression for member %r."
+                                      % name)
+        if zlib.crc32(data) & 0xffffffff != entry.crc:
+            raise zipfile.BadZipFile("Bad CRC-32 for member %r." % name)
+        return data
 
     def relative_iterdir(self, relpath=''):
         relpath = self._as_zip_path(relpath)
+        if self._get_index() is not None:
+            yield from self._indexed_iterdir(relpath)
+            return
+
         seen = set()
-        with zipfile.ZipFile(str(self.path), mode='r') as zf:
+        with self._zipfile() as zf:
             for name in zf.namelist():
                 if name.startswith(relpath):
                     parts = pathlib.PurePosixPath(name).parts
@@ -192,24 +823,187 @@ class _ZipArchive(_Archive):
                             seen.add(result)
                             yield result
 
+    def namelist(self):
+        """Return the name of every member, like ZipFile.namelist."""
+        if self._get_index() is not None:
+            return list(self._index_names)
+        with self._zipfile() as zf:
+            return zf.namelist()
+
+    def _indexed_iterdir(self, relpath):
+        # The same as scanning every name, but each top-level entry is found
+        # with a binary search of the sorted names instead.
+        names = self._index_names
+        idx = bisect.bisect_left(names, relpath)
+        while idx < len(names) and names[idx].startswith(relpath):
+            name = names[idx]
+            result = name.split('/', 1)[0]
+            yield result
+            if '/' in name:
+                # Skip everything else beneath `result`
+                idx = bisect.bisect_left(names, result + '0', idx)
+            else:
+                idx += 1
+
     def open(self, relpath):
         relpath = pathlib.Path(str(self.uuid)) / relpath
-        with zipfile.ZipFile(str(self.path), mode='r') as zf:
+        index = self._get_index()
+        if index is not None:
+            name = self._as_zip_path(relpath)
+            try:
+                entry = index[name]
+            except KeyError:
+                raise KeyError("There is no item named %r in the archive"
+                               % name)
+            return io.TextIOWrapper(
+                io.BytesIO(self._read_member(name, entry)))
+
+        with self._zipfile() as zf:
             # The filehandle will still work even when `zf` is "closed"
             return io.TextIOWrapper(zf.open(self._as_zip_path(relpath)))
 
-    def mount(self, filepath):
+    def checksum_members(self, algorithm='md5', workers=1):
+        """Hash every visible member without extracting the archive.
+
+        Returns the same relative paths and digests as `checksum_directory`
+        would for the extracted root directory.
+
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        root = str(self.uuid) + '/'
+
+        with self._zipfile() as zf:
+            relpaths = collections.OrderedDict()
+            for name in zf.namelist():
+                parts = name[len(root):].split('/')
+                if (not name.startswith(root) or name.endswith('/') or
+                        any(part.startswith('.') for part in parts)):
+                    continue
+                relpaths[name] = os.path.join(*parts)
+
+            def checksum_member(name):
+                digest = hashlib.new(algorithm)
+                with zf.open(name) as fh:
+                    for chunk in iter(lambda: fh.read(self.CHUNK_SIZE), b''):
+                        digest.update(chunk)
+                return digest.hexdigest()
+
+            # Reads from a ZipFile are thread-safe and decompression releases
+            # the GIL, so members are hashed concurrently.
+            if workers == 1:
+                digests = list(map(checksum_member, relpaths))
+            else:
+                with concurrent.futures.ThreadPoolExecutor(
+                        max_workers=workers) as executor:
+                    digests = list(executor.map(checksum_member, relpaths))
+
+        return collections.OrderedDict(zip(relpaths.values(), digests))
+
+    def member_index(self, names=None):
+        """Map member names to the MemberRange of their data.
+
+        When the archive has a member index, it is used directly. Otherwise
+        the central directory only records where each member's local header
+        is, so the local headers of `names` (default: every member) are read
+        to find where the data begins.
+
+        """
+        entries = self._get_index()
+        if entries is not None:
+            if names is None:
+                names = entries
+            return {name: MemberRange(entries[name].offset,
+                                      entries[name].compress_size,
+                                      entries[name].compress_type)
+                    for name in names}
+
+        index = {}
+        with self._zipfile() as zf:
+            infos = zf.infolist()
+            if names is not None:
+                names = set(names)
+                infos = [info for info in infos if info.filename in names]
+
+            with open(str(self.path), 'rb') as fh:
+                for info in infos:
+                    fh.seek(info.header_offset)
+                    header = fh.read(zipfile.sizeFileHeader)
+                    if header[:4] != zipfile.stringFileHeader:
+                        raise zipfile.BadZipFile(
+                            "Bad local header for member %r."
+                            % info.filename)
+                    name_len, extra_len = struct.unpack('<HH', header[26:30])
+                    offset = (info.header_offset + zipfile.sizeFileHeader +
+                              name_len + extra_len)
+                    index[info.filename] = MemberRange(
+                        offset, info.compress_size, info.compress_type)
+
+        return index
+
+    def mount(self, filepath, lazy=False):
         # TODO: use FUSE/MacFUSE/Dokany bindings (many Python bindings are
         # outdated, we may need to take up maintenance/fork)
-        root = self.extract(filepath)
+        if lazy:
+            # Only the files at the root of the archive (VERSION,
+            # metadata.yaml, etc.) are extracted, everything nested is left in
+            # the zip until `materialize` is called for it.
+            root = self._extract_members(
+                filepath, lambda relpath: '/' not in relpath)
+        else:
+            root = self.extract(filepath)
         return ArchiveRecord(root, root / self.VERSION_FILE,
                              self.uuid, self.version, self.framework_version)
 
-    def extract(self, filepath):
+    def materialize(self, filepath, relpath):
+        prefix = self._as_zip_path(relpath) + '/'
+        return self._extract_members(
+            filepath, lambda member: member.startswith(prefix))
+
+    def extract(self, filepath, pattern=None):
+        if pattern is None:
+            return self._extract_members(filepath, lambda relpath: True)
+        return self._extract_members(
+            filepath, lambda relpath: fnmatch.fnmatchcase(relpath, pattern))
+
+    def export(self, relpath, destination, pattern=None):
+        """Copy the files under `relpath` into `destination`.
+
+        Members are decompressed straight into their destination files. When
+        `pattern` is provided, only members whose path relative to `relpath`
+        matches the glob are copied. Returns the paths which were copied.
+
+        """
+        prefix = '%s/%s/' % (self.uuid, self._as_zip_path(relpath))
+        destination = pathlib.Path(destination)
+        exported = []
+        with self._zipfile() as zf:
+            for name in zf.namelist():
+                if not name.startswith(prefix) or name.endswith('/'):
+                    continue
+                member = name[len(prefix):]
+                if pattern is not None and \
+                        not fnmatch.fnmatchcase(member, pattern):
+                    continue
+
+                # Same sanitization as ZipFile.extract, so nothing is written
+                # outside of `destination`.
+                parts = [part for part in member.split('/')
+                         if part not in ('', '.', '..')]
+                target = destination.joinpath(*parts)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                with zf.open(name) as src, target.open('wb') as dst:
+                    shutil.copyfileobj(src, dst, self.CHUNK_SIZE)
+                exported.append(member)
+
+        return exported
+
+    def _extract_members(self, filepath, predicate):
         filepath = pathlib.Path(filepath)
-        with zipfile.ZipFile(str(self.path), mode='r') as zf:
+        root = str(self.uuid) + '/'
+        with self._zipfile() as zf:
             for name in zf.namelist():
-                if name.startswith(str(self.uuid)):
+                if name.startswith(root) and predicate(name[len(root):]):
                     # extract removes `..` components, so as long as we extract
                     # into `filepath`, the path won't go backwards.
                     zf.extract(name, path=str(filepath))
@@ -228,7 +1022,7 @@ class _ZipArchive(_Archive):
 
 
 class Archiver:
-    CURRENT_FORMAT_VERSION = '5'
+    CURRENT_FORMAT_VERSION = '9'
     CURRENT_ARCHIVE = _ZipArchive
     _FORMAT_REGISTRY = {
         # NOTE: add more archive formats as things change
@@ -237,7 +1031,11 @@ class Archiver:
         '2': 'qiime2.core.archive.format.v2:ArchiveFormat',
         '3': 'qiime2.core.archive.format.v3:ArchiveFormat',
         '4': 'qiime2.core.archive.format.v4:ArchiveFormat',
-        '5': 'qiime2.core.archive.format.v5:ArchiveFormat'
+        '5': 'qiime2.core.archive.format.v5:ArchiveFormat',
+        '6': 'qiime2.core.archive.format.v6:ArchiveFormat',
+        '7': 'qiime2.core.archive.format.v7:ArchiveFormat',
+        '8': 'qiime2.core.archive.format.v8:ArchiveFormat',
+        '9': 'qiime2.core.archive.format.v9:ArchiveFormat'
     }
 
     @classmethod
@@ -258,12 +1056,17 @@ class Archiver:
         if not filepath.exists():
             raise ValueError("%s does not exist." % filepath)
 
-        if _ZipArchive.is_archive_type(filepath):
-            archive = _ZipArchive(filepath)
-        else:
+        if not cls.CURRENT_ARCHIVE.is_archive_type(filepath):
             raise ValueError("%s is not a QIIME archive." % filepath)
 
-        return archive
+        # Parsing the zip's central directory is the expensive part of
+        # reading an archive without a member index, so the archive keeps
+        # the file open after doing it once (and closes it when used as a
+        # context manager).
+        try:
+            return cls.CURRENT_ARCHIVE(filepath, keep_open=True)
+        except zipfile.BadZipFile:
+            raise ValueError("%s is not a QIIME archive." % filepath)
 
     @classmethod
     def _futuristic_archive_error(cls, filepath, archive):
@@ -275,37 +1078,136 @@ class Archiver:
 
     @classmethod
     def peek(cls, filepath):
-        archive = cls.get_archive(filepath)
-        Format = cls.get_format_class(archive.version)
-        if Format is None:
-            cls._futuristic_archive_error(filepath, archive)
-        # NOTE: in the future, we may want to manipulate the results so that
-        # older formats provide the "new" API even if they don't support it.
-        # e.g. a new format has a new property that peek should describe. We
-        # add some compatability code here to return a default for that
-        # property on older formats.
-        return Format.load_metadata(archive)
+        with cls.get_archive(filepath) as archive:
+            Format = cls.get_format_class(archive.version)
+            if Format is None:
+                cls._futuristic_archive_error(filepath, archive)
+            # NOTE: in the future, we may want to manipulate the results so
+            # that older formats provide the "new" API even if they don't
+            # support it. e.g. a new format has a new property that peek
+            # should describe. We add some compatability code here to return a
+            # default for that property on older formats.
+            return Format.load_metadata(archive)
 
     @classmethod
-    def extract(cls, filepath, dest):
-        archive = cls.get_archive(filepath)
-        # Format really doesn't matter, the archive knows how to extract so
-        # that is sufficient, furthermore it would suck if something was wrong
-        # with an archive's format and extract failed to actually extract.
-        return str(archive.extract(dest))
+    def extract(cls, filepath, dest, pattern=None):
+        with cls.get_archive(filepath) as archive:
+            # Format really doesn't matter, the archive knows how to extract
+            # so that is sufficient, furthermore it would suck if something
+            # was wrong with an archive's format and extract failed to
+            # actually extract.
+            root = archive.extract(dest, pattern=pattern)
+        if pattern is not None and not root.exists():
+            raise ValueError("No members of %s match %r."
+                             % (filepath, pattern))
+        return str(root)
 
     @classmethod
-    def load(cls, filepath):
-        archive = cls.get_archive(filepath)
-        Format = cls.get_format_class(archive.version)
-        if Format is None:
-            cls._futuristic_archive_error(filepath, archive)
+    def validate_archive(cls, filepath, workers=1):
+        """Compare the members of an archive to its checksums.
+
+        Unlike `validate_checksums`, nothing is extracted: members are
+        decompressed and hashed in memory, on `workers` threads (None will
+        use one per CPU). Returns a ChecksumDiff, which is empty for formats
+        without checksums.
+
+        """
+        with cls.get_archive(filepath) as archive:
+            Format = cls.get_format_class(archive.version)
+            if Format is None:
+                cls._futuristic_archive_error(filepath, archive)
+            if not issubclass(Format, cls.get_format_class('5')):
+                return ChecksumDiff({}, {}, {})
+
+            with archive.open(Format.CHECKSUM_FILE) as fh:
+                algorithm, exp = read_checksum_file(fh)
+            obs = archive.checksum_members(algorithm, workers=workers)
+            obs.pop(Format.CHECKSUM_FILE, None)
+
+            manifest = getattr(Format, 'BLOB_MANIFEST', None)
+            if manifest is not None and manifest in obs:
+                # Files in the blob store aren't part of a thin archive
+                del obs[manifest]
+                with archive.open(manifest) as fh:
+                    _, blobs = read_checksum_file(fh)
+                for relpath in blobs:
+                    exp.pop(relpath, None)
+
+        return _diff_checksums(exp, obs)
 
-        path = cls._make_temp_path()
-        rec = archive.mount(path)
+    @classmethod
+    def load(cls, filepath, lazy=False):
+        with cls.get_archive(filepath) as archive:
+            Format = cls.get_format_class(archive.version)
+            if Format is None:
+                cls._futuristic_archive_error(filepath, archive)
+
+            path = cls._make_temp_path()
+            cache = None if lazy else ArchiveCache.from_environment()
+            checksum_file = getattr(Format, 'CHECKSUM_FILE', None)
+            if cache is not None and checksum_file is not None:
+                root = cache.mount(archive, checksum_file, path)
+                rec = ArchiveRecord(root, root / archive.VERSION_FILE,
+                                    archive.uuid, archive.version,
+                                    archive.framework_version)
+            else:
+                rec = archive.mount(path, lazy=lazy)
+
+        manifest = getattr(Format, 'BLOB_MANIFEST', None)
+        thin = manifest is not None and (rec.root / manifest).exists()
+        if thin:
+            cls._link_blobs(filepath, rec.root, manifest)
+
+        if lazy:
+            # The data and provenance directories stay inside of the zip until
+            # something asks for a real path to them.
+            unmounted = [getattr(Format, name)
+                         for name in ('DATA_DIR', 'PROVENANCE_DIR')
+                         if hasattr(Format, name)]
+            archiver = cls(path, Format(rec), archive=archive,
+                           unmounted=unmounted)
+            if thin:
+                # Part of the data directory was linked from the blob store,
+                # so the zip only has the rest of it.
+                archiver._materialize(Format.DATA_DIR)
+            return archiver
 
         return cls(path, Format(rec))
 
+    @classmethod
+    def _link_blobs(cls, filepath, root, manifest):
+        store = BlobStore.from_environment()
+        if store is None:
+            raise ValueError(
+                "%s is a thin archive, its data can only be loaded from a "
+                "blob store (set %s)." % (filepath, BlobStore.ROOT_ENVVAR))
+
+        with (root / manifest).open() as fh:
+            algorithm, blobs = read_checksum_file(fh)
+        for relpath, digest in blobs.items():
+            try:
+                store.link(digest, root / relpath, algorithm)
+            except KeyError as e:
+                raise ValueError("Cannot load %s: %s" % (filepath, e.args[0]))
+
+        # Now that the data is in place this is an ordinary archive, so it
+        # can be saved like one.
+        (root / manifest).unlink()
+
+    @classmethod
+    def rehydrate(cls, filepath, destination, workers=1):
+        """Save a self-contained copy of the archive at `filepath`.
+
+        Files which a thin archive left in the blob store are embedded in
+        the copy at `destination`, so it can be shared.
+
+        """
+        archiver = cls.load(filepath, lazy=True)
+        try:
+            archiver.save(destination, workers=workers)
+        finally:
+            archiver._destructor()
+
     @classmethod
     def from_data(cls, type, format, data_initializer, provenance_capture):
         path = cls._make_temp_path()
@@ -317,9 +1219,89 @@ class Archiver:
 
         return cls(path, Format(rec))
 
-    def __init__(self, path, fmt):
+    def __init__(self, path, fmt, archive=None, unmounted=()):
         self.path = path
         self._fmt = fmt
+        # When lazily loaded, `archive` is the source zip and `unmounted`
+        # are the top-level directories which have not been extracted yet.
+        self._archive = archive
+        self._unmounted = set(unmounted)
+        self._mount_lock = threading.Lock()
+        self.path._update_usage()
+
+    def __getstate__(self):
+        # Whoever receives a pickled archiver cannot assume the source zip is
+        # still around (or even on the same filesystem), so mount everything.
+        self._materialize()
+        state = self.__dict__.copy()
+        del state['_mount_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._mount_lock = threading.Lock()
+
+    def handoff(self):
+        """Return an ArchiveHandle to share this archive with another process.
+
+        The receiver (see `attach`) uses the extracted archive in place, so
+        this archiver must outlive the receiver's use of it, unless its
+        directory is given up with `release`.
+
+        """
+        self._materialize()
+        return ArchiveHandle(str(self.path), str(self.uuid))
+
+    def release(self):
+        """Give up the archive's directory without removing it."""
+        self.path._detach()
+
+    @classmethod
+    def attach(cls, handle, owned=False):
+        """Open the extracted archive referred to by an ArchiveHandle.
+
+        When `owned` is True, the directory is removed along with the new
+        archiver, so whoever created it must have released it. Otherwise the
+        directory is left alone.
+
+        """
+        path = qiime2.core.path.ArchivePath(handle.path)
+        if not owned:
+            # The directory still belongs to whoever handed it off, and only
+            # counts against their scratch budget (this path was never
+            # tracked, so there is nothing to release).
+            path._destructor.detach()
+
+        root = path / handle.uuid
+        version_fp = root / cls.CURRENT_ARCHIVE.VERSION_FILE
+        version, framework_version = cls.CURRENT_ARCHIVE._parse_versions(
+            version_fp.read_text())
+        rec = ArchiveRecord(root, version_fp, handle.uuid, version,
+                            framework_version)
+        Format = cls.get_format_class(version)
+        if Format is None:
+            cls._futuristic_archive_error(handle.path, rec)
+        return cls(path, Format(rec))
+
+    @property
+    def is_lazy(self):
+        return bool(self._unmounted)
+
+    def _materialize(self, *relpaths):
+        """Extract unmounted directories so that they exist on disk.
+
+        With no arguments, every remaining directory is extracted.
+        """
+        if not self._unmounted:
+            return
+        with self._mount_lock:
+            if not relpaths:
+                relpaths = tuple(self._unmounted)
+            for relpath in relpaths:
+                if relpath in self._unmounted:
+                    self._archive.materialize(self.path, relpath)
+                    self._unmounted.remove(relpath)
+            self.path._update_usage()
 
     @property
     def uuid(self):
@@ -335,41 +1317,115 @@ class Archiver:
 
     @property
     def data_dir(self):
+        self._materialize(self._fmt.DATA_DIR)
         return self._fmt.data_dir
 
     @property
     def root_dir(self):
+        self._materialize()
         return self._fmt.path
 
     @property
     def provenance_dir(self):
-        return getattr(self._fmt, 'provenance_dir', None)
+        if not hasattr(self._fmt, 'provenance_dir'):
+            return None
+        self._materialize(self._fmt.PROVENANCE_DIR)
+        return self._fmt.provenance_dir
 
     @property
     def citations(self):
+        if hasattr(self._fmt, 'PROVENANCE_DIR'):
+            self._materialize(self._fmt.PROVENANCE_DIR)
         return getattr(self._fmt, 'citations', cite.Citations())
 
-    def save(self, filepath):
-        self.CURRENT_ARCHIVE.save(self.path, filepath)
+    def save(self, filepath, workers=1, compresslevel=None, align=(),
+             blob_store=None):
+        """Write the archive to a zip file at `filepath`.
+
+        When `blob_store` is provided, files in the data directory are added
+        to it and left out of the zip file, making a thin archive.
+
+        """
+        self._materialize()
+        exclude, extra = (), None
+        if blob_store is not None:
+            exclude, extra = self._store_blobs(blob_store)
+
+        # `align` is relative to the data directory
+        align = ['%s/%s' % (self._fmt.DATA_DIR, pattern) for pattern in align]
+        policy = CompressionPolicy(
+            level=compresslevel,
+            fast_threshold=getattr(self._fmt, 'FAST_COMPRESSION_THRESHOLD',
+                                   None),
+            align=align)
+        self.CURRENT_ARCHIVE.save(
+            self.path, filepath, workers=workers, policy=policy,
+            index=getattr(self._fmt, 'MEMBER_INDEX', False),
+            exclude=exclude, extra=extra)
+
+    def _store_blobs(self, blob_store):
+        manifest = getattr(self._fmt, 'BLOB_MANIFEST', None)
+        if manifest is None:
+            raise ValueError("Archive %s predates thin archives, so it cannot "
+                             "be saved as one." % self.uuid)
+
+        # The checksums were computed when the archive was written, and are
+        # verified as each file is added.
+        with (self._fmt.path / self._fmt.CHECKSUM_FILE).open() as fh:
+            algorithm, checksums = read_checksum_file(fh)
+        blobs = blob_store.add_directory(self._fmt.path, checksums, algorithm,
+                                         relpath=self._fmt.DATA_DIR)
+
+        fh = io.StringIO()
+        write_checksum_file(fh, blobs, algorithm)
+        return list(blobs), {manifest: fh.getvalue()}
+
+    def export_data(self, output_dir, pattern=None):
+        """Copy the data directory (or the files matching `pattern`).
+
+        `pattern` is a glob matched against paths relative to the data
+        directory. When the data hasn't been extracted from the source
+        archive yet, matching members are copied straight out of the archive
+        instead.
+
+        """
+        if self._fmt.DATA_DIR in self._unmounted:
+            exported = self._archive.export(self._fmt.DATA_DIR, output_dir,
+                                            pattern=pattern)
+        elif pattern is None:
+            qiime2.core.path.clone_tree(self.data_dir, output_dir, fresh=True)
+            exported = None
+        else:
+            exported = []
+            data_dir = str(self.data_dir)
+            for root, _, files in os.walk(data_dir):
+                for file in files:
+                    src = os.path.join(root, file)
+                    relpath = pathlib.Path(os.path.relpath(src, data_dir))
+                    if not fnmatch.fnmatchcase(relpath.as_posix(), pattern):
+                        continue
+                    dst = pathlib.Path(output_dir) / relpath
+                    dst.parent.mkdir(parents=True, exist_ok=True)
+                    qiime2.core.path.clone_file(src, dst, fresh=True)
+                    exported.append(relpath.as_posix())
+
+        if pattern is not None and not exported:
+            raise ValueError("No files in the data directory of %s match %r."
+                             % (self.uuid, pattern))
 
     def validate_checksums(self):
         if not isinstance(self._fmt, self.get_format_class('5')):
             return ChecksumDiff({}, {}, {})
 
-        obs = dict(x for x in md5sum_directory(str(self.root_dir)).items()
+        self._materialize()
+
+        with (self.root_dir / self._fmt.CHECKSUM_FILE).open() as fh:
+            algorithm, exp = read_checksum_file(fh)
+        obs = dict(x for x in checksum_directory(str(self.root_dir),
+                                                 algorithm).items()
                    if x[0] != self._fmt.CHECKSUM_FILE)
-        exp = dict(from_checksum_format(line) for line in
-                   (self.root_dir / self._fmt.CHECKSUM_FILE).open().readlines()
-                   )
-        obs_keys = set(obs)
-        exp_keys = set(exp)
-
-        added = {x: obs[x] for x in obs_keys - exp_keys}
-        removed = {x: exp[x] for x in exp_keys - obs_keys}
-        changed = {x: (exp[x], obs[x]) for x in exp_keys & obs_keys
-                   if exp[x] != obs[x]}
-
-        return ChecksumDiff(added=added, removed=removed, changed=changed)
+
+        return _diff_checksums(exp, obs)
 
     @property
     def _destructor(self):
@@ -0,0 +1,128 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2019, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+import hashlib
+import os
+import pathlib
+import stat
+import tempfile
+
+import qiime2.core.path
+
+
+class BlobStore:
+    """A directory of files addressed by their checksum.
+
+    Thin archives leave the files of their data directory out of the zip and
+    list them (with their checksums) in a manifest instead. Loading a thin
+    archive links each file back into place from the store, so byte-identical
+    data shared by many archives is only stored once.
+
+    Blobs are written to a hidden file and then atomically renamed into
+    place, after which they are never modified (they are made read-only).
+
+    Example filesystem::
+
+        <store root>/
+        |--- .adding-<random>
+        !--- md5/
+            !--- d4/
+                !--- d41d8cd98f00b204e9800998ecf8427e
+
+    The store is configured by the environment: ``QIIME2_BLOB_STORE`` is the
+    root directory.
+
+    """
+    ROOT_ENVVAR = 'QIIME2_BLOB_STORE'
+    # Smaller files aren't worth the extra file in the store
+    MIN_SIZE = 2 ** 12
+    BUFFER_SIZE = 2 ** 20
+
+    @classmethod
+    def from_environment(cls):
+        root = os.environ.get(cls.ROOT_ENVVAR)
+        if not root:
+            return None
+        return cls(root)
+
+    def __init__(self, root, min_size=None):
+        self.root = pathlib.Path(root)
+        self.min_size = self.MIN_SIZE if min_size is None else min_size
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, digest, algorithm='md5'):
+        return self.root / algorithm / digest[:2] / digest
+
+    def add(self, filepath, digest, algorithm='md5'):
+        """Add the file at `filepath`, whose checksum is `digest`.
+
+        The file is hashed as it is copied into the store and a ValueError is
+        raised if it doesn't match `digest`, so a stale checksum can never
+        put the wrong contents at an address. Nothing is copied when the
+        store already has the blob.
+
+        """
+        blob = self.path(digest, algorithm)
+        if blob.exists():
+            return blob
+
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        fd, staging = tempfile.mkstemp(prefix='.adding-', dir=str(self.root))
+        try:
+            observed = hashlib.new(algorithm)
+            with open(str(filepath), 'rb') as src, \
+                    os.fdopen(fd, 'wb') as dst:
+                for chunk in iter(lambda: src.read(self.BUFFER_SIZE), b''):
+                    observed.update(chunk)
+                    dst.write(chunk)
+            if observed.hexdigest() != digest:
+                raise ValueError("%s does not match its checksum (%s: %s)."
+                                 % (filepath, algorithm, digest))
+
+            os.chmod(staging, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            # If another process added the same blob first, this replaces it
+            # with identical contents.
+            os.replace(staging, str(blob))
+        finally:
+            if os.path.exists(staging):
+                os.unlink(staging)
+        return blob
+
+    def add_directory(self, root, checksums, algorithm='md5', relpath=''):
+        """Add files of `root` under `relpath` which are at least `min_size`.
+
+        `checksums` maps paths relative to `root` to their digests, as
+        written to the checksum file of an archive. Returns the subset of
+        `checksums` which were added.
+
+        """
+        root = pathlib.Path(root)
+        prefix = relpath + '/' if relpath else ''
+        added = collections.OrderedDict()
+        for path, digest in checksums.items():
+            if not path.startswith(prefix):
+                continue
+            filepath = root / path
+            if filepath.stat().st_size < self.min_size:
+                continue
+            self.add(filepath, digest, algorithm)
+            added[path] = digest
+        return added
+
+    def link(self, digest, destination, algorithm='md5'):
+        """Put the blob whose checksum is `digest` at `destination`."""
+        blob = self.path(digest, algorithm)
+        if not blob.exists():
+            raise KeyError("Blob store %s does not contain %s:%s."
+                           % (self.root, algorithm, digest))
+        destination = pathlib.Path(destination)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        # Blobs are read-only and archives are never modified, so they can
+        # share storage.
+        return qiime2.core.path.clone_file(blob, destination, immutable=True)
@@ -0,0 +1,294 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2019, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+import errno
+import hashlib
+import os
+import pathlib
+import shutil
+import stat
+import tempfile
+import uuid
+
+import yaml
+
+import qiime2
+import qiime2.core.path
+from qiime2.core.archive.provenance import ProvenanceDumper, MetadataPath
+
+
+class _DirectoryCache:
+    """Entries in a directory, evicted least recently used first.
+
+    Subclasses name the environment variables which configure them. Every
+    entry has a `SIZE_FILE` recording how many bytes it holds, and the
+    modification time of the entry tracks its recency.
+
+    """
+    ROOT_ENVVAR = None
+    BUDGET_ENVVAR = None
+    SIZE_FILE = '.size'
+
+    @classmethod
+    def from_environment(cls):
+        root = os.environ.get(cls.ROOT_ENVVAR)
+        if not root:
+            return None
+
+        budget = os.environ.get(cls.BUDGET_ENVVAR)
+        if budget:
+            budget = int(budget)
+        else:
+            budget = None
+
+        return cls(root, budget=budget)
+
+    def __init__(self, root, budget=None):
+        self.root = pathlib.Path(root)
+        self.budget = budget
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _publish(self, staging, entry, size):
+        (staging / self.SIZE_FILE).write_text(str(size))
+        try:
+            os.rename(str(staging), str(entry))
+        except OSError as e:
+            # Someone else populated the entry first, which is fine as the
+            # contents are equivalent.
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+
+    def entries(self):
+        """Return cache entries, least recently used first."""
+        entries = []
+        for entry in self.root.iterdir():
+            if entry.name.startswith('.'):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, entry))
+            except FileNotFoundError:
+                # Evicted by another process
+                continue
+        return [entry for _, entry in sorted(entries)]
+
+    def size(self, entry):
+        try:
+            return int((entry / self.SIZE_FILE).read_text())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def evict(self, keep=None):
+        """Evict least recently used entries until the budget is satisfied."""
+        entries = self.entries()
+        total = sum(self.size(entry) for entry in entries)
+        for entry in entries:
+            if self.budget is None or total <= self.budget:
+                break
+            if entry == keep:
+                continue
+
+            size = self.size(entry)
+            # Rename first so that other processes never observe a partially
+            # deleted entry.
+            graveyard = self.root / ('.evicting-' + uuid.uuid4().hex)
+            try:
+                os.rename(str(entry), str(graveyard))
+            except FileNotFoundError:
+                continue
+            shutil.rmtree(str(graveyard))
+            total -= size
+
+
+class ArchiveCache(_DirectoryCache):
+    """A directory of extracted archives shared between processes.
+
+    Entries are keyed by the archive's UUID and the digest of its checksum
+    file, so an archive is only ever extracted once no matter how many
+    processes load it. Entries are populated in a hidden directory and then
+    atomically renamed into place, after which they are never modified (their
+    files are made read-only). Processes mount an entry by reflinking (or
+    copying) its files into their own archive directory, so a process may
+    write to its mount without corrupting the entry, and an entry can be
+    evicted without disturbing anyone who is already using it.
+
+    Example filesystem::
+
+        <cache root>/
+        |--- .populating-<random>/
+        !--- 770509e6-85f4-432c-9663-cdc04eb07db2-<checksums digest>/
+            |--- .size
+            !--- 770509e6-85f4-432c-9663-cdc04eb07db2/
+                !--- <the extracted archive>
+
+    The cache is configured by the environment: ``QIIME2_ARCHIVE_CACHE`` is
+    the root directory and ``QIIME2_ARCHIVE_CACHE_BUDGET`` is the number of
+    bytes the cache may hold before the least recently used entries are
+    evicted.
+
+    """
+    ROOT_ENVVAR = 'QIIME2_ARCHIVE_CACHE'
+    BUDGET_ENVVAR = 'QIIME2_ARCHIVE_CACHE_BUDGET'
+
+    def key(self, archive, checksum_file):
+        with archive.open(checksum_file) as fh:
+            digest = hashlib.md5(fh.read().encode('utf-8')).hexdigest()
+        return '%s-%s' % (archive.uuid, digest)
+
+    def mount(self, archive, checksum_file, filepath):
+        """Mount a cached copy of `archive` into `filepath`.
+
+        Returns the root of the mounted archive, populating the cache first
+        if necessary.
+
+        """
+        entry = self.root / self.key(archive, checksum_file)
+        destination = pathlib.Path(filepath) / str(archive.uuid)
+
+        try:
+            self._link(entry, destination)
+        except FileNotFoundError:
+            # Either a miss, or the entry was evicted while we were linking.
+            if destination.exists():
+                shutil.rmtree(str(destination))
+            self._populate(archive, entry)
+            self._link(entry, destination)
+
+        # Use the modification time of the entry to track recency.
+        os.utime(str(entry))
+        return destination
+
+    def _link(self, entry, destination):
+        qiime2.core.path.clone_tree(entry / destination.name, destination,
+                                    fresh=True)
+
+    def _populate(self, archive, entry):
+        staging = pathlib.Path(
+            tempfile.mkdtemp(prefix='.populating-', dir=str(self.root)))
+        try:
+            root = archive.extract(staging)
+            size = 0
+            for dirpath, _, filenames in os.walk(str(root)):
+                for filename in filenames:
+                    fp = os.path.join(dirpath, filename)
+                    size += os.path.getsize(fp)
+                    os.chmod(fp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            self._publish(staging, entry, size)
+        finally:
+            if staging.exists():
+                shutil.rmtree(str(staging))
+
+        if self.budget is not None:
+            self.evict(keep=entry)
+
+
+def _canonical(value):
+    # Sets have no order of their own, so give them one for the key
+    if isinstance(value, (set, frozenset)):
+        return sorted((_canonical(v) for v in value), key=repr)
+    if isinstance(value, list):
+        return [_canonical(v) for v in value]
+    if isinstance(value, dict):
+        return collections.OrderedDict(
+            (k, _canonical(v)) for k, v in value.items())
+    return value
+
+
+class ResultCache(_DirectoryCache):
+    """A directory of action results shared between processes.
+
+    Entries are keyed by everything which determines what an action produces:
+    the framework and plugin versions, the action, the UUIDs of its inputs,
+    and its parameters as they are recorded in provenance (with the content
+    of any metadata). Each output is saved in the entry as its own archive,
+    named for its position in the action's outputs. As with `ArchiveCache`,
+    entries are populated in a hidden directory and then atomically renamed
+    into place.
+
+    Example filesystem::
+
+        <cache root>/
+        |--- .populating-<random>/
+        !--- <key>/
+            |--- .size
+            |--- 0.qza
+            !--- 1.qza
+
+    The cache is configured by the environment: ``QIIME2_RESULT_CACHE`` is
+    the root directory and ``QIIME2_RESULT_CACHE_BUDGET`` is the number of
+    bytes the cache may hold before the least recently used entries are
+    evicted.
+
+    """
+    ROOT_ENVVAR = 'QIIME2_RESULT_CACHE'
+    BUDGET_ENVVAR = 'QIIME2_RESULT_CACHE_BUDGET'
+
+    def key(self, provenance):
+        """Key the call recorded (so far) by an ActionProvenanceCapture."""
+        parameters = collections.OrderedDict()
+        for name, value in provenance.parameters.items():
+            if isinstance(value, MetadataPath):
+                relpath = value.path.rsplit(':', 1)[-1]
+                with (provenance.action_dir / relpath).open('rb') as fh:
+                    digest = hashlib.md5(fh.read()).hexdigest()
+                value = [value, digest]
+            parameters[name] = value
+
+        plugin = provenance._plugin
+        record = collections.OrderedDict([
+            ('framework', qiime2.__version__),
+            ('plugin', [plugin.name, plugin.version]),
+            ('action', [provenance.action_type, provenance.action.id]),
+            ('inputs', _canonical(provenance.inputs)),
+            ('parameters', _canonical(parameters)),
+        ])
+        serialized = yaml.dump(record, Dumper=ProvenanceDumper,
+                               default_flow_style=False)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+    def get(self, key, loader):
+        """Load the results stored under `key` with `loader`.
+
+        Returns None when there are no results for `key`.
+
+        """
+        entry = self.root / key
+        try:
+            filepaths = sorted(
+                (fp for fp in entry.iterdir()
+                 if fp.name != self.SIZE_FILE),
+                key=lambda fp: int(fp.name.split('.', 1)[0]))
+            results = [loader(str(fp)) for fp in filepaths]
+        except FileNotFoundError:
+            # Either a miss, or the entry was evicted while we were loading.
+            return None
+
+        # Use the modification time of the entry to track recency.
+        try:
+            os.utime(str(entry))
+        except FileNotFoundError:
+            pass
+        return results
+
+    def put(self, key, results):
+        """Store `results` (anything with a `save` method) under `key`."""
+        entry = self.root / key
+        staging = pathlib.Path(
+            tempfile.mkdtemp(prefix='.populating-', dir=str(self.root)))
+        try:
+            size = 0
+            for idx, result in enumerate(results):
+                fp = result.save(str(staging / str(idx)))
+                size += os.path.getsize(fp)
+            self._publish(staging, entry, size)
+        finally:
+            if staging.exists():
+                shutil.rmtree(str(staging))
+
+        if self.budget is not None:
+            self.evict(keep=entry)
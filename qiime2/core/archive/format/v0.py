@@ -59,7 +59,7 @@ class ArchiveFormat:
         data_dir = root / cls.DATA_DIR
         data_dir.mkdir()
 
-        data_initializer(data_dir)
+        return data_initializer(data_dir)
 
     def __init__(self, archive_record):
         path = archive_record.root
@@ -7,16 +7,29 @@
 # ----------------------------------------------------------------------------
 
 import qiime2.core.archive.format.v0 as v0
+from qiime2.core.path import TRANSFER_STRATEGIES
 
 
 class ArchiveFormat(v0.ArchiveFormat):
     PROVENANCE_DIR = 'provenance'
+    # Whether the execution section of action.yaml says how the data was
+    # transferred into the archive (see qiime2.core.path.clone)
+    RECORDS_DATA_TRANSFER = False
+    # Whether the Python packages of the environment are written once to the
+    # `environments` directory of the provenance instead of every action.yaml
+    SHARES_ENVIRONMENT = False
 
     @classmethod
     def write(cls, archive_record, type, format, data_initializer,
               provenance_capture):
-        super().write(archive_record, type, format, data_initializer,
-                      provenance_capture)
+        transfer = super().write(archive_record, type, format,
+                                 data_initializer, provenance_capture)
+        # Data initializers may return anything, only strategies are recorded
+        if (cls.RECORDS_DATA_TRANSFER and isinstance(transfer, str) and
+                transfer in TRANSFER_STRATEGIES):
+            provenance_capture.record_data_transfer(transfer)
+        if cls.SHARES_ENVIRONMENT:
+            provenance_capture.share_environment()
         root = archive_record.root
 
         prov_dir = root / cls.PROVENANCE_DIR
@@ -25,6 +38,8 @@ class ArchiveFormat(v0.ArchiveFormat):
         provenance_capture.finalize(
             prov_dir, [root / cls.METADATA_FILE, archive_record.version_fp])
 
+        return transfer
+
     def __init__(self, archive_record):
         super().__init__(archive_record)
 
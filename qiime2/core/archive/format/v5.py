@@ -7,21 +7,25 @@
 # ----------------------------------------------------------------------------
 
 import qiime2.core.archive.format.v4 as v4
-from qiime2.core.util import md5sum_directory, to_checksum_format
+from qiime2.core.util import checksum_directory, write_checksum_file
 
 
 class ArchiveFormat(v4.ArchiveFormat):
     CHECKSUM_FILE = 'checksums.md5'
     # Adds `checksums.md5` to root of directory structure
+    # Any hashlib algorithm may be used by later formats, anything other than
+    # md5 is recorded in a header line of the checksum file.
+    CHECKSUM_ALGORITHM = 'md5'
 
     @classmethod
     def write(cls, archive_record, type, format, data_initializer,
               provenance_capture):
-        super().write(archive_record, type, format, data_initializer,
-                      provenance_capture)
+        transfer = super().write(archive_record, type, format,
+                                 data_initializer, provenance_capture)
 
-        checksums = md5sum_directory(str(archive_record.root))
+        checksums = checksum_directory(str(archive_record.root),
+                                       cls.CHECKSUM_ALGORITHM)
         with (archive_record.root / cls.CHECKSUM_FILE).open('w') as fh:
-            for item in checksums.items():
-                fh.write(to_checksum_format(*item))
-                fh.write('\n')
+            write_checksum_file(fh, checksums, cls.CHECKSUM_ALGORITHM)
+
+        return transfer
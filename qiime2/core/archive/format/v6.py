@@ -0,0 +1,25 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2019, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import qiime2.core.archive.format.v5 as v5
+
+
+class ArchiveFormat(v5.ArchiveFormat):
+    # Exactly the same layout as v5, but members are no longer all deflated
+    # at the default level:
+    # - members which are already compressed (gzip, bzip2, xz, zip, zstd) are
+    #   stored as-is
+    # - members of at least FAST_COMPRESSION_THRESHOLD bytes are deflated at
+    #   the fastest level, as the time spent compressing them dominates
+    #   saving (the zip spec offers no faster codec that every reader
+    #   supports)
+    # The execution section of action.yaml also records how the data was
+    # transferred into the archive in `data-transfer` (one of rename,
+    # hardlink, reflink, or copy) when it is known.
+    FAST_COMPRESSION_THRESHOLD = 2 ** 26
+    RECORDS_DATA_TRANSFER = True
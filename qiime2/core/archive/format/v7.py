@@ -0,0 +1,18 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2019, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import qiime2.core.archive.format.v6 as v6
+
+
+class ArchiveFormat(v6.ArchiveFormat):
+    # Exactly the same layout as v6, but the first member of the zip file is
+    # an index (`.qiime2-index`, outside of the root directory) recording the
+    # offset, size and CRC-32 of every other member. Readers can use it to
+    # find members without parsing the central directory, and readers which
+    # don't know about it ignore it like any other hidden file.
+    MEMBER_INDEX = True
@@ -0,0 +1,18 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2019, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import qiime2.core.archive.format.v7 as v7
+
+
+class ArchiveFormat(v7.ArchiveFormat):
+    # Exactly the same layout as v7, but the archive may be "thin": files of
+    # the data directory can be left out of the zip file and listed in
+    # `blobs.md5` (same layout as `checksums.md5`) instead, in which case
+    # they are loaded from a blob store by their checksum. `checksums.md5`
+    # still lists every file.
+    BLOB_MANIFEST = 'blobs.md5'
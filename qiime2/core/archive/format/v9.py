@@ -0,0 +1,19 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2019, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import qiime2.core.archive.format.v8 as v8
+
+
+class ArchiveFormat(v8.ArchiveFormat):
+    # Exactly the same layout as v8, except for the `python-packages` of the
+    # environment section of action.yaml. Nearly every action in a history
+    # ran with the same packages, so they are written once to
+    # `provenance/environments/<sha256 digest>.yaml` and action.yaml only
+    # has `python-packages: !environment <sha256 digest>`. Every environment
+    # used by the archive's ancestors is in the same directory.
+    SHARES_ENVIRONMENT = True
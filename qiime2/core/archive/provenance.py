@@ -8,6 +8,8 @@
 
 import time
 import collections
+import functools
+import hashlib
 import pkg_resources
 import uuid
 import copy
@@ -16,7 +18,6 @@ import shutil
 import sys
 from datetime import datetime
 
-import distutils
 import yaml
 import tzlocal
 import dateutil.relativedelta as relativedelta
@@ -33,69 +34,172 @@ MetadataPath = collections.namedtuple('MetadataPath', ['path'])
 ColorPrimitive = collections.namedtuple('ColorPrimitive', ['hex'])
 LiteralString = collections.namedtuple('LiteralString', ['string'])
 CitationKey = collections.namedtuple('CitationKey', ['key'])
+EnvironmentRef = collections.namedtuple('EnvironmentRef', ['digest'])
 
 
 class OrderedKeyValue(collections.OrderedDict):
     pass
 
 
+# libyaml is much faster than the pure-Python implementation, but it is an
+# optional part of PyYAML. It is only used for reading: it folds long
+# double-quoted scalars differently, so writing with it would change the
+# bytes (and so the checksums) of action.yaml.
+try:
+    _BaseLoader = yaml.CSafeLoader
+except AttributeError:
+    _BaseLoader = yaml.SafeLoader
+
+
+class ProvenanceDumper(yaml.Dumper):
+    """Dumper for action.yaml, which knows about the tags of provenance."""
+
+
+class ProvenanceLoader(_BaseLoader):
+    """Loader for action.yaml, which knows about the tags of provenance.
+
+    Tagged scalars are loaded as the same types that were written (e.g.
+    `!ref` as ForwardRef), and mappings are ordered, so dumping what was
+    loaded with ProvenanceDumper writes the same YAML.
+
+    """
+
+
+def _add_representer(type_, representer):
+    # Also registered with yaml.Dumper for anything using yaml.dump directly
+    yaml.add_representer(type_, representer)
+    ProvenanceDumper.add_representer(type_, representer)
+
+
+def _tagged_scalar(dumper, tag, value):
+    # The pure-Python emitter always quotes scalars with a custom tag, libyaml
+    # only when it has to, so the style is explicit to write the same YAML
+    # with either.
+    return dumper.represent_scalar(tag, value, style="'")
+
+
+def _add_scalar_constructor(tag, type_):
+    ProvenanceLoader.add_constructor(
+        tag, lambda loader, node: type_(loader.construct_scalar(node)))
+
+
 # Used for yaml that looks like:
 #   - key1: value1
 #   - key2: value2
-yaml.add_representer(OrderedKeyValue, lambda dumper, data:
-                     dumper.represent_list([
-                        {k: v} for k, v in data.items()]))
+_add_representer(OrderedKeyValue, lambda dumper, data:
+                 dumper.represent_list([
+                    {k: v} for k, v in data.items()]))
 
 
 # Controlling the order of dictionaries (even if semantically irrelevant) is
 # important to making it look nice.
-yaml.add_representer(collections.OrderedDict, lambda dumper, data:
-                     dumper.represent_dict(data.items()))
+_add_representer(collections.OrderedDict, lambda dumper, data:
+                 dumper.represent_dict(data.items()))
 
 
 # YAML libraries aren't good at writing a clean version of this, and typically
 # the fact that it is a set is irrelevant to tools that use provenance
 # so add a custom tag and treat it like a sequence. Then code doesn't need to
 # special case set vs list in their business logic when it isn't important.
-yaml.add_representer(set, lambda dumper, data:
-                     dumper.represent_sequence('!set', data))
+_add_representer(set, lambda dumper, data:
+                 dumper.represent_sequence('!set', data))
 
 
 # LiteralString uses the | character and has literal newlines
-yaml.add_representer(LiteralString, lambda dumper, data:
-                     dumper.represent_scalar('tag:yaml.org,2002:str',
-                                             data.string, style='|'))
+_add_representer(LiteralString, lambda dumper, data:
+                 dumper.represent_scalar('tag:yaml.org,2002:str',
+                                         data.string, style='|'))
 
 
 # Make our timestamps pretty (unquoted).
-yaml.add_representer(datetime, lambda dumper, data:
-                     dumper.represent_scalar('tag:yaml.org,2002:timestamp',
-                                             data.isoformat()))
+_add_representer(datetime, lambda dumper, data:
+                 dumper.represent_scalar('tag:yaml.org,2002:timestamp',
+                                         data.isoformat()))
 
 
 # Forward reference to something else in the document, namespaces are
 # delimited by colons (:).
-yaml.add_representer(ForwardRef, lambda dumper, data:
-                     dumper.represent_scalar('!ref', data.reference))
+_add_representer(ForwardRef, lambda dumper, data:
+                 _tagged_scalar(dumper, '!ref', data.reference))
 
 
 # This tag represents an artifact without provenance, this is to support
 # archive format v0. Ideally this won't be seen in the wild in practice.
-yaml.add_representer(NoProvenance, lambda dumper, data:
-                     dumper.represent_scalar('!no-provenance', str(data.uuid)))
+_add_representer(NoProvenance, lambda dumper, data:
+                 _tagged_scalar(dumper, '!no-provenance', str(data.uuid)))
 
 
 # A reference to Metadata and MetadataColumn whose data can be found at the
 # relative path indicated as its value
-yaml.add_representer(MetadataPath, lambda dumper, data:
-                     dumper.represent_scalar('!metadata', data.path))
+_add_representer(MetadataPath, lambda dumper, data:
+                 _tagged_scalar(dumper, '!metadata', data.path))
 
 # A color primitive.
-yaml.add_representer(ColorPrimitive, lambda dumper, data:
-                     dumper.represent_scalar('!color', data.hex))
+_add_representer(ColorPrimitive, lambda dumper, data:
+                 _tagged_scalar(dumper, '!color', data.hex))
+
+_add_representer(CitationKey, lambda dumper, data:
+                 _tagged_scalar(dumper, '!cite', data.key))
+
+# A reference to a block of the environment which is in the `environments`
+# directory of the provenance (named by its digest), as it is identical for
+# most actions.
+_add_representer(EnvironmentRef, lambda dumper, data:
+                 _tagged_scalar(dumper, '!environment', data.digest))
+
+
+# The tags above, when reading provenance
+_add_scalar_constructor('!ref', ForwardRef)
+_add_scalar_constructor('!no-provenance', NoProvenance)
+_add_scalar_constructor('!metadata', MetadataPath)
+_add_scalar_constructor('!color', ColorPrimitive)
+_add_scalar_constructor('!cite', CitationKey)
+_add_scalar_constructor('!environment', EnvironmentRef)
+ProvenanceLoader.add_constructor(
+    '!set', lambda loader, node: set(
+        loader.construct_sequence(node, deep=True)))
+ProvenanceLoader.add_constructor(
+    'tag:yaml.org,2002:map', lambda loader, node: collections.OrderedDict(
+        loader.construct_pairs(node, deep=True)))
+
+
+def _construct_str(loader, node):
+    string = loader.construct_scalar(node)
+    if node.style == '|':
+        return LiteralString(string)
+    return string
+
+
+ProvenanceLoader.add_constructor('tag:yaml.org,2002:str', _construct_str)
 
-yaml.add_representer(CitationKey, lambda dumper, data:
-                     dumper.represent_scalar('!cite', data.key))
+
+# The environment doesn't change while a process is running, so it is only
+# inspected once.
+@functools.lru_cache(maxsize=None)
+def _python_packages():
+    return tuple((d.project_name, d.version)
+                 for d in pkg_resources.working_set)
+
+
+@functools.lru_cache(maxsize=None)
+def _python_version():
+    # There is a trailing whitespace in sys.version, strip so that YAML can
+    # use literal formatting.
+    return '\n'.join(line.strip() for line in sys.version.split('\n'))
+
+
+@functools.lru_cache(maxsize=8)
+def _render_block(key, items):
+    """Render `key: <mapping of items>` like it is nested in a section.
+
+    Returns the YAML and its SHA-256 digest.
+
+    """
+    text = yaml.dump({key: collections.OrderedDict(items)},
+                     Dumper=ProvenanceDumper, default_flow_style=False,
+                     indent=4)
+    text = ''.join('    ' + line for line in text.splitlines(True))
+    return text, hashlib.sha256(text.encode('utf-8')).hexdigest()
 
 
 class ProvenanceCapture:
@@ -103,6 +207,7 @@ class ProvenanceCapture:
     ACTION_DIR = 'action'
     ACTION_FILE = 'action.yaml'
     CITATION_FILE = 'citations.bib'
+    ENVIRONMENT_DIR = 'environments'
 
     def __init__(self):
         self.start = time.time()
@@ -116,6 +221,11 @@ class ProvenanceCapture:
         self.transformers = collections.OrderedDict()
         self.citations = Citations()
         self._framework_citations = []
+        self.data_transfer = None
+        self.shared_environment = False
+        # Provenance directories of the captures this was forked from, which
+        # are shared by every fork and only copied at finalize
+        self._bases = ()
 
         for idx, citation in enumerate(qiime2.__citations__):
             citation_key = self.make_citation_key('framework')
@@ -149,25 +259,52 @@ class ProvenanceCapture:
             # contain an artifact UUID that is not in the artifacts/ directory.
             return NoProvenance(artifact.uuid)
 
-        destination = self.ancestor_dir / str(artifact.uuid)
         # If it exists, then the artifact is already in the provenance
         # (and so are its ancestors)
-        if not destination.exists():
+        if not self._has(self.ANCESTOR_DIR, str(artifact.uuid)):
             # Handle root node of ancestor
-            shutil.copytree(
-                str(other_path), str(destination),
-                ignore=shutil.ignore_patterns(self.ANCESTOR_DIR + '*'))
+            self._add_node(str(artifact.uuid), other_path)
 
             # Handle ancestral nodes of ancestor
             grandcestor_path = other_path / self.ANCESTOR_DIR
             if grandcestor_path.exists():
                 for grandcestor in grandcestor_path.iterdir():
-                    destination = self.ancestor_dir / grandcestor.name
-                    if not destination.exists():
-                        shutil.copytree(str(grandcestor), str(destination))
+                    if not self._has(self.ANCESTOR_DIR, grandcestor.name):
+                        self._add_node(grandcestor.name, grandcestor)
+
+            # Environments referenced by any of those nodes
+            env_path = other_path / self.ENVIRONMENT_DIR
+            if env_path.exists():
+                env_dir = self.path / self.ENVIRONMENT_DIR
+                env_dir.mkdir(exist_ok=True)
+                for env_fp in env_path.iterdir():
+                    if not self._has(self.ENVIRONMENT_DIR, env_fp.name):
+                        qiime2.core.path.clone_file(
+                            env_fp, env_dir / env_fp.name, immutable=True)
 
         return str(artifact.uuid)
 
+    def _has(self, *parts):
+        """Whether the provenance (including its bases) has `parts`."""
+        return any(path.joinpath(*parts).exists()
+                   for path in (self.path,) + self._bases)
+
+    def _add_node(self, uuid, source):
+        """Add the node `uuid` to the ancestors, without its own ancestors.
+
+        Provenance is never modified once written, so nodes are hardlinked
+        (when the filesystem allows) rather than copied.
+
+        """
+        destination = self.ancestor_dir / uuid
+        destination.mkdir()
+        for child in source.iterdir():
+            if (child.name.startswith(self.ANCESTOR_DIR) or
+                    child.name == self.ENVIRONMENT_DIR):
+                continue
+            qiime2.core.path.clone(child, destination / child.name,
+                                   immutable=True)
+
     def make_citation_key(self, domain, package=None, identifier=None,
                           index=0):
         if domain == 'framework':
@@ -202,8 +339,19 @@ class ProvenanceCapture:
         return ForwardRef('environment:plugins:' + plugin.name)
 
     def capture_env(self):
-        return collections.OrderedDict(
-            (d.project_name, d.version) for d in pkg_resources.working_set)
+        return collections.OrderedDict(_python_packages())
+
+    def share_environment(self):
+        """Write the Python packages once per archive, not once per action.
+
+        action.yaml refers to them by digest instead (see EnvironmentRef).
+
+        """
+        self.shared_environment = True
+
+    def record_data_transfer(self, strategy):
+        """Record how the output's data was transferred into its archive."""
+        self.data_transfer = strategy
 
     def transformation_recorder(self, name):
         section = self.transformers[name] = []
@@ -256,6 +404,8 @@ class ProvenanceCapture:
         runtime['end'] = end = self._ts_to_date(self.end)
         runtime['duration'] = \
             util.duration_time(relativedelta.relativedelta(end, start))
+        if self.data_transfer is not None:
+            execution['data-transfer'] = self.data_transfer
 
         return execution
 
@@ -272,10 +422,7 @@ class ProvenanceCapture:
     def make_env_section(self):
         env = collections.OrderedDict()
         env['platform'] = pkg_resources.get_build_platform()
-        # There is a trailing whitespace in sys.version, strip so that YAML can
-        # use literal formatting.
-        env['python'] = LiteralString('\n'.join(line.strip() for line in
-                                      sys.version.split('\n')))
+        env['python'] = LiteralString(_python_version())
         env['framework'] = self.make_software_entry(
             qiime2.__version__, qiime2.__website__, self._framework_citations)
         env['plugins'] = self.plugins
@@ -284,7 +431,8 @@ class ProvenanceCapture:
         return env
 
     def write_action_yaml(self):
-        settings = dict(default_flow_style=False, indent=4)
+        settings = dict(Dumper=ProvenanceDumper, default_flow_style=False,
+                        indent=4)
         with (self.action_dir / self.ACTION_FILE).open(mode='w') as fh:
             fh.write(yaml.dump({'execution': self.make_execution_section()},
                                **settings))
@@ -297,8 +445,25 @@ class ProvenanceCapture:
                     {'transformers': self.make_transformers_section()},
                     **settings))
             fh.write('\n')
-            fh.write(yaml.dump({'environment': self.make_env_section()},
-                               **settings))
+            fh.write(self._render_env_section(settings))
+
+    def _render_env_section(self, settings):
+        env = self.make_env_section()
+        # The packages are the last (and by far the largest) entry, and
+        # rarely change, so their YAML is cached.
+        packages = env.pop('python-packages')
+        text, digest = _render_block('python-packages',
+                                     tuple(packages.items()))
+        if self.shared_environment:
+            env_dir = self.path / self.ENVIRONMENT_DIR
+            env_dir.mkdir(exist_ok=True)
+            env_fp = env_dir / (digest + '.yaml')
+            if not self._has(self.ENVIRONMENT_DIR, env_fp.name):
+                env_fp.write_text(text)
+            env['python-packages'] = EnvironmentRef(digest)
+            text = ''
+
+        return yaml.dump({'environment': env}, **settings) + text
 
     def write_citations_bib(self):
         self.citations.save(str(self.path / self.CITATION_FILE))
@@ -312,7 +477,27 @@ class ProvenanceCapture:
         self.write_action_yaml()
         self.write_citations_bib()
 
-        self.path.rename(final_path)
+        qiime2.core.path.move(self.path, final_path)
+        for base in self._bases:
+            self._materialize(base, final_path)
+
+    def _materialize(self, base, final_path):
+        """Copy what is missing from `final_path` out of `base`."""
+        for child in base.iterdir():
+            destination = final_path / child.name
+            if child.is_dir():
+                destination.mkdir(exist_ok=True)
+                # Ancestors and environments are never modified, so they
+                # can be shared
+                immutable = child.name in (self.ANCESTOR_DIR,
+                                           self.ENVIRONMENT_DIR)
+                for grandchild in child.iterdir():
+                    if not (destination / grandchild.name).exists():
+                        qiime2.core.path.clone(
+                            grandchild, destination / grandchild.name,
+                            immutable=immutable)
+            elif not destination.exists():
+                qiime2.core.path.clone_file(child, destination)
 
     def fork(self):
         forked = copy.copy(self)
@@ -320,10 +505,12 @@ class ProvenanceCapture:
         forked.plugins = forked.plugins.copy()
         forked.transformers = forked.transformers.copy()
         forked.citations = forked.citations.copy()
-        # create a copy of the backing dir so factory (the hard stuff is
-        # mostly done by this point)
+        # The backing dir (the hard stuff is mostly done by this point) is
+        # shared rather than copied, each fork only writes its own files to a
+        # new (empty) one on top of it. This also keeps the base alive for as
+        # long as the fork is.
+        forked._bases = (self.path,) + self._bases
         forked._build_paths()
-        distutils.dir_util.copy_tree(str(self.path), str(forked.path))
 
         return forked
 
@@ -356,6 +543,7 @@ class ActionProvenanceCapture(ProvenanceCapture):
         self.inputs = OrderedKeyValue()
         self.parameters = OrderedKeyValue()
         self.output_name = ''
+        self.alias = None
 
         self._action_citations = []
         for idx, citation in enumerate(self.action.citations):
@@ -417,23 +605,21 @@ class ActionProvenanceCapture(ProvenanceCapture):
         if self._action_citations:
             action['citations'] = self._action_citations
 
+        if self.alias is not None:
+            action['alias-of'] = str(self.alias.uuid)
+
         return action
 
-    def fork(self, name):
+    def fork(self, name, alias=None):
         forked = super().fork()
         forked.output_name = name
+        if alias is not None:
+            forked.alias = alias
+            forked.add_ancestor(alias)
         return forked
 
 
 class PipelineProvenanceCapture(ActionProvenanceCapture):
-    def make_action_section(self):
-        action = super().make_action_section()
-        action['alias-of'] = str(self.alias.uuid)
-
-        return action
-
     def fork(self, name, alias):
-        forked = super().fork(name)
-        forked.alias = alias
-        forked.add_ancestor(alias)
-        return forked
+        # Every output of a pipeline is an alias of one of its steps' results
+        return super().fork(name, alias)
@@ -0,0 +1,387 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2019, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+import concurrent.futures
+import os
+import re
+import sqlite3
+import threading
+
+import yaml
+
+from qiime2.core.archive.archiver import Archiver
+from qiime2.core.archive.provenance import (
+    ProvenanceCapture, ProvenanceDumper, ProvenanceLoader, ForwardRef,
+    NoProvenance)
+
+
+ProvenanceNode = collections.namedtuple(
+    'ProvenanceNode', ['uuid', 'type', 'format', 'action_type', 'plugin',
+                       'action', 'output_name', 'inputs', 'parameters',
+                       'archive'])
+
+
+# Sections of action.yaml are separate top-level keys, and only the first two
+# (execution and action) are needed, so the rest (mostly the environment) is
+# never parsed.
+_UNUSED_SECTIONS = re.compile(r'^(?:transformers|environment):',
+                              flags=re.MULTILINE)
+_PLUGIN_REF = 'environment:plugins:'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    uuid TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    uuid TEXT PRIMARY KEY,
+    type TEXT,
+    format TEXT,
+    action_type TEXT,
+    plugin TEXT,
+    action TEXT,
+    output_name TEXT,
+    inputs TEXT,
+    parameters TEXT,
+    archive TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS edges (
+    child TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    PRIMARY KEY (child, parent)
+);
+CREATE INDEX IF NOT EXISTS edges_parent ON edges (parent);
+CREATE TABLE IF NOT EXISTS members (
+    archive TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    PRIMARY KEY (archive, uuid)
+);
+CREATE INDEX IF NOT EXISTS members_uuid ON members (uuid);
+"""
+
+
+class ProvenanceGraph:
+    """The provenance of many archives as a single graph of UUIDs.
+
+    Archives are indexed by `refresh`, which reads ``metadata.yaml`` and
+    ``action.yaml`` of every node straight from the zip files, without
+    extracting them. A node is only read from the first archive it is found
+    in, as a UUID always refers to the same node. Edges go from the inputs
+    (and for pipelines, the output which is aliased) to the result.
+
+    The index is kept in an SQLite database, so with a filepath it persists
+    between sessions and only archives which are new (or whose size or
+    modification time has changed) are read again. Archives which have been
+    deleted or changed are dropped from the index on every refresh, along
+    with any node which no remaining archive contains. The graph used by
+    queries is built in memory from the database when it is first needed.
+
+    A graph may be queried from many threads at the same time.
+
+    """
+
+    def __init__(self, index=None):
+        self.index = index
+        self._conn = sqlite3.connect(
+            ':memory:' if index is None else str(index),
+            check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.RLock()
+        self._known = None
+        self._dag = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            count, = self._conn.execute(
+                'SELECT COUNT(*) FROM nodes').fetchone()
+        return count
+
+    def __contains__(self, uuid):
+        return self._get_row(str(uuid)) is not None
+
+    def refresh(self, filepaths, workers=None):
+        """Index archives which are new or have changed since last time.
+
+        Parameters
+        ----------
+        filepaths : iterable of str
+            Paths of the archives to index.
+        workers : int, optional
+            Number of threads to read archives with, None will use one per
+            CPU.
+
+        Returns
+        -------
+        list
+            In the same order as `filepaths`, the UUID of each archive or the
+            exception raised when reading it.
+
+        Notes
+        -----
+        Every archive already in the index (not just those in `filepaths`)
+        which no longer exists, or whose size or modification time has
+        changed, is removed from the index first.
+
+        """
+        filepaths = [os.path.abspath(str(fp)) for fp in filepaths]
+        with self._lock:
+            if self._known is None:
+                self._known = {uuid for uuid, in
+                               self._conn.execute('SELECT uuid FROM nodes')}
+            indexed = {path: (size, mtime_ns, uuid) for path, size, mtime_ns,
+                       uuid in self._conn.execute('SELECT * FROM archives')}
+            stale = [path for path, (size, mtime_ns, _) in indexed.items()
+                     if self._stat_key(path) != (size, mtime_ns)]
+            self._prune(stale)
+            for path in stale:
+                del indexed[path]
+
+        def read(filepath):
+            try:
+                stat = os.stat(filepath)
+                key = (stat.st_size, stat.st_mtime_ns)
+                if indexed.get(filepath, (None, None))[:2] == key:
+                    return indexed[filepath][2], key, None, None
+                uuid, nodes, members = self._read_archive(filepath)
+                return uuid, key, nodes, members
+            except Exception as e:
+                return e, None, None, None
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers) as executor:
+            for filepath, (uuid, key, nodes, members) in zip(
+                    filepaths, executor.map(read, filepaths)):
+                results.append(uuid)
+                if nodes is not None:
+                    self._insert(filepath, uuid, key, nodes, members)
+
+        with self._lock:
+            self._conn.commit()
+        return results
+
+    @classmethod
+    def _stat_key(cls, filepath):
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _prune(self, paths):
+        """Remove the archives at `paths` and the nodes only they contain.
+
+        A node which another indexed archive also contains is kept, and is
+        read from that archive from now on.
+
+        """
+        if not paths:
+            return
+        orphans = set()
+        for path in paths:
+            self._conn.execute('DELETE FROM archives WHERE path = ?', (path,))
+            self._conn.execute('DELETE FROM members WHERE archive = ?',
+                               (path,))
+            orphans.update(uuid for uuid, in self._conn.execute(
+                'SELECT uuid FROM nodes WHERE archive = ?', (path,)))
+
+        for uuid in orphans:
+            row = self._conn.execute(
+                'SELECT archive FROM members WHERE uuid = ? LIMIT 1',
+                (uuid,)).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    'UPDATE nodes SET archive = ? WHERE uuid = ?',
+                    (row[0], uuid))
+            else:
+                self._conn.execute('DELETE FROM nodes WHERE uuid = ?',
+                                   (uuid,))
+                self._conn.execute('DELETE FROM edges WHERE child = ?',
+                                   (uuid,))
+                self._known.discard(uuid)
+        self._dag = None
+
+    def _read_archive(self, filepath):
+        with Archiver.get_archive(filepath) as archive:
+            Format = Archiver.get_format_class(archive.version)
+            if Format is None:
+                Archiver._futuristic_archive_error(filepath, archive)
+
+            if not hasattr(Format, 'PROVENANCE_DIR'):
+                # Version 0 has no provenance, only the result itself
+                uuid, type, format = Format.load_metadata(archive)
+                return uuid, [self._make_node(uuid, type, format, None,
+                                              filepath)], [str(uuid)]
+
+            prov_dir = Format.PROVENANCE_DIR
+            ancestor_dir = ProvenanceCapture.ANCESTOR_DIR
+            relpaths = []
+            # Every node in the archive, including those already indexed
+            members = [archive.uuid]
+            if archive.uuid not in self._known:
+                relpaths.append(prov_dir)
+            prefix = '/'.join([archive.uuid, prov_dir, ancestor_dir, ''])
+            suffix = '/' + Format.METADATA_FILE
+            for name in archive.namelist():
+                if name.startswith(prefix) and name.endswith(suffix):
+                    node_uuid = name[len(prefix):].split('/', 1)[0]
+                    members.append(node_uuid)
+                    relpath = '/'.join([prov_dir, ancestor_dir, node_uuid])
+                    if (node_uuid not in self._known and
+                            relpath not in relpaths):
+                        relpaths.append(relpath)
+
+            action_file = '/'.join(['', ProvenanceCapture.ACTION_DIR,
+                                    ProvenanceCapture.ACTION_FILE])
+            nodes = []
+            for relpath in relpaths:
+                with archive.open(relpath + suffix) as fh:
+                    metadata = yaml.load(fh, Loader=ProvenanceLoader)
+                with archive.open(relpath + action_file) as fh:
+                    action_yaml = _UNUSED_SECTIONS.split(fh.read(), 1)[0]
+                action = yaml.load(action_yaml, Loader=ProvenanceLoader)
+                nodes.append(self._make_node(
+                    metadata['uuid'], metadata['type'], metadata['format'],
+                    action['action'], filepath))
+
+            return archive.uuid, nodes, members
+
+    def _make_node(self, uuid, type, format, action, filepath):
+        action = action or {}
+        plugin = action.get('plugin')
+        if isinstance(plugin, ForwardRef):
+            plugin = plugin.reference[len(_PLUGIN_REF):]
+        inputs = collections.OrderedDict(
+            item for input in action.get('inputs') or [] for item in
+            input.items())
+        parameters = collections.OrderedDict(
+            item for parameter in action.get('parameters') or [] for item in
+            parameter.items())
+
+        parents = set()
+        for value in inputs.values():
+            if value is None:
+                continue
+            if not isinstance(value, (list, set)):
+                value = [value]
+            for parent in value:
+                if isinstance(parent, NoProvenance):
+                    parent = parent.uuid
+                parents.add(parent)
+        if 'alias-of' in action:
+            parents.add(action['alias-of'])
+
+        dump = dict(Dumper=ProvenanceDumper, default_flow_style=False)
+        return (ProvenanceNode(
+            str(uuid), type, format, action.get('type'), plugin,
+            action.get('action'), action.get('output-name'),
+            yaml.dump(inputs, **dump), yaml.dump(parameters, **dump),
+            filepath), parents)
+
+    def _insert(self, filepath, uuid, key, nodes, members):
+        with self._lock:
+            for node, parents in nodes:
+                if node.uuid in self._known:
+                    continue
+                self._conn.execute(
+                    'INSERT OR IGNORE INTO nodes VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', node)
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO edges VALUES (?, ?)',
+                    [(node.uuid, parent) for parent in parents])
+                self._known.add(node.uuid)
+                self._dag = None
+            self._conn.execute(
+                'INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?)',
+                (filepath, key[0], key[1], uuid))
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO members VALUES (?, ?)',
+                [(filepath, member) for member in members])
+
+    def archives(self):
+        """Map the path of every indexed archive to its UUID."""
+        with self._lock:
+            return dict(self._conn.execute(
+                'SELECT path, uuid FROM archives'))
+
+    def _get_row(self, uuid):
+        with self._lock:
+            return self._conn.execute('SELECT * FROM nodes WHERE uuid = ?',
+                                      (uuid,)).fetchone()
+
+    def get(self, uuid):
+        """Return the ProvenanceNode of `uuid`."""
+        row = self._get_row(str(uuid))
+        if row is None:
+            raise KeyError("%s is not in the provenance graph." % uuid)
+        node = ProvenanceNode(*row)
+        return node._replace(
+            inputs=yaml.load(node.inputs, Loader=ProvenanceLoader),
+            parameters=yaml.load(node.parameters, Loader=ProvenanceLoader))
+
+    def parameters(self, uuid):
+        """Return the parameters of the action which produced `uuid`."""
+        return self.get(uuid).parameters
+
+    def _get_dag(self):
+        with self._lock:
+            if self._dag is None:
+                parents = collections.defaultdict(set)
+                children = collections.defaultdict(set)
+                for child, parent in self._conn.execute(
+                        'SELECT child, parent FROM edges'):
+                    parents[child].add(parent)
+                    children[parent].add(child)
+                self._dag = parents, children
+            return self._dag
+
+    def parents(self, uuid):
+        """Return the UUIDs which `uuid` was directly derived from."""
+        return set(self._get_dag()[0].get(str(uuid), ()))
+
+    def children(self, uuid):
+        """Return the UUIDs which were directly derived from `uuid`."""
+        return set(self._get_dag()[1].get(str(uuid), ()))
+
+    def ancestors(self, uuid):
+        """Return every UUID which `uuid` was derived from."""
+        return self._walk(self._get_dag()[0], str(uuid))
+
+    def descendants(self, uuid):
+        """Return every UUID which was derived from `uuid`."""
+        return self._walk(self._get_dag()[1], str(uuid))
+
+    def select_descendants(self, ancestor, uuids):
+        """Return those of `uuids` which were derived from `ancestor`."""
+        descendants = self.descendants(ancestor)
+        return [uuid for uuid in uuids if str(uuid) in descendants]
+
+    def _walk(self, edges, start):
+        seen = set()
+        stack = [start]
+        while stack:
+            for uuid in edges.get(stack.pop(), ()):
+                if uuid not in seen:
+                    seen.add(uuid)
+                    stack.append(uuid)
+        return seen
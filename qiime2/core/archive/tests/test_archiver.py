@@ -6,20 +6,30 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import gzip
+import io
 import os
+import pickle
+import random
 import tempfile
+import threading
 import unittest
+import unittest.mock
 import uuid
 import zipfile
 import pathlib
+import zlib
 
+import qiime2.core.path
 from qiime2.core.archive import Archiver
 from qiime2.core.archive import ImportProvenanceCapture
-from qiime2.core.archive.archiver import _ZipArchive
+import qiime2.core.archive.archiver as archiver_module
+from qiime2.core.archive.archiver import _ZipArchive, CompressionPolicy
 from qiime2.core.archive.format.util import artifact_version
 from qiime2.core.testing.format import IntSequenceDirectoryFormat
 from qiime2.core.testing.type import IntSequence1
-from qiime2.core.testing.util import ArchiveTestingMixin
+from qiime2.core.testing.util import (ArchiveTestingMixin,
+                                      get_environment_member)
 
 
 class TestArchiver(unittest.TestCase, ArchiveTestingMixin):
@@ -93,7 +103,8 @@ class TestArchiver(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertArchiveMembers(fp, root_dir, expected)
@@ -112,11 +123,405 @@ class TestArchiver(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertArchiveMembers(fp, root_dir, expected)
 
+    def test_save_parallel(self):
+        def data_initializer(data_dir):
+            data_dir = str(data_dir)
+            with open(os.path.join(data_dir, 'ints.txt'), 'w') as fh:
+                for i in range(1000):
+                    fh.write('%d\n' % i)
+            os.mkdir(os.path.join(data_dir, 'nested'))
+            open(os.path.join(data_dir, 'nested', 'empty.txt'), 'w').close()
+
+        archiver = Archiver.from_data(
+            IntSequence1, IntSequenceDirectoryFormat,
+            data_initializer=data_initializer,
+            provenance_capture=ImportProvenanceCapture())
+
+        serial_fp = os.path.join(self.temp_dir.name, 'serial.zip')
+        parallel_fp = os.path.join(self.temp_dir.name, 'parallel.zip')
+        archiver.save(serial_fp)
+        # Small chunks so that members span many units of work.
+        with unittest.mock.patch.object(_ZipArchive, 'CHUNK_SIZE', 97):
+            archiver.save(parallel_fp, workers=4)
+
+        with zipfile.ZipFile(serial_fp) as serial, \
+                zipfile.ZipFile(parallel_fp) as parallel:
+            self.assertIsNone(parallel.testzip())
+            self.assertEqual(parallel.namelist(), serial.namelist())
+            for name in serial.namelist():
+                if name == _ZipArchive.INDEX_FILE:
+                    # Offsets depend on how well each member compressed
+                    continue
+                self.assertEqual(parallel.read(name), serial.read(name))
+                self.assertEqual(parallel.getinfo(name).compress_type,
+                                 zipfile.ZIP_DEFLATED)
+
+        loaded = Archiver.load(parallel_fp)
+        self.assertEqual(loaded.validate_checksums(), ({}, {}, {}))
+
+    def test_zip_writer(self):
+        data = b'1\n2\n3\n' * 100
+        chunks = [data[:256], data[256:]]
+        fh = io.BytesIO()
+        zf = archiver_module._ZipWriter(fh)
+        info = zipfile.ZipInfo('ints.txt')
+        info.compress_type = zipfile.ZIP_DEFLATED
+        zf.start(info)
+        zdict = None
+        for idx, chunk in enumerate(chunks):
+            zf.write(chunk, archiver_module._deflate(
+                chunk, zdict, idx == len(chunks) - 1, 6))
+            zdict = chunk
+        zf.finish()
+        info = zipfile.ZipInfo('stored.txt')
+        info.compress_type = zipfile.ZIP_STORED
+        zf.writestr(info, 'stored')
+        zf.writestr('\u00fcnicode.txt', 'deflated')
+        zf.close()
+
+        with zipfile.ZipFile(fh) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(),
+                             ['ints.txt', 'stored.txt', '\u00fcnicode.txt'])
+            self.assertEqual(zf.read('ints.txt'), data)
+            self.assertEqual(zf.read('\u00fcnicode.txt'), b'deflated')
+            info = zf.getinfo('ints.txt')
+            self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+            self.assertLess(info.compress_size, len(data))
+
+    def test_zip_writer_requires_compressed_data(self):
+        zf = archiver_module._ZipWriter(io.BytesIO())
+        info = zipfile.ZipInfo('ints.txt')
+        info.compress_type = zipfile.ZIP_DEFLATED
+        zf.start(info)
+
+        with self.assertRaisesRegex(ValueError, 'already be compressed'):
+            zf.write(b'1\n2\n3\n')
+
+    def test_save_parallel_compresses_on_workers(self):
+        # Parallel saves must never quietly fall back to deflating serially:
+        # every deflated chunk is compressed on a worker thread.
+        threads = []
+        deflate = archiver_module._deflate
+
+        def record_deflate(*args):
+            threads.append(threading.current_thread())
+            return deflate(*args)
+
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        with unittest.mock.patch.object(_ZipArchive, 'CHUNK_SIZE', 7), \
+                unittest.mock.patch.object(archiver_module, '_deflate',
+                                           side_effect=record_deflate):
+            self.archiver.save(fp, workers=4)
+
+        with zipfile.ZipFile(fp) as zf:
+            self.assertIsNone(zf.testzip())
+            chunks = sum(-(-info.file_size // 7) or 1
+                         for info in zf.infolist()
+                         if info.compress_type == zipfile.ZIP_DEFLATED)
+        self.assertEqual(len(threads), chunks)
+        self.assertNotIn(threading.main_thread(), threads)
+
+        loaded = Archiver.load(fp)
+        self.assertEqual(loaded.validate_checksums(), ({}, {}, {}))
+
+    def test_save_stores_compressed_members(self):
+        def data_initializer(data_dir):
+            data_dir = str(data_dir)
+            with open(os.path.join(data_dir, 'ints.txt'), 'w') as fh:
+                fh.write('1\n2\n3\n')
+            with gzip.open(os.path.join(data_dir, 'ints.txt.gz'), 'wt') as fh:
+                fh.write('1\n2\n3\n')
+
+        archiver = Archiver.from_data(
+            IntSequence1, IntSequenceDirectoryFormat,
+            data_initializer=data_initializer,
+            provenance_capture=ImportProvenanceCapture())
+
+        for workers in 1, 4:
+            fp = os.path.join(self.temp_dir.name, '%d.zip' % workers)
+            archiver.save(fp, workers=workers)
+
+            root = str(archiver.uuid)
+            with zipfile.ZipFile(fp) as zf:
+                self.assertIsNone(zf.testzip())
+                info = zf.getinfo(root + '/data/ints.txt.gz')
+                self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+                info = zf.getinfo(root + '/data/ints.txt')
+                self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+                self.assertIn(b'archive: 9', zf.read(root + '/VERSION'))
+
+            loaded = Archiver.load(fp)
+            self.assertEqual(loaded.validate_checksums(), ({}, {}, {}))
+
+    def test_save_compresslevel(self):
+        def data_initializer(data_dir):
+            rand = random.Random(0)
+            with open(os.path.join(str(data_dir), 'ints.txt'), 'w') as fh:
+                for _ in range(10000):
+                    fh.write('%d\n' % rand.randrange(1000))
+
+        archiver = Archiver.from_data(
+            IntSequence1, IntSequenceDirectoryFormat,
+            data_initializer=data_initializer,
+            provenance_capture=ImportProvenanceCapture())
+
+        sizes = {}
+        for level in 0, 1, 9:
+            fp = os.path.join(self.temp_dir.name, '%d.zip' % level)
+            archiver.save(fp, compresslevel=level)
+            with zipfile.ZipFile(fp) as zf:
+                info = zf.getinfo(str(archiver.uuid) + '/data/ints.txt')
+                sizes[level] = info.compress_size
+                expected = (zipfile.ZIP_STORED if level == 0
+                            else zipfile.ZIP_DEFLATED)
+                self.assertEqual(info.compress_type, expected)
+
+        self.assertGreater(sizes[0], sizes[1])
+        self.assertGreater(sizes[1], sizes[9])
+
+        with self.assertRaisesRegex(ValueError, 'between -1 and 9'):
+            archiver.save(fp, compresslevel=10)
+
+    def test_compression_policy(self):
+        policy = CompressionPolicy(level=6, fast_threshold=100)
+
+        self.assertEqual(policy.choose(b'\x1f\x8b\x08', 10),
+                         (zipfile.ZIP_STORED, None))
+        self.assertEqual(policy.choose(b'BZh9', 1000),
+                         (zipfile.ZIP_STORED, None))
+        self.assertEqual(policy.choose(b'ACGT', 10),
+                         (zipfile.ZIP_DEFLATED, 6))
+        self.assertEqual(policy.choose(b'ACGT', 100),
+                         (zipfile.ZIP_DEFLATED, 1))
+
+        policy = CompressionPolicy(store_compressed=False)
+        self.assertEqual(policy.choose(b'\x1f\x8b\x08', 10),
+                         (zipfile.ZIP_DEFLATED, zlib.Z_DEFAULT_COMPRESSION))
+
+    def test_load_unknown_version(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver.save(fp)
+        with zipfile.ZipFile(fp) as zf:
+            members = {name: zf.read(name) for name in zf.namelist()}
+        version = '%s/VERSION' % self.archiver.uuid
+        members[version] = members[version].replace(b'archive: 9',
+                                                    b'archive: 999')
+        with zipfile.ZipFile(fp, mode='w') as zf:
+            for name, data in members.items():
+                zf.writestr(name, data)
+
+        with self.assertRaisesRegex(ValueError,
+                                    "cannot interpret archive version '999'"):
+            Archiver.load(fp)
+
+    def test_checksum_algorithm(self):
+        Format = Archiver.get_format_class(Archiver.CURRENT_FORMAT_VERSION)
+
+        def data_initializer(data_dir):
+            with open(os.path.join(str(data_dir), 'ints.txt'), 'w') as fh:
+                fh.write('1\n2\n3\n')
+
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        with unittest.mock.patch.object(Format, 'CHECKSUM_ALGORITHM',
+                                        'blake2b'):
+            Archiver.from_data(
+                IntSequence1, IntSequenceDirectoryFormat,
+                data_initializer=data_initializer,
+                provenance_capture=ImportProvenanceCapture()).save(fp)
+
+        # Readers don't need to know the algorithm ahead of time.
+        archiver = Archiver.load(fp)
+        with (archiver.root_dir / 'checksums.md5').open() as fh:
+            self.assertEqual(fh.readline(), '#algorithm: blake2b\n')
+        self.assertEqual(archiver.validate_checksums(), ({}, {}, {}))
+
+        with (archiver.data_dir / 'ints.txt').open('a') as fh:
+            fh.write('4\n')
+        diff = archiver.validate_checksums()
+        self.assertEqual(list(diff.changed), ['data/ints.txt'])
+
+    def test_peek_opens_archive_once(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        # Without a member index
+        _ZipArchive.save(self.archiver.path, fp)
+
+        with unittest.mock.patch('zipfile.ZipFile',
+                                 wraps=zipfile.ZipFile) as ZipFile:
+            uuid_, type_, format_ = Archiver.peek(fp)
+
+        self.assertEqual(ZipFile.call_count, 1)
+        self.assertEqual(uuid_, str(self.archiver.uuid))
+        self.assertEqual(type_, 'IntSequence1')
+        self.assertEqual(format_, 'IntSequenceDirectoryFormat')
+
+    def test_peek_indexed_archive(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver.save(fp)
+
+        with unittest.mock.patch('zipfile.ZipFile',
+                                 wraps=zipfile.ZipFile) as ZipFile:
+            uuid_, type_, format_ = Archiver.peek(fp)
+
+        # Everything was found with the index
+        self.assertEqual(ZipFile.call_count, 0)
+        self.assertEqual(uuid_, str(self.archiver.uuid))
+        self.assertEqual(type_, 'IntSequence1')
+        self.assertEqual(format_, 'IntSequenceDirectoryFormat')
+
+    def test_save_member_index(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver.save(fp)
+
+        with zipfile.ZipFile(fp) as zf:
+            self.assertIsNone(zf.testzip())
+            infos = zf.infolist()
+            self.assertEqual(infos[0].filename, _ZipArchive.INDEX_FILE)
+            self.assertEqual(infos[0].compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(infos[0].header_offset, 0)
+            expected = {info.filename: info for info in infos[1:]}
+
+        index = _ZipArchive(pathlib.Path(fp))._get_index()
+        self.assertEqual(set(index), set(expected))
+        for name, entry in index.items():
+            info = expected[name]
+            self.assertEqual(entry.header_offset, info.header_offset)
+            self.assertEqual(entry.compress_size, info.compress_size)
+            self.assertEqual(entry.file_size, info.file_size)
+            self.assertEqual(entry.crc, info.CRC)
+            self.assertEqual(entry.compress_type, info.compress_type)
+
+    def test_member_index_matches_scan(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver.save(fp)
+        indexed = _ZipArchive(pathlib.Path(fp))
+        self.assertIsNotNone(indexed._get_index())
+
+        with unittest.mock.patch.object(_ZipArchive, '_get_index',
+                                        return_value=None):
+            scanned = _ZipArchive(pathlib.Path(fp))
+
+            for relpath in '', str(self.archiver.uuid), 'missing':
+                self.assertEqual(list(indexed.relative_iterdir(relpath)),
+                                 list(scanned.relative_iterdir(relpath)))
+            for relpath in 'VERSION', 'metadata.yaml', 'provenance/VERSION':
+                with indexed.open(relpath) as a, scanned.open(relpath) as b:
+                    self.assertEqual(a.read(), b.read())
+            expected = scanned.member_index()
+
+        del expected[_ZipArchive.INDEX_FILE]
+        self.assertEqual(indexed.member_index(), expected)
+        with self.assertRaises(KeyError):
+            indexed.open('missing')
+
+    def test_stale_member_index_ignored(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver.save(fp)
+        # Rewriting the zip file keeps the index, but moves everything else
+        with zipfile.ZipFile(fp) as zf:
+            members = [(info, zf.read(info)) for info in zf.infolist()]
+        with zipfile.ZipFile(fp, mode='w') as zf:
+            for info, data in members:
+                info.compress_type = zipfile.ZIP_STORED
+                zf.writestr(info, data)
+
+        archive = _ZipArchive(pathlib.Path(fp))
+        self.assertIsNone(archive._get_index())
+        self.assertEqual(archive.uuid, str(self.archiver.uuid))
+        self.assertEqual(archive.version, '9')
+
+    def test_get_archive_not_a_zip(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        with open(fp, 'w') as fh:
+            fh.write('not a zip')
+
+        with self.assertRaisesRegex(ValueError, 'not a QIIME archive'):
+            Archiver.get_archive(fp)
+        with self.assertRaisesRegex(ValueError, 'not a QIIME archive'):
+            Archiver.get_archive(self.temp_dir.name)
+
+    def test_save_align(self):
+        payload = bytes(range(256)) * 100
+
+        def data_initializer(data_dir):
+            data_dir = str(data_dir)
+            with open(os.path.join(data_dir, 'ints.txt'), 'w') as fh:
+                fh.write('1\n2\n3\n')
+            for name in 'a.bin', 'b.bin':
+                with open(os.path.join(data_dir, name), 'wb') as fh:
+                    fh.write(payload)
+
+        archiver = Archiver.from_data(
+            IntSequence1, IntSequenceDirectoryFormat,
+            data_initializer=data_initializer,
+            provenance_capture=ImportProvenanceCapture())
+
+        root = str(archiver.uuid)
+        for workers in 1, 4:
+            fp = os.path.join(self.temp_dir.name, '%d.zip' % workers)
+            archiver.save(fp, workers=workers, align=['*.bin'])
+
+            with zipfile.ZipFile(fp) as zf:
+                self.assertIsNone(zf.testzip())
+                for name in 'a.bin', 'b.bin':
+                    info = zf.getinfo('%s/data/%s' % (root, name))
+                    self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+                    # Padding is only in the local header
+                    self.assertEqual(info.extra, b'')
+                info = zf.getinfo(root + '/data/ints.txt')
+                self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+
+            archive = _ZipArchive(pathlib.Path(fp))
+            index = archive.member_index()
+            with open(fp, 'rb') as fh:
+                for name in 'a.bin', 'b.bin':
+                    member = index['%s/data/%s' % (root, name)]
+                    self.assertEqual(member.offset % 4096, 0)
+                    self.assertEqual(member.size, len(payload))
+                    fh.seek(member.offset)
+                    self.assertEqual(fh.read(member.size), payload)
+
+            loaded = Archiver.load(fp)
+            self.assertEqual(loaded.validate_checksums(), ({}, {}, {}))
+
+    def test_member_index(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver.save(fp, compresslevel=0)
+        archive = _ZipArchive(pathlib.Path(fp))
+
+        index = archive.member_index()
+
+        with zipfile.ZipFile(fp) as zf, open(fp, 'rb') as fh:
+            self.assertEqual(set(index),
+                             set(zf.namelist()) - {_ZipArchive.INDEX_FILE})
+            for name, member in index.items():
+                self.assertEqual(member.compress_type, zipfile.ZIP_STORED)
+                fh.seek(member.offset)
+                self.assertEqual(fh.read(member.size), zf.read(name))
+
+        name = '%s/VERSION' % self.archiver.uuid
+        self.assertEqual(list(archive.member_index([name])), [name])
+
+    def test_load_aligned_members(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver.save(fp, align=['ints.txt'])
+        name = '%s/data/ints.txt' % self.archiver.uuid
+        self.assertEqual(
+            _ZipArchive(pathlib.Path(fp)).member_index([name])[name].offset
+            % 4096, 0)
+
+        for lazy in True, False:
+            archiver = Archiver.load(fp, lazy=lazy)
+            path = archiver.data_dir / 'ints.txt'
+            self.assertEqual(qiime2.core.path.map_file(path).tobytes(),
+                             b'1\n2\n3\n')
+
     def test_load_archive(self):
         fp = os.path.join(self.temp_dir.name, 'archive.zip')
         self.archiver.save(fp)
@@ -130,6 +535,193 @@ class TestArchiver(unittest.TestCase, ArchiveTestingMixin):
                           for p in archiver.data_dir.iterdir()},
                          {'ints.txt'})
 
+    def test_load_archive_lazy(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver.save(fp)
+
+        archiver = Archiver.load(fp, lazy=True)
+
+        self.assertTrue(archiver.is_lazy)
+        self.assertEqual(archiver.uuid, self.archiver.uuid)
+        self.assertEqual(archiver.type, IntSequence1)
+        self.assertEqual(archiver.format, IntSequenceDirectoryFormat)
+
+        mount = archiver.path / str(archiver.uuid)
+        self.assertEqual({p.name for p in mount.iterdir()},
+                         {'VERSION', 'checksums.md5', 'metadata.yaml'})
+
+        self.assertEqual({str(p.relative_to(archiver.data_dir))
+                          for p in archiver.data_dir.iterdir()},
+                         {'ints.txt'})
+        self.assertFalse((mount / 'provenance').exists())
+        self.assertTrue(archiver.is_lazy)
+
+        self.assertTrue(archiver.provenance_dir.exists())
+        self.assertFalse(archiver.is_lazy)
+
+    def test_scratch_usage(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver.save(fp)
+        root = os.path.join(self.temp_dir.name, 'scratch')
+        scratch = qiime2.core.path.ScratchManager()
+        env = {'QIIME2_SCRATCH': root, 'QIIME2_SCRATCH_BUDGET': str(2**30)}
+
+        with unittest.mock.patch.dict(os.environ, env), \
+                unittest.mock.patch.object(qiime2.core.path, '_SCRATCH',
+                                           scratch):
+            archiver = Archiver.load(fp, lazy=True)
+            mounted = scratch.usage(root)
+            self.assertGreater(mounted, 0)
+
+            archiver.provenance_dir
+            self.assertGreater(scratch.usage(root), mounted)
+
+            archiver._destructor()
+            self.assertEqual(scratch.usage(root), 0)
+
+    def test_scratch_usage_handoff(self):
+        root = os.path.join(self.temp_dir.name, 'scratch')
+        scratch = qiime2.core.path.ScratchManager()
+        env = {'QIIME2_SCRATCH': root, 'QIIME2_SCRATCH_BUDGET': str(2**30)}
+
+        with unittest.mock.patch.dict(os.environ, env), \
+                unittest.mock.patch.object(qiime2.core.path, '_SCRATCH',
+                                           scratch):
+            archiver = Archiver.from_data(
+                IntSequence1, IntSequenceDirectoryFormat,
+                data_initializer=lambda data_dir: None,
+                provenance_capture=ImportProvenanceCapture())
+            self.assertGreater(scratch.usage(root), 0)
+            handle = archiver.handoff()
+
+            # Attaching without ownership leaves the owner's usage alone
+            borrowed = Archiver.attach(handle)
+            self.assertGreater(scratch.usage(root), 0)
+            borrowed._destructor()
+            self.assertGreater(scratch.usage(root), 0)
+
+            # Once released, the directory is no longer ours to count
+            archiver.release()
+            self.assertEqual(scratch.usage(root), 0)
+            self.assertNotIn(handle.path, scratch._live)
+            self.assertNotIn(handle.path, scratch._sizes)
+
+            owned = Archiver.attach(handle, owned=True)
+            owned._destructor()
+            self.assertEqual(scratch.usage(root), 0)
+            self.assertFalse(os.path.exists(handle.path))
+
+    def test_lazy_archive_save_and_validate(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver.save(fp)
+
+        archiver = Archiver.load(fp, lazy=True)
+        diff = archiver.validate_checksums()
+
+        self.assertFalse(archiver.is_lazy)
+        self.assertEqual(diff.added, {})
+        self.assertEqual(diff.removed, {})
+        self.assertEqual(diff.changed, {})
+
+        archiver = Archiver.load(fp, lazy=True)
+        other_fp = os.path.join(self.temp_dir.name, 'other.zip')
+        archiver.save(other_fp)
+
+        root_dir = str(archiver.uuid)
+        expected = {
+            'VERSION',
+            'checksums.md5',
+            'metadata.yaml',
+            'data/ints.txt',
+            'provenance/metadata.yaml',
+            'provenance/VERSION',
+            'provenance/citations.bib',
+            'provenance/action/action.yaml',
+            get_environment_member()
+        }
+
+        self.assertArchiveMembers(other_fp, root_dir, expected)
+
+    def test_validate_archive(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver.save(fp)
+
+        with unittest.mock.patch.object(_ZipArchive, 'extract') as extract:
+            for workers in 1, 4:
+                self.assertEqual(Archiver.validate_archive(fp, workers),
+                                 ({}, {}, {}))
+        extract.assert_not_called()
+
+        root = str(self.archiver.uuid)
+        with zipfile.ZipFile(fp) as zf:
+            members = {name: zf.read(name) for name in zf.namelist()}
+        del members[root + '/metadata.yaml']
+        members[root + '/data/ints.txt'] = b'4\n5\n6\n'
+        members[root + '/extra.txt'] = b'uh oh'
+        members[root + '/.hidden'] = b'ignored'
+        with zipfile.ZipFile(fp, mode='w') as zf:
+            for name, data in members.items():
+                zf.writestr(name, data)
+
+        diff = Archiver.validate_archive(fp, workers=2)
+
+        self.assertEqual(list(diff.added), ['extra.txt'])
+        self.assertEqual(list(diff.removed), ['metadata.yaml'])
+        self.assertEqual(list(diff.changed), ['data/ints.txt'])
+
+    def test_validate_archive_without_checksums(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        with artifact_version(4):
+            archiver = Archiver.from_data(
+                IntSequence1, IntSequenceDirectoryFormat,
+                data_initializer=lambda data_dir: None,
+                provenance_capture=ImportProvenanceCapture())
+        archiver.save(fp)
+
+        self.assertEqual(Archiver.validate_archive(fp), ({}, {}, {}))
+
+    def test_lazy_archive_pickle_mounts(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver.save(fp)
+
+        archiver = Archiver.load(fp, lazy=True)
+        clone = pickle.loads(pickle.dumps(archiver))
+        clone.path._destructor.detach()
+
+        self.assertFalse(archiver.is_lazy)
+        self.assertFalse(clone.is_lazy)
+        self.assertEqual(clone.uuid, archiver.uuid)
+        self.assertTrue((clone.data_dir / 'ints.txt').exists())
+
+    def test_handoff_attach(self):
+        handle = self.archiver.handoff()
+        self.assertEqual(handle.uuid, str(self.archiver.uuid))
+
+        borrowed = Archiver.attach(handle)
+        self.assertEqual(borrowed.uuid, self.archiver.uuid)
+        self.assertEqual(borrowed.type, IntSequence1)
+        self.assertEqual(borrowed.root_dir, self.archiver.root_dir)
+        # Borrowing an archive leaves it alone
+        borrowed._destructor()
+        self.assertTrue((self.archiver.data_dir / 'ints.txt').exists())
+
+        self.archiver.release()
+        owner = Archiver.attach(pickle.loads(pickle.dumps(handle)),
+                                owned=True)
+        self.assertEqual(owner.validate_checksums(), ({}, {}, {}))
+        owner._destructor()
+        self.assertFalse(os.path.exists(handle.path))
+
+    def test_handoff_lazy_archive_mounts(self):
+        fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver.save(fp)
+
+        archiver = Archiver.load(fp, lazy=True)
+        borrowed = Archiver.attach(archiver.handoff())
+
+        self.assertFalse(archiver.is_lazy)
+        self.assertTrue((borrowed.data_dir / 'ints.txt').exists())
+
     def test_load_ignores_root_dotfiles(self):
         fp = os.path.join(self.temp_dir.name, 'archive.zip')
         self.archiver.save(fp)
@@ -147,6 +739,7 @@ class TestArchiver(unittest.TestCase, ArchiveTestingMixin):
         with zipfile.ZipFile(fp, mode='r') as zf:
             root_dir = str(self.archiver.uuid)
             expected = {
+                '.qiime2-index',
                 '.DS_Store',
                 '.hidden-file',
                 '.hidden-dir/ignored-file',
@@ -157,7 +750,8 @@ class TestArchiver(unittest.TestCase, ArchiveTestingMixin):
                 '%s/provenance/metadata.yaml' % root_dir,
                 '%s/provenance/VERSION' % root_dir,
                 '%s/provenance/citations.bib' % root_dir,
-                '%s/provenance/action/action.yaml' % root_dir
+                '%s/provenance/action/action.yaml' % root_dir,
+                get_environment_member('%s/provenance' % root_dir)
             }
 
             observed = set(zf.namelist())
@@ -205,7 +799,8 @@ class TestArchiver(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertArchiveMembers(fp, root_dir, expected)
@@ -229,7 +824,8 @@ class TestArchiver(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertArchiveMembers(fp, root_dir, expected)
@@ -285,6 +881,7 @@ class TestArchiver(unittest.TestCase, ArchiveTestingMixin):
         with zipfile.ZipFile(fp, mode='r') as zf:
             root_dir = str(self.archiver.uuid)
             expected = {
+                '.qiime2-index',
                 '%s/VERSION' % root_dir,
                 '%s/checksums.md5' % root_dir,
                 '%s/metadata.yaml' % root_dir,
@@ -293,6 +890,7 @@ class TestArchiver(unittest.TestCase, ArchiveTestingMixin):
                 '%s/provenance/VERSION' % root_dir,
                 '%s/provenance/citations.bib' % root_dir,
                 '%s/provenance/action/action.yaml' % root_dir,
+                get_environment_member('%s/provenance' % root_dir),
                 '%s/VERSION' % second_root_dir
             }
 
@@ -0,0 +1,181 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2019, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import hashlib
+import os
+import pathlib
+import stat
+import tempfile
+import unittest
+import unittest.mock as mock
+import zipfile
+
+from qiime2.core.archive import Archiver, BlobStore
+from qiime2.core.archive import ImportProvenanceCapture
+from qiime2.core.testing.format import IntSequenceDirectoryFormat
+from qiime2.core.testing.type import IntSequence1
+
+
+def make_archiver(ints=(1, 2, 3)):
+    def data_initializer(data_dir):
+        with open(os.path.join(str(data_dir), 'ints.txt'), 'w') as fh:
+            for i in ints:
+                fh.write('%d\n' % i)
+
+    return Archiver.from_data(
+        IntSequence1, IntSequenceDirectoryFormat,
+        data_initializer=data_initializer,
+        provenance_capture=ImportProvenanceCapture())
+
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        prefix = "qiime2-test-temp-"
+        self.temp_dir = tempfile.TemporaryDirectory(prefix=prefix)
+        self.store_dir = os.path.join(self.temp_dir.name, 'blobs')
+        self.store = BlobStore(self.store_dir, min_size=0)
+        self.env = {'QIIME2_BLOB_STORE': self.store_dir}
+
+        self.fp = os.path.join(self.temp_dir.name, 'file.txt')
+        with open(self.fp, 'w') as fh:
+            fh.write('1\n2\n3\n')
+        self.digest = hashlib.md5(b'1\n2\n3\n').hexdigest()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_from_environment(self):
+        with mock.patch.dict(os.environ, {}, clear=True):
+            self.assertIsNone(BlobStore.from_environment())
+
+        with mock.patch.dict(os.environ, self.env):
+            store = BlobStore.from_environment()
+
+        self.assertEqual(store.root, pathlib.Path(self.store_dir))
+
+    def test_add_and_link(self):
+        blob = self.store.add(self.fp, self.digest)
+        self.assertEqual(blob, self.store.path(self.digest))
+        self.assertEqual(blob.read_text(), '1\n2\n3\n')
+        self.assertEqual(stat.S_IMODE(blob.stat().st_mode) & 0o222, 0)
+
+        # Adding it again is a no-op
+        with mock.patch('os.replace') as replace:
+            self.assertEqual(self.store.add(self.fp, self.digest), blob)
+        replace.assert_not_called()
+
+        dst = pathlib.Path(self.temp_dir.name) / 'nested' / 'linked.txt'
+        self.store.link(self.digest, dst)
+        self.assertEqual(dst.read_text(), '1\n2\n3\n')
+
+    def test_add_wrong_digest(self):
+        with self.assertRaisesRegex(ValueError, 'does not match'):
+            self.store.add(self.fp, hashlib.md5(b'other').hexdigest())
+        self.assertEqual(os.listdir(self.store_dir), ['md5'])
+
+    def test_link_missing(self):
+        with self.assertRaisesRegex(KeyError, 'does not contain'):
+            self.store.link(self.digest, os.path.join(self.temp_dir.name, 'x'))
+
+    def test_add_directory_min_size(self):
+        root = pathlib.Path(self.temp_dir.name)
+        (root / 'data').mkdir()
+        (root / 'data' / 'small.txt').write_text('1')
+        (root / 'data' / 'large.txt').write_text('1' * 10)
+        (root / 'other.txt').write_text('1' * 10)
+        checksums = {
+            'data/small.txt': hashlib.md5(b'1').hexdigest(),
+            'data/large.txt': hashlib.md5(b'1' * 10).hexdigest(),
+            'other.txt': hashlib.md5(b'1' * 10).hexdigest()}
+
+        store = BlobStore(self.store_dir, min_size=5)
+        added = store.add_directory(root, checksums, relpath='data')
+
+        self.assertEqual(list(added), ['data/large.txt'])
+
+    def test_thin_archive(self):
+        archiver = make_archiver()
+        fp = os.path.join(self.temp_dir.name, 'thin.zip')
+        archiver.save(fp, blob_store=self.store)
+
+        root = str(archiver.uuid)
+        with zipfile.ZipFile(fp) as zf:
+            names = zf.namelist()
+            self.assertNotIn(root + '/data/ints.txt', names)
+            self.assertIn(root + '/blobs.md5', names)
+        self.assertTrue(self.store.path(self.digest).exists())
+        self.assertEqual(Archiver.validate_archive(fp), ({}, {}, {}))
+
+        with mock.patch.dict(os.environ, self.env):
+            for lazy in True, False:
+                loaded = Archiver.load(fp, lazy=lazy)
+                self.assertEqual((loaded.data_dir / 'ints.txt').read_text(),
+                                 '1\n2\n3\n')
+                self.assertEqual(loaded.validate_checksums(), ({}, {}, {}))
+                self.assertFalse((loaded.root_dir / 'blobs.md5').exists())
+
+    def test_export_lazy_thin_archive(self):
+        fp = os.path.join(self.temp_dir.name, 'thin.zip')
+        make_archiver().save(fp, blob_store=self.store)
+        output_dir = os.path.join(self.temp_dir.name, 'exported')
+
+        with mock.patch.dict(os.environ, self.env):
+            loaded = Archiver.load(fp, lazy=True)
+        loaded.export_data(output_dir)
+
+        with open(os.path.join(output_dir, 'ints.txt')) as fh:
+            self.assertEqual(fh.read(), '1\n2\n3\n')
+
+    def test_thin_archives_share_blobs(self):
+        for name in 'a.zip', 'b.zip':
+            make_archiver().save(os.path.join(self.temp_dir.name, name),
+                                 blob_store=self.store)
+
+        self.assertEqual(os.listdir(os.path.join(self.store_dir, 'md5')),
+                         [self.digest[:2]])
+        self.assertEqual(
+            os.listdir(os.path.join(self.store_dir, 'md5', self.digest[:2])),
+            [self.digest])
+
+    def test_load_thin_archive_without_store(self):
+        fp = os.path.join(self.temp_dir.name, 'thin.zip')
+        make_archiver().save(fp, blob_store=self.store)
+
+        with mock.patch.dict(os.environ, {}, clear=True):
+            with self.assertRaisesRegex(ValueError, 'thin archive'):
+                Archiver.load(fp)
+
+        other = os.path.join(self.temp_dir.name, 'other')
+        with mock.patch.dict(os.environ, {'QIIME2_BLOB_STORE': other}):
+            with self.assertRaisesRegex(ValueError, 'does not contain'):
+                Archiver.load(fp)
+
+    def test_rehydrate(self):
+        archiver = make_archiver()
+        fp = os.path.join(self.temp_dir.name, 'thin.zip')
+        full_fp = os.path.join(self.temp_dir.name, 'full.zip')
+        archiver.save(fp, blob_store=self.store)
+
+        with mock.patch.dict(os.environ, self.env):
+            Archiver.rehydrate(fp, full_fp)
+
+        root = str(archiver.uuid)
+        with zipfile.ZipFile(full_fp) as zf:
+            names = zf.namelist()
+            self.assertIn(root + '/data/ints.txt', names)
+            self.assertNotIn(root + '/blobs.md5', names)
+
+        with mock.patch.dict(os.environ, {}, clear=True):
+            loaded = Archiver.load(full_fp)
+        self.assertEqual((loaded.data_dir / 'ints.txt').read_text(),
+                         '1\n2\n3\n')
+        self.assertEqual(Archiver.validate_archive(full_fp), ({}, {}, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,286 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2019, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import pathlib
+import stat
+import tempfile
+import unittest
+import unittest.mock as mock
+
+import pandas as pd
+
+import qiime2
+import qiime2.plugin
+from qiime2.core.archive import Archiver
+from qiime2.core.archive import ImportProvenanceCapture
+from qiime2.core.archive import ActionProvenanceCapture
+from qiime2.core.archive.archiver import _ZipArchive
+from qiime2.core.archive.cache import ArchiveCache, ResultCache
+from qiime2.core.archive.format.util import artifact_version
+from qiime2.core.testing.format import IntSequenceDirectoryFormat
+from qiime2.core.testing.type import IntSequence1
+
+
+def make_archive(fp, ints=(1, 2, 3)):
+    def data_initializer(data_dir):
+        with open(os.path.join(str(data_dir), 'ints.txt'), 'w') as fh:
+            for i in ints:
+                fh.write('%d\n' % i)
+
+    archiver = Archiver.from_data(
+        IntSequence1, IntSequenceDirectoryFormat,
+        data_initializer=data_initializer,
+        provenance_capture=ImportProvenanceCapture())
+    archiver.save(fp)
+    return archiver
+
+
+class TestArchiveCache(unittest.TestCase):
+    def setUp(self):
+        prefix = "qiime2-test-temp-"
+        self.temp_dir = tempfile.TemporaryDirectory(prefix=prefix)
+        self.cache_dir = os.path.join(self.temp_dir.name, 'cache')
+        self.fp = os.path.join(self.temp_dir.name, 'archive.zip')
+        self.archiver = make_archive(self.fp)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_from_environment(self):
+        with mock.patch.dict(os.environ, {}, clear=True):
+            self.assertIsNone(ArchiveCache.from_environment())
+
+        env = {'QIIME2_ARCHIVE_CACHE': self.cache_dir,
+               'QIIME2_ARCHIVE_CACHE_BUDGET': '1024'}
+        with mock.patch.dict(os.environ, env):
+            cache = ArchiveCache.from_environment()
+
+        self.assertEqual(cache.root, pathlib.Path(self.cache_dir))
+        self.assertEqual(cache.budget, 1024)
+        self.assertTrue(cache.root.is_dir())
+
+    def test_load_populates_then_hits(self):
+        with mock.patch.dict(os.environ,
+                             {'QIIME2_ARCHIVE_CACHE': self.cache_dir}):
+            first = Archiver.load(self.fp)
+
+            with mock.patch.object(_ZipArchive, 'extract') as extract:
+                second = Archiver.load(self.fp)
+            extract.assert_not_called()
+
+        entries = ArchiveCache(self.cache_dir).entries()
+        self.assertEqual(len(entries), 1)
+        self.assertTrue(entries[0].name.startswith(str(self.archiver.uuid)))
+
+        for archiver in first, second:
+            self.assertEqual(archiver.uuid, self.archiver.uuid)
+            self.assertEqual(archiver.type, IntSequence1)
+            with (archiver.data_dir / 'ints.txt').open() as fh:
+                self.assertEqual(fh.read(), '1\n2\n3\n')
+            diff = archiver.validate_checksums()
+            self.assertEqual(diff, ({}, {}, {}))
+
+        # Each process gets its own directory so that destructors don't
+        # interfere with each other or with the cache.
+        self.assertNotEqual(first.root_dir, second.root_dir)
+        first._destructor()
+        self.assertTrue(second.data_dir.exists())
+        self.assertTrue((entries[0] / str(self.archiver.uuid)).exists())
+
+    def test_entries_are_read_only(self):
+        cache = ArchiveCache(self.cache_dir)
+        archive = _ZipArchive(pathlib.Path(self.fp))
+        mount_dir = pathlib.Path(self.temp_dir.name) / 'mount'
+        mount_dir.mkdir()
+
+        root = cache.mount(archive, 'checksums.md5', mount_dir)
+
+        entry = cache.root / cache.key(archive, 'checksums.md5')
+        entry_fp = entry / str(self.archiver.uuid) / 'data' / 'ints.txt'
+        mode = entry_fp.stat().st_mode
+        self.assertEqual(stat.S_IMODE(mode) & 0o222, 0)
+
+        # The mount is a writable copy, so writing to it leaves the entry
+        # (and every other process's mount) alone.
+        mount_fp = root / 'data' / 'ints.txt'
+        self.assertTrue(stat.S_IMODE(mount_fp.stat().st_mode) & stat.S_IWUSR)
+        self.assertNotEqual(mount_fp.stat().st_ino, entry_fp.stat().st_ino)
+        with mount_fp.open('a') as fh:
+            fh.write('4\n')
+        self.assertEqual(entry_fp.read_text(), '1\n2\n3\n')
+
+    def test_loaded_data_is_independent_of_entry(self):
+        with mock.patch.dict(os.environ,
+                             {'QIIME2_ARCHIVE_CACHE': self.cache_dir}):
+            first = Archiver.load(self.fp)
+            with (first.data_dir / 'ints.txt').open('a') as fh:
+                fh.write('4\n')
+            second = Archiver.load(self.fp)
+
+        with (second.data_dir / 'ints.txt').open() as fh:
+            self.assertEqual(fh.read(), '1\n2\n3\n')
+        self.assertEqual(second.validate_checksums(), ({}, {}, {}))
+
+    def test_export_data_is_writable(self):
+        with mock.patch.dict(os.environ,
+                             {'QIIME2_ARCHIVE_CACHE': self.cache_dir}):
+            archiver = Archiver.load(self.fp)
+
+        default_mode = 0o666 & ~qiime2.core.path._UMASK
+        for i, pattern in enumerate([None, '*.txt']):
+            output_dir = os.path.join(self.temp_dir.name, 'out%d' % i)
+            archiver.export_data(output_dir, pattern=pattern)
+            mode = os.stat(os.path.join(output_dir, 'ints.txt')).st_mode
+            self.assertEqual(stat.S_IMODE(mode), default_mode)
+
+    def test_populate_lost_race(self):
+        cache = ArchiveCache(self.cache_dir)
+        archive = _ZipArchive(pathlib.Path(self.fp))
+        entry = cache.root / cache.key(archive, 'checksums.md5')
+
+        cache._populate(archive, entry)
+        # Another process populating the same entry shouldn't fail or leave
+        # anything behind.
+        cache._populate(archive, entry)
+
+        self.assertEqual([p.name for p in cache.root.iterdir()],
+                         [entry.name])
+
+    def test_evicts_least_recently_used(self):
+        fps = []
+        for i in range(3):
+            fp = os.path.join(self.temp_dir.name, 'archive%d.zip' % i)
+            make_archive(fp, ints=range(i * 10))
+            fps.append(fp)
+
+        cache = ArchiveCache(self.cache_dir)
+        mount_dir = pathlib.Path(self.temp_dir.name) / 'mount'
+        keys = []
+        for i, fp in enumerate(fps):
+            archive = _ZipArchive(pathlib.Path(fp))
+            keys.append(cache.key(archive, 'checksums.md5'))
+            (mount_dir / str(i)).mkdir(parents=True)
+            cache.mount(archive, 'checksums.md5', mount_dir / str(i))
+            os.utime(str(cache.root / keys[-1]), (i, i))
+
+        # Touch the oldest so that the second is now least recently used.
+        os.utime(str(cache.root / keys[0]), (10, 10))
+        sizes = [cache.size(cache.root / key) for key in keys]
+        cache.budget = sizes[0] + sizes[2]
+        cache.evict()
+
+        self.assertEqual([p.name for p in cache.entries()],
+                         [keys[2], keys[0]])
+        # Mounts are independent of the cache entry.
+        self.assertTrue((mount_dir / '1').exists())
+
+    def test_no_cache_for_archives_without_checksums(self):
+        fp = os.path.join(self.temp_dir.name, 'v4.zip')
+        with artifact_version(4):
+            make_archive(fp)
+
+        with mock.patch.dict(os.environ,
+                             {'QIIME2_ARCHIVE_CACHE': self.cache_dir}):
+            archiver = Archiver.load(fp)
+
+        self.assertEqual(archiver.type, IntSequence1)
+        self.assertEqual(ArchiveCache(self.cache_dir).entries(), [])
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        prefix = "qiime2-test-temp-"
+        self.temp_dir = tempfile.TemporaryDirectory(prefix=prefix)
+        self.cache = ResultCache(os.path.join(self.temp_dir.name, 'cache'))
+        self.ints = qiime2.Artifact.import_data('IntSequence1', [1, 2, 3])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def capture(self, ints, int1=1, metadata=None):
+        provenance = ActionProvenanceCapture(
+            'method', 'qiime2.plugins.dummy_plugin.methods',
+            'identity_with_metadata')
+        provenance.add_input('ints', ints)
+        provenance.add_parameter('int1', qiime2.plugin.Int, int1)
+        provenance.add_parameter('metadata', qiime2.plugin.Metadata,
+                                 metadata)
+        return provenance
+
+    def test_from_environment(self):
+        with mock.patch.dict(os.environ, {}, clear=True):
+            self.assertIsNone(ResultCache.from_environment())
+
+        env = {'QIIME2_RESULT_CACHE': str(self.cache.root),
+               'QIIME2_RESULT_CACHE_BUDGET': '1024'}
+        with mock.patch.dict(os.environ, env):
+            cache = ResultCache.from_environment()
+
+        self.assertEqual(cache.root, self.cache.root)
+        self.assertEqual(cache.budget, 1024)
+
+    def test_key(self):
+        key = self.cache.key(self.capture(self.ints))
+
+        self.assertEqual(self.cache.key(self.capture(self.ints)), key)
+        self.assertNotEqual(self.cache.key(self.capture(self.ints, 2)), key)
+        other = qiime2.Artifact.import_data('IntSequence1', [1, 2, 3])
+        self.assertNotEqual(self.cache.key(self.capture(other)), key)
+
+    def test_key_set_order(self):
+        ints = [qiime2.Artifact.import_data('SingleInt', i) for i in range(5)]
+        keys = set()
+        for order in ints, ints[::-1]:
+            provenance = self.capture(self.ints)
+            provenance.add_input('int_set', set(order))
+            keys.add(self.cache.key(provenance))
+        self.assertEqual(len(keys), 1)
+
+    def test_key_metadata_content(self):
+        md1 = qiime2.Metadata(pd.DataFrame(
+            {'a': ['1', '2']}, index=pd.Index(['0', '1'], name='id')))
+        md2 = qiime2.Metadata(pd.DataFrame(
+            {'a': ['1', '3']}, index=pd.Index(['0', '1'], name='id')))
+
+        key = self.cache.key(self.capture(self.ints, metadata=md1))
+        self.assertEqual(
+            self.cache.key(self.capture(self.ints, metadata=md1)), key)
+        self.assertNotEqual(
+            self.cache.key(self.capture(self.ints, metadata=md2)), key)
+
+    def test_put_then_get(self):
+        other = qiime2.Artifact.import_data('IntSequence2', [4, 5])
+        self.assertIsNone(self.cache.get('key', qiime2.sdk.Result.load))
+
+        self.cache.put('key', [self.ints, other])
+        results = self.cache.get('key', qiime2.sdk.Result.load)
+
+        self.assertEqual([r.uuid for r in results],
+                         [self.ints.uuid, other.uuid])
+        self.assertEqual(results[1].view(list), [4, 5])
+        self.assertEqual(self.cache.size(self.cache.root / 'key'),
+                         sum(os.path.getsize(str(fp)) for fp in
+                             (self.cache.root / 'key').glob('*.qza')))
+
+    def test_evicts_least_recently_used(self):
+        for i, key in enumerate(['a', 'b', 'c']):
+            self.cache.put(key, [self.ints])
+            os.utime(str(self.cache.root / key), (i, i))
+        # Reading an entry makes it the most recently used
+        self.cache.get('a', qiime2.sdk.Result.load)
+
+        self.cache.budget = (self.cache.size(self.cache.root / 'a') +
+                             self.cache.size(self.cache.root / 'c'))
+        self.cache.evict()
+
+        self.assertEqual([p.name for p in self.cache.entries()], ['c', 'a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
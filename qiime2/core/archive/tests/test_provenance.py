@@ -6,18 +6,48 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import collections
+import datetime
+import os
+import pathlib
+import tempfile
 import unittest
 import re
 
 import pandas as pd
 import pandas.util.testing as pdt
+import yaml
 
 import qiime2
 from qiime2.plugins import dummy_plugin
+import qiime2.core.archive.provenance as provenance
+from qiime2.core.archive.format.util import artifact_version
 from qiime2.core.testing.type import IntSequence1, Mapping
 
 
 class TestProvenanceIntegration(unittest.TestCase):
+    def test_data_transfer(self):
+        def data_transfer(artifact):
+            p_dir = artifact._archiver.provenance_dir
+            with (p_dir / 'action' / 'action.yaml').open() as fh:
+                match = re.search(r'^    data-transfer: (\w+)$', fh.read(),
+                                  flags=re.MULTILINE)
+            return match.group(1) if match else None
+
+        # Transformed views are moved into the archive
+        a = qiime2.Artifact.import_data('IntSequence1', [1, 2, 3])
+        self.assertEqual(data_transfer(a), 'rename')
+
+        # Pipelines alias the data of their outputs
+        b = dummy_plugin.actions.typical_pipeline(
+            a, qiime2.Artifact.import_data('Mapping', {'a': '42'}),
+            do_extra_thing=True).out_map
+        self.assertIn(data_transfer(b), ('hardlink', 'reflink', 'copy'))
+
+        with artifact_version(5):
+            a = qiime2.Artifact.import_data('IntSequence1', [1, 2, 3])
+        self.assertIsNone(data_transfer(a))
+
     def test_chain_with_metadata(self):
         df = pd.DataFrame({'a': ['1', '2', '3']},
                           index=pd.Index(['0', '1', '2'], name='feature ID'))
@@ -239,5 +269,204 @@ class TestProvenanceIntegration(unittest.TestCase):
         self.assertIn('action: split_ints', actual_method_yaml)
 
 
+class TestAncestors(unittest.TestCase):
+    def node_file(self, artifact, uuid):
+        p_dir = artifact._archiver.provenance_dir
+        return str(p_dir / 'artifacts' / str(uuid) / 'action' / 'action.yaml')
+
+    def test_ancestors_are_shared(self):
+        concatenate_ints = dummy_plugin.actions.concatenate_ints
+        a = qiime2.Artifact.import_data('IntSequence1', [1, 2, 3])
+        s = qiime2.Artifact.import_data('IntSequence2', [4, 5])
+        b = concatenate_ints(a, a, s, 1, 2).concatenated_ints
+        c1 = concatenate_ints(b, b, s, 4, 6).concatenated_ints
+        c2 = concatenate_ints(a, b, s, 1, 2).concatenated_ints
+
+        # Every copy of an ancestor is the same file
+        for uuid in a.uuid, b.uuid, s.uuid:
+            self.assertTrue(os.path.samefile(self.node_file(c1, uuid),
+                                             self.node_file(c2, uuid)))
+
+        # Ancestors don't keep their own ancestors, those are shared too
+        p_dir = c1._archiver.provenance_dir
+        self.assertFalse(
+            (p_dir / 'artifacts' / str(b.uuid) / 'artifacts').exists())
+        self.assertTrue((p_dir / 'artifacts' / str(a.uuid)).exists())
+
+    def test_fork_shares_base(self):
+        concatenate_ints = dummy_plugin.actions.concatenate_ints
+        a = qiime2.Artifact.import_data('IntSequence1', [1, 2, 3])
+        s = qiime2.Artifact.import_data('IntSequence2', [4, 5])
+        b = concatenate_ints(a, a, s, 1, 2).concatenated_ints
+
+        capture = provenance.ImportProvenanceCapture()
+        capture.add_ancestor(b)
+        forks = [capture.fork(), capture.fork()]
+        del capture
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for idx, forked in enumerate(forks):
+                # Nothing is copied until the fork is finalized
+                self.assertEqual(list(forked.ancestor_dir.iterdir()), [])
+                self.assertEqual(forked.add_ancestor(a), str(a.uuid))
+                self.assertEqual(list(forked.ancestor_dir.iterdir()), [])
+
+                final_path = pathlib.Path(temp_dir) / str(idx)
+                final_path.mkdir()
+                forked.finalize(final_path, [])
+
+                self.assertEqual(
+                    {p.name for p in (final_path / 'artifacts').iterdir()},
+                    {str(a.uuid), str(b.uuid), str(s.uuid)})
+                self.assertTrue((final_path / 'action' / 'action.yaml')
+                                .exists())
+                with open(str(final_path / 'artifacts' / str(b.uuid) /
+                              'action' / 'action.yaml')) as fh:
+                    self.assertIn('action: concatenate_ints', fh.read())
+
+
+class TestEnvironment(unittest.TestCase):
+    def action_yaml(self, artifact):
+        p_dir = artifact._archiver.provenance_dir
+        with (p_dir / 'action' / 'action.yaml').open() as fh:
+            return fh.read()
+
+    def test_shared_environment(self):
+        a = qiime2.Artifact.import_data('IntSequence1', [1, 2, 3])
+        s = qiime2.Artifact.import_data('IntSequence2', [4, 5])
+        b = dummy_plugin.actions.concatenate_ints(
+            a, a, s, 1, 2).concatenated_ints
+
+        match = re.search(r"^    python-packages: !environment '?(\w+)'?$",
+                          self.action_yaml(b), flags=re.MULTILINE)
+        self.assertIsNotNone(match)
+        digest = match.group(1)
+
+        p_dir = b._archiver.provenance_dir
+        env_fp = p_dir / 'environments' / (digest + '.yaml')
+        with env_fp.open() as fh:
+            self.assertTrue(fh.read().startswith('    python-packages:\n'))
+        # The ancestors ran in the same process, so it is the only one
+        self.assertEqual([fp.name for fp in env_fp.parent.iterdir()],
+                         [env_fp.name])
+        self.assertFalse(
+            (p_dir / 'artifacts' / str(a.uuid) / 'environments').exists())
+
+    def test_inline_environment(self):
+        with artifact_version(8):
+            a = qiime2.Artifact.import_data('IntSequence1', [1, 2, 3])
+
+        action_yaml = self.action_yaml(a)
+        self.assertNotIn('!environment', action_yaml)
+        self.assertIn('\n    python-packages:\n        ', action_yaml)
+        self.assertFalse(
+            (a._archiver.provenance_dir / 'environments').exists())
+
+    def test_snapshot_is_cached(self):
+        self.assertIs(provenance._python_packages(),
+                      provenance._python_packages())
+        capture = provenance.ProvenanceCapture()
+        self.assertEqual(list(capture.capture_env().items()),
+                         list(provenance._python_packages()))
+
+
+class TestProvenanceYAML(unittest.TestCase):
+    SETTINGS = dict(default_flow_style=False, indent=4)
+
+    def dump(self, loaded, **kwargs):
+        # action.yaml has one document per section, separated by blank lines
+        return '\n'.join(yaml.dump({key: value}, **kwargs, **self.SETTINGS)
+                         for key, value in loaded.items())
+
+    def assertRoundTrip(self, action_yaml):
+        loaded = yaml.load(action_yaml, Loader=provenance.ProvenanceLoader)
+        self.assertEqual(
+            self.dump(loaded, Dumper=provenance.ProvenanceDumper),
+            action_yaml)
+        # The pure-Python dumper writes exactly the same YAML
+        self.assertEqual(self.dump(loaded, Dumper=yaml.Dumper), action_yaml)
+        return loaded
+
+    def read_action_yaml(self, artifact):
+        p_dir = artifact._archiver.provenance_dir
+        with (p_dir / 'action' / 'action.yaml').open() as fh:
+            return fh.read()
+
+    def test_round_trip_actions(self):
+        df = pd.DataFrame({'a': ['1', '2', '3']},
+                          index=pd.Index(['0', '1', '2'], name='feature ID'))
+        a = qiime2.Artifact.import_data('IntSequence1', [1, 2, 3])
+        m = qiime2.Artifact.import_data('Mapping', {'a': '42'})
+        results = [
+            a,
+            dummy_plugin.actions.identity_with_metadata(
+                a, qiime2.Metadata(df)).out,
+            dummy_plugin.actions.most_common_viz(a).visualization,
+            dummy_plugin.actions.typical_pipeline(
+                a, m, do_extra_thing=True).out_map,
+        ]
+        for result in results:
+            self.assertRoundTrip(self.read_action_yaml(result))
+
+        with artifact_version(5):
+            a = qiime2.Artifact.import_data('IntSequence1', [1, 2, 3])
+        self.assertRoundTrip(self.read_action_yaml(a))
+
+    def test_custom_tags(self):
+        data = collections.OrderedDict([
+            ('execution', collections.OrderedDict([
+                ('uuid', 'b3f1c7a0-0000-4000-8000-000000000000'),
+                ('start', datetime.datetime(
+                    2019, 1, 2, 3, 4, 5, 6789,
+                    tzinfo=datetime.timezone(datetime.timedelta(hours=-7))))
+            ])),
+            ('action', collections.OrderedDict([
+                ('inputs', [
+                    {'ints': provenance.NoProvenance('some-uuid')},
+                    {'other': None}]),
+                ('parameters', [
+                    {'metadata': provenance.MetadataPath('metadata.tsv')},
+                    {'color': provenance.ColorPrimitive('#ff00ff')},
+                    {'letters': {'a'}},
+                    {'quote': provenance.ForwardRef("it's")},
+                    {'number': '42'}]),
+                ('citations', [provenance.CitationKey('action|dummy:0|0')]),
+            ])),
+            ('environment', collections.OrderedDict([
+                ('python', provenance.LiteralString('3.6.7\n[GCC 7.3.0]')),
+                ('plugins', collections.OrderedDict([
+                    ('dummy', provenance.ForwardRef(
+                        'environment:plugins:dummy'))])),
+                ('python-packages', provenance.EnvironmentRef('abc123')),
+            ])),
+        ])
+        action_yaml = self.dump(data, Dumper=yaml.Dumper)
+        self.assertIn("metadata: !metadata 'metadata.tsv'", action_yaml)
+        self.assertIn("- !cite 'action|dummy:0|0'", action_yaml)
+
+        loaded = self.assertRoundTrip(action_yaml)
+        self.assertEqual(loaded, data)
+        self.assertIsInstance(loaded['environment']['python'],
+                              provenance.LiteralString)
+
+    def test_double_quoted_strings(self):
+        # These need double quotes, which libyaml folds differently when they
+        # are long.
+        strings = ['a\tb ' * 30, '\u00e9' * 100, 'x\x07y',
+                   '\u00fc long ' * 20]
+        data = collections.OrderedDict([
+            ('action', collections.OrderedDict([
+                ('parameters', [{'str%d' % i: string}
+                                for i, string in enumerate(strings)]),
+            ])),
+        ])
+        action_yaml = self.dump(data, Dumper=yaml.Dumper)
+        self.assertEqual(
+            self.dump(data, Dumper=provenance.ProvenanceDumper), action_yaml)
+
+        loaded = self.assertRoundTrip(action_yaml)
+        self.assertEqual(loaded, data)
+
+
 if __name__ == '__main__':
     unittest.main()
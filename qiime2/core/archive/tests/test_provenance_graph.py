@@ -0,0 +1,211 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2019, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+
+import qiime2
+from qiime2.plugins import dummy_plugin
+from qiime2.core.archive import ProvenanceGraph
+from qiime2.core.archive.provenance import MetadataPath
+from qiime2.core.archive.format.util import artifact_version
+
+
+class TestProvenanceGraph(unittest.TestCase):
+    def setUp(self):
+        prefix = "qiime2-test-temp-"
+        self.temp_dir = tempfile.TemporaryDirectory(prefix=prefix)
+
+        concatenate_ints = dummy_plugin.actions.concatenate_ints
+        self.a = qiime2.Artifact.import_data('IntSequence1', [1, 2, 3])
+        self.s = qiime2.Artifact.import_data('IntSequence2', [4, 5])
+        self.b = concatenate_ints(self.a, self.a, self.s, 1, 2) \
+            .concatenated_ints
+        self.c = concatenate_ints(self.b, self.a, self.s, 3, 4) \
+            .concatenated_ints
+        self.other = qiime2.Artifact.import_data('IntSequence1', [6])
+
+        self.fps = []
+        for name in 'a', 's', 'b', 'c', 'other':
+            fp = os.path.join(self.temp_dir.name, name + '.qza')
+            getattr(self, name).save(fp)
+            self.fps.append(fp)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def uuids(self, *results):
+        return {str(result.uuid) for result in results}
+
+    def test_refresh(self):
+        with ProvenanceGraph() as graph:
+            uuids = graph.refresh(self.fps + ['missing.qza'])
+
+            self.assertEqual(uuids[:-1], [str(r.uuid) for r in (
+                self.a, self.s, self.b, self.c, self.other)])
+            self.assertIsInstance(uuids[-1], Exception)
+            self.assertEqual(len(graph), 5)
+            self.assertIn(self.a.uuid, graph)
+            self.assertEqual(graph.archives()[os.path.abspath(self.fps[3])],
+                             str(self.c.uuid))
+
+    def test_queries(self):
+        with ProvenanceGraph() as graph:
+            graph.refresh(self.fps)
+
+            self.assertEqual(graph.parents(self.b.uuid),
+                             self.uuids(self.a, self.s))
+            self.assertEqual(graph.children(self.a.uuid),
+                             self.uuids(self.b, self.c))
+            self.assertEqual(graph.ancestors(self.c.uuid),
+                             self.uuids(self.a, self.s, self.b))
+            self.assertEqual(graph.descendants(self.a.uuid),
+                             self.uuids(self.b, self.c))
+            self.assertEqual(graph.descendants(self.c.uuid), set())
+            self.assertEqual(
+                graph.select_descendants(self.s.uuid, [
+                    self.c.uuid, self.other.uuid, self.b.uuid]),
+                [self.c.uuid, self.b.uuid])
+
+    def test_get(self):
+        with ProvenanceGraph() as graph:
+            graph.refresh(self.fps)
+
+            node = graph.get(self.c.uuid)
+            self.assertEqual(node.type, 'IntSequence1')
+            self.assertEqual(node.action_type, 'method')
+            self.assertEqual(node.plugin, 'dummy-plugin')
+            self.assertEqual(node.action, 'concatenate_ints')
+            self.assertEqual(node.output_name, 'concatenated_ints')
+            self.assertEqual(node.inputs['ints1'], str(self.b.uuid))
+            self.assertEqual(graph.parameters(self.c.uuid),
+                             {'int1': 3, 'int2': 4})
+
+            node = graph.get(self.a.uuid)
+            self.assertEqual(node.action_type, 'import')
+            self.assertEqual(node.inputs, {})
+
+            with self.assertRaisesRegex(KeyError, 'not in the provenance'):
+                graph.get('not-a-uuid')
+
+    def test_metadata_parameter(self):
+        m = qiime2.Artifact.import_data('Mapping', {'a': 'foo'})
+        b = dummy_plugin.actions.identity_with_metadata(
+            self.a, m.view(qiime2.Metadata)).out
+        fp = os.path.join(self.temp_dir.name, 'metadata.qza')
+        b.save(fp)
+
+        with ProvenanceGraph() as graph:
+            graph.refresh([fp])
+            self.assertEqual(graph.parameters(b.uuid)['metadata'],
+                             MetadataPath(str(m.uuid) + ':metadata.tsv'))
+
+    def test_pipeline_alias(self):
+        result = dummy_plugin.actions.typical_pipeline(
+            self.a, qiime2.Artifact.import_data('Mapping', {'a': '42'}),
+            do_extra_thing=True).out_map
+        fp = os.path.join(self.temp_dir.name, 'pipeline.qza')
+        result.save(fp)
+
+        with ProvenanceGraph() as graph:
+            graph.refresh([fp])
+            node = graph.get(result.uuid)
+            self.assertEqual(node.action_type, 'pipeline')
+            self.assertEqual(len(graph.parents(result.uuid)), 2)
+
+    def test_format_v0(self):
+        with artifact_version(0):
+            a = qiime2.Artifact.import_data('IntSequence1', [1, 2, 3])
+        fp = os.path.join(self.temp_dir.name, 'v0.qza')
+        a.save(fp)
+
+        with ProvenanceGraph() as graph:
+            self.assertEqual(graph.refresh([fp]), [str(a.uuid)])
+            node = graph.get(a.uuid)
+            self.assertIsNone(node.action_type)
+            self.assertEqual(graph.ancestors(a.uuid), set())
+
+    def test_incremental_refresh(self):
+        index = os.path.join(self.temp_dir.name, 'index.sqlite')
+        with ProvenanceGraph(index) as graph:
+            graph.refresh(self.fps[:3])
+
+        with ProvenanceGraph(index) as graph:
+            self.assertEqual(len(graph), 3)
+            with mock.patch.object(ProvenanceGraph, '_read_archive',
+                                   wraps=graph._read_archive) as read:
+                graph.refresh(self.fps)
+            # Only the new archives are read, and only their new nodes
+            self.assertEqual(read.call_count, 2)
+            self.assertEqual(len(graph), 5)
+            self.assertEqual(graph.ancestors(self.c.uuid),
+                             self.uuids(self.a, self.s, self.b))
+
+            # A changed archive is read again
+            self.other.save(self.fps[0])
+            with mock.patch.object(ProvenanceGraph, '_read_archive',
+                                   wraps=graph._read_archive) as read:
+                uuids = graph.refresh(self.fps)
+            self.assertEqual(read.call_count, 1)
+            self.assertEqual(uuids[0], str(self.other.uuid))
+
+    def test_refresh_prunes_deleted_archives(self):
+        index = os.path.join(self.temp_dir.name, 'index.sqlite')
+        with ProvenanceGraph(index) as graph:
+            graph.refresh(self.fps)
+
+        # `a` is also an ancestor in `b` and `c`, but `other` is only in its
+        # own archive.
+        os.remove(self.fps[0])
+        os.remove(self.fps[4])
+        with ProvenanceGraph(index) as graph:
+            graph.refresh([])
+
+            archives = graph.archives()
+            self.assertNotIn(os.path.abspath(self.fps[0]), archives)
+            self.assertNotIn(os.path.abspath(self.fps[4]), archives)
+            self.assertEqual(len(archives), 3)
+
+            self.assertNotIn(self.other.uuid, graph)
+            self.assertEqual(len(graph), 4)
+            self.assertIn(graph.get(self.a.uuid).archive,
+                          [os.path.abspath(fp) for fp in self.fps[2:4]])
+            self.assertEqual(graph.ancestors(self.c.uuid),
+                             self.uuids(self.a, self.s, self.b))
+
+            # Once nothing contains them, nodes and their edges are gone.
+            for fp in self.fps[1:4]:
+                os.remove(fp)
+            self.assertEqual(graph.refresh([]), [])
+            self.assertEqual(len(graph), 0)
+            self.assertEqual(graph.archives(), {})
+            self.assertEqual(graph.parents(self.c.uuid), set())
+            self.assertEqual(graph.children(self.a.uuid), set())
+
+    def test_refresh_prunes_replaced_archives(self):
+        with ProvenanceGraph() as graph:
+            graph.refresh(self.fps[4:])
+            self.assertIn(self.other.uuid, graph)
+
+            # Same path, different archive
+            self.b.save(self.fps[4])
+            os.utime(self.fps[4], ns=(0, 0))
+            uuids = graph.refresh(self.fps[4:])
+
+            self.assertEqual(uuids, [str(self.b.uuid)])
+            self.assertNotIn(self.other.uuid, graph)
+            self.assertEqual(graph.archives(),
+                             {os.path.abspath(self.fps[4]): str(self.b.uuid)})
+            self.assertEqual(graph.ancestors(self.b.uuid),
+                             self.uuids(self.a, self.s))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,12 +9,55 @@
 import os
 import pkg_resources
 import collections
+import functools
 
 import bibtexparser as bp
 
 CitationRecord = collections.namedtuple('CitationRecord', ['type', 'fields'])
 
 
+# Citation databases are loaded by every plugin (and by every archive using
+# format v4+), and rarely change, so they are only parsed again when the file
+# has been modified.
+@functools.lru_cache(maxsize=256)
+def _parse(path, mtime_ns, size):
+    parser = bp.bparser.BibTexParser()
+    # Downstream tooling is much easier with unicode. For actual latex
+    # users, use the modern biber backend instead of bibtex
+    parser.customization = bp.customization.convert_to_unicode
+    with open(path) as fh:
+        try:
+            db = bp.load(fh, parser=parser)
+        except Exception as e:
+            raise ValueError("There was a problem loading the BiBTex file:"
+                             "%r" % path) from e
+
+    entries = collections.OrderedDict()
+    for entry in db.entries:
+        id_ = entry.pop('ID')
+        type_ = entry.pop('ENTRYTYPE')
+        if id_ in entries:
+            raise ValueError("Duplicate entry-key found in BibTex file: %r"
+                             % id_)
+        entries[id_] = (type_, tuple(entry.items()))
+
+    return tuple(entries.items())
+
+
+# The same citations are saved with every result, under the same keys, so
+# each entry is only rendered once. BibTexWriter renders each entry on its
+# own, so the rendered entries can simply be concatenated.
+@functools.lru_cache(maxsize=4096)
+def _render(key, type_, fields):
+    entry = dict(fields)
+    entry['ID'] = key
+    entry['ENTRYTYPE'] = type_
+
+    db = bp.bibdatabase.BibDatabase()
+    db.entries = [entry]
+    return bp.dumps(db, writer=bp.bwriter.BibTexWriter())
+
+
 class Citations(collections.OrderedDict):
     @classmethod
     def load(cls, path, package=None):
@@ -23,52 +66,27 @@ class Citations(collections.OrderedDict):
             root = os.path.abspath(root)
             path = os.path.join(root, path)
 
-        parser = bp.bparser.BibTexParser()
-        # Downstream tooling is much easier with unicode. For actual latex
-        # users, use the modern biber backend instead of bibtex
-        parser.customization = bp.customization.convert_to_unicode
-        with open(path) as fh:
-            try:
-                db = bp.load(fh, parser=parser)
-            except Exception as e:
-                raise ValueError("There was a problem loading the BiBTex file:"
-                                 "%r" % path) from e
-
-        entries = collections.OrderedDict()
-        for entry in db.entries:
-            id_ = entry.pop('ID')
-            type_ = entry.pop('ENTRYTYPE')
-            if id_ in entries:
-                raise ValueError("Duplicate entry-key found in BibTex file: %r"
-                                 % id_)
-            entries[id_] = CitationRecord(type_, entry)
-
-        return cls(entries)
+        stat = os.stat(path)
+        entries = _parse(os.path.abspath(path), stat.st_mtime_ns,
+                         stat.st_size)
+        # Each load gets its own fields, which the caller may modify
+        return cls((id_, CitationRecord(type_, dict(fields)))
+                   for id_, (type_, fields) in entries)
 
     def __iter__(self):
         return iter(self.values())
 
     def save(self, f):
-        entries = []
-        for key, citation in self.items():
-            entry = citation.fields.copy()
-            entry['ID'] = key
-            entry['ENTRYTYPE'] = citation.type
-
-            entries.append(entry)
-
-        db = bp.bibdatabase.BibDatabase()
-        db.entries = entries
-
-        writer = bp.bwriter.BibTexWriter()
-        writer.order_entries_by = tuple(self.keys())
+        bibtex = ''.join(
+            _render(key, citation.type, tuple(citation.fields.items()))
+            for key, citation in self.items())
 
         owned = False
         if type(f) is str:
             f = open(f, 'w')
             owned = True
         try:
-            bp.dump(db, f, writer=writer)
+            f.write(bibtex)
         finally:
             if owned:
                 f.close()
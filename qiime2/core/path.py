@@ -6,17 +6,299 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import collections
+import errno
+import mmap
 import os
 import pathlib
 import shutil
-import distutils
 import tempfile
+import threading
 import weakref
 
+from qiime2.core.exceptions import ScratchSpaceError
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 
 _ConcretePath = type(pathlib.Path())
 
 
+def map_file(path):
+    """Return a read-only memoryview of the contents of `path`."""
+    with open(str(path), 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            # Empty files cannot be mapped
+            return memoryview(b'')
+        mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped)
+
+
+# How data was transferred, from cheapest to most expensive
+RENAME = 'rename'
+HARDLINK = 'hardlink'
+REFLINK = 'reflink'
+COPY = 'copy'
+TRANSFER_STRATEGIES = (RENAME, HARDLINK, REFLINK, COPY)
+
+# _IOW(0x94, 9, int) from linux/fs.h, supported by btrfs, XFS, and others
+_FICLONE = 0x40049409
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        return False
+    # Clone into a new file which then replaces `dst`, as `dst` may share its
+    # inode (e.g. a hardlink) with a file that mustn't change.
+    fd, tmp = tempfile.mkstemp(prefix='.%s.' % os.path.basename(dst),
+                               dir=os.path.dirname(dst) or '.')
+    try:
+        with open(src, 'rb') as src_fh, open(fd, 'wb') as dst_fh:
+            fcntl.ioctl(dst_fh.fileno(), _FICLONE, src_fh.fileno())
+        os.replace(tmp, dst)
+    except OSError:
+        os.unlink(tmp)
+        return False
+    return True
+
+
+# The umask can only be read by setting it, which isn't safe to do once other
+# threads may be creating files.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def clone_file(src, dst, immutable=False, fresh=False):
+    """Copy the file `src` to `dst` as cheaply as possible.
+
+    A copy-on-write clone (reflink) is tried first. If the filesystem doesn't
+    support them and `immutable` is True (neither file will be modified
+    afterwards), a hardlink is tried next. Otherwise the bytes are copied.
+    Like shutil.copy2, `dst` is overwritten and may be a directory.
+
+    If `fresh` is True, `dst` gets the permissions of a newly created file
+    instead of the metadata of `src` (e.g. when `src` is read-only), and is
+    never hardlinked.
+
+    Returns the strategy which was used.
+
+    """
+    src, dst = str(src), str(dst)
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+
+    if _reflink(src, dst):
+        if fresh:
+            os.chmod(dst, 0o666 & ~_UMASK)
+        else:
+            shutil.copystat(src, dst)
+        return REFLINK
+
+    # Neither a hardlink nor a copy should write through to the inode of an
+    # existing `dst`.
+    if os.path.lexists(dst):
+        os.unlink(dst)
+
+    if immutable and not fresh:
+        try:
+            os.link(src, dst)
+            return HARDLINK
+        except OSError:
+            pass
+
+    if fresh:
+        shutil.copyfile(src, dst)
+    else:
+        shutil.copy2(src, dst)
+    return COPY
+
+
+def clone_tree(src, dst, immutable=False, fresh=False):
+    """Copy the directory `src` into `dst` (which may exist) like clone_file.
+
+    Returns the most expensive strategy used, or None if there were no files.
+
+    """
+    def raise_error(error):
+        raise error
+
+    src, dst = str(src), str(dst)
+    strategies = set()
+    for root, _, files in os.walk(src, onerror=raise_error, followlinks=True):
+        target = os.path.normpath(os.path.join(dst,
+                                               os.path.relpath(root, src)))
+        os.makedirs(target, exist_ok=True)
+        for file in files:
+            strategies.add(clone_file(os.path.join(root, file),
+                                      os.path.join(target, file),
+                                      immutable=immutable, fresh=fresh))
+
+    if not strategies:
+        return None
+    return max(strategies, key=TRANSFER_STRATEGIES.index)
+
+
+def clone(src, dst, immutable=False):
+    """Copy a file or directory using clone_file or clone_tree."""
+    if os.path.isdir(str(src)):
+        return clone_tree(src, dst, immutable=immutable)
+    return clone_file(src, dst, immutable=immutable)
+
+
+def move(src, dst):
+    """Rename `src` to `dst`, even when they are on different filesystems.
+
+    Returns the strategy which was used.
+
+    """
+    src, dst = str(src), str(dst)
+    try:
+        os.rename(src, dst)
+        return RENAME
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    strategy = clone(src, dst)
+    if os.path.isdir(src):
+        shutil.rmtree(src)
+    else:
+        os.unlink(src)
+    return strategy
+
+
+class ScratchManager:
+    """Decides where temporary files and directories are created.
+
+    Roots are configured by the environment as lists separated by
+    `os.pathsep`: ``QIIME2_ARCHIVE_SCRATCH`` is used for archives and the
+    outputs of transformers (which are moved into archives, so they should
+    be on the same filesystem), ``QIIME2_PROVENANCE_SCRATCH`` for
+    provenance, and ``QIIME2_SCRATCH`` for anything not otherwise
+    configured. Without any of these, the system's temporary directory is
+    used.
+
+    ``QIIME2_SCRATCH_BUDGET`` limits the bytes this process may have in each
+    root and ``QIIME2_SCRATCH_RESERVE`` is the number of bytes to always
+    leave free on each root. New paths are created in the first root which
+    satisfies both, so later roots are spill space. When none do, a
+    ScratchSpaceError is raised instead of running out of space partway
+    through a job. The bytes of a path are counted when it is `update`d
+    (e.g. once an archive has been written to it) and uncounted when it is
+    released, so choosing a root doesn't have to walk every live path.
+
+    """
+    ROOTS_ENVVAR = 'QIIME2_SCRATCH'
+    KIND_ENVVARS = {
+        'archive': 'QIIME2_ARCHIVE_SCRATCH',
+        'provenance': 'QIIME2_PROVENANCE_SCRATCH'
+    }
+    BUDGET_ENVVAR = 'QIIME2_SCRATCH_BUDGET'
+    RESERVE_ENVVAR = 'QIIME2_SCRATCH_RESERVE'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Live paths created by this process, mapped to their root
+        self._live = {}
+        # Bytes of each live path when it was last updated, and their totals
+        # for each root
+        self._sizes = {}
+        self._usage = collections.Counter()
+
+    def roots(self, kind):
+        for envvar in self.KIND_ENVVARS.get(kind), self.ROOTS_ENVVAR:
+            value = os.environ.get(envvar) if envvar else None
+            if value:
+                return [root for root in value.split(os.pathsep) if root]
+        return [tempfile.gettempdir()]
+
+    def _get_bytes(self, envvar):
+        value = os.environ.get(envvar)
+        return int(value) if value else None
+
+    def usage(self, root):
+        """Bytes used by the live paths this process created in `root`."""
+        with self._lock:
+            return self._usage[root]
+
+    def update(self, path):
+        """Count the bytes now in `path` (which this process created).
+
+        Nothing is measured when there is no budget to count against.
+
+        """
+        path = str(path)
+        if self._get_bytes(self.BUDGET_ENVVAR) is None:
+            return
+        with self._lock:
+            if path not in self._live:
+                return
+
+        size = 0
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                for filename in filenames:
+                    try:
+                        size += os.lstat(
+                            os.path.join(dirpath, filename)).st_size
+                    except FileNotFoundError:
+                        pass
+        elif os.path.exists(path):
+            size = os.path.getsize(path)
+
+        with self._lock:
+            # It may have been released in the meantime
+            if path in self._live:
+                self._usage[self._live[path]] += \
+                    size - self._sizes.get(path, 0)
+                self._sizes[path] = size
+
+    def _choose_root(self, kind):
+        budget = self._get_bytes(self.BUDGET_ENVVAR)
+        reserve = self._get_bytes(self.RESERVE_ENVVAR)
+        roots = self.roots(kind)
+        for root in roots:
+            os.makedirs(root, exist_ok=True)
+            if budget is not None and self.usage(root) >= budget:
+                continue
+            if reserve is not None and \
+                    shutil.disk_usage(root).free < reserve:
+                continue
+            return root
+
+        raise ScratchSpaceError(
+            errno.ENOSPC, "No scratch space left for %s data in %s (budget:"
+            " %r bytes, reserve: %r bytes)." % (kind, os.pathsep.join(roots),
+                                                budget, reserve))
+
+    def _track(self, path, root):
+        with self._lock:
+            self._live[path] = root
+        return path
+
+    def mkdtemp(self, kind, **kwargs):
+        root = self._choose_root(kind)
+        return self._track(tempfile.mkdtemp(dir=root, **kwargs), root)
+
+    def mkstemp(self, kind, **kwargs):
+        root = self._choose_root(kind)
+        fd, path = tempfile.mkstemp(dir=root, **kwargs)
+        return fd, self._track(path, root)
+
+    def release(self, path):
+        with self._lock:
+            root = self._live.pop(path, None)
+            size = self._sizes.pop(path, 0)
+            if root is not None:
+                self._usage[root] -= size
+
+
+_SCRATCH = ScratchManager()
+
+
 def _party_parrot(self, *args):
     raise TypeError("Cannot mutate %r." % self)
 
@@ -29,12 +311,9 @@ class OwnedPath(_ConcretePath):
 
     def _move_or_copy(self, other):
         if self._user_owned:
-            if self.is_dir():
-                return distutils.dir_util.copy_tree(str(self), str(other))
-            else:
-                return shutil.copy(str(self), str(other))
+            return clone(self, other)
         else:
-            return _ConcretePath.rename(self, other)
+            return move(self, other)
 
 
 class InPath(OwnedPath):
@@ -57,8 +336,12 @@ class InPath(OwnedPath):
 
 
 class OutPath(OwnedPath):
+    # Outputs are usually moved into archives
+    SCRATCH_KIND = 'archive'
+
     @classmethod
     def _destruct(cls, path):
+        _SCRATCH.release(path)
         if not os.path.exists(path):
             return
 
@@ -72,9 +355,9 @@ class OutPath(OwnedPath):
         Create a tempfile, return pathlib.Path reference to it.
         """
         if dir:
-            name = tempfile.mkdtemp(**kwargs)
+            name = _SCRATCH.mkdtemp(cls.SCRATCH_KIND, **kwargs)
         else:
-            fd, name = tempfile.mkstemp(**kwargs)
+            fd, name = _SCRATCH.mkstemp(cls.SCRATCH_KIND, **kwargs)
             # fd is now assigned to our process table, but we don't need to do
             # anything with the file. We will call `open` on the `name` later
             # producing a different file descriptor, so close this one to
@@ -91,10 +374,12 @@ class OutPath(OwnedPath):
 
 class InternalDirectory(_ConcretePath):
     DEFAULT_PREFIX = 'qiime2-'
+    SCRATCH_KIND = None
 
     @classmethod
     def _destruct(cls, path):
         """DO NOT USE DIRECTLY, use `_destructor()` instead"""
+        _SCRATCH.release(path)
         if os.path.exists(path):
             shutil.rmtree(path)
 
@@ -116,10 +401,23 @@ class InternalDirectory(_ConcretePath):
                 prefix = cls.DEFAULT_PREFIX
             elif not prefix.startswith(cls.DEFAULT_PREFIX):
                 prefix = cls.DEFAULT_PREFIX + prefix
-            # TODO: normalize when temp-directories are configurable
-            path = tempfile.mkdtemp(prefix=prefix)
+            path = _SCRATCH.mkdtemp(cls.SCRATCH_KIND, prefix=prefix)
             return cls.__new(path)
 
+    def _update_usage(self):
+        """Count what has been written here against the scratch budget."""
+        _SCRATCH.update(self)
+
+    def _detach(self):
+        """Give up this directory without removing it.
+
+        It is no longer removed by `_destructor` or counted against the
+        scratch budget, as whoever it was handed to is now responsible for it.
+
+        """
+        self._destructor.detach()
+        _SCRATCH.release(str(self))
+
     def __truediv__(self, path):
         # We don't want to create self-destructing paths when using the join
         # operator
@@ -132,7 +430,9 @@ class InternalDirectory(_ConcretePath):
 
 class ArchivePath(InternalDirectory):
     DEFAULT_PREFIX = 'qiime2-archive-'
+    SCRATCH_KIND = 'archive'
 
 
 class ProvenancePath(InternalDirectory):
     DEFAULT_PREFIX = 'qiime2-provenance-'
+    SCRATCH_KIND = 'provenance'
@@ -73,10 +73,13 @@ dummy_plugin.register_formats(
     citations=[citations['baerheim1994effect']])
 
 dummy_plugin.register_views(
-    int, IntSequenceFormat, IntSequenceDirectoryFormat,
+    IntSequenceFormat, IntSequenceDirectoryFormat,
     SingleIntFormat, RedundantSingleIntDirectoryFormat,
     citations=[citations['mayer2012walking']])
 
+dummy_plugin.register_views(
+    int, citations=[citations['mayer2012walking']], cache='immutable')
+
 dummy_plugin.register_semantic_type_to_format(
     IntSequence1,
     artifact_format=IntSequenceDirectoryFormat
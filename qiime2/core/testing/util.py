@@ -11,6 +11,7 @@ import os.path
 import zipfile
 
 import qiime2.sdk
+from qiime2.core.archive.provenance import _python_packages, _render_block
 
 
 def get_dummy_plugin():
@@ -24,6 +25,18 @@ def get_dummy_plugin():
     return plugin_manager.plugins['dummy-plugin']
 
 
+def get_environment_member(provenance_dir='provenance'):
+    """Return the member of an archive which has this process's packages.
+
+    Since archive version 9, the Python packages of every action are written
+    once to ``provenance/environments``, named for their digest, so the name
+    depends on what is installed.
+
+    """
+    _, digest = _render_block('python-packages', _python_packages())
+    return '%s/environments/%s.yaml' % (provenance_dir, digest)
+
+
 class ArchiveTestingMixin:
     """Mixin for testing properties of archives created by Archiver."""
 
@@ -48,7 +61,10 @@ class ArchiveTestingMixin:
         archive_filepath = str(archive_filepath)
         root_dir = str(root_dir)
         with zipfile.ZipFile(archive_filepath, mode='r') as zf:
-            observed = set(zf.namelist())
+            # Hidden members next to the root directory (e.g. the member
+            # index) are bookkeeping for readers, not contents of the archive.
+            observed = {name for name in zf.namelist()
+                        if not name.startswith('.')}
 
         # Path separator '/' is hardcoded because paths in the zipfile will
         # always use this separator.
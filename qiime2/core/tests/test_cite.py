@@ -0,0 +1,92 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2019, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import io
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+
+import bibtexparser as bp
+
+import qiime2.core.cite as cite
+from qiime2.core.cite import Citations
+
+
+class TestCitations(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory(
+            prefix='qiime2-test-temp-')
+        self.fp = os.path.join(self.temp_dir.name, 'citations.bib')
+        self.write('@article{frogs,\n  title={Of flying frogs},\n'
+                   '  year={1997}\n}\n')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, bibtex):
+        with open(self.fp, 'w') as fh:
+            fh.write(bibtex)
+
+    def test_load_is_cached(self):
+        with mock.patch.object(bp, 'load', wraps=bp.load) as load:
+            first = Citations.load(self.fp)
+            second = Citations.load(self.fp)
+        self.assertEqual(load.call_count, 1)
+
+        self.assertEqual(first, second)
+        self.assertEqual(first['frogs'].fields['title'], 'Of flying frogs')
+        # Each load can be modified without affecting the others
+        first['frogs'].fields['title'] = 'Of levitrons'
+        self.assertEqual(Citations.load(self.fp)['frogs'].fields['title'],
+                         'Of flying frogs')
+
+    def test_load_modified(self):
+        Citations.load(self.fp)
+        self.write('@book{coffee,\n  title={Walking with coffee}\n}\n')
+        os.utime(self.fp, ns=(0, 0))
+
+        citations = Citations.load(self.fp)
+        self.assertEqual(list(citations.keys()), ['coffee'])
+        self.assertEqual(citations['coffee'].type, 'book')
+
+    def test_load_package(self):
+        citations = Citations.load('citations.bib',
+                                   package='qiime2.core.testing')
+        self.assertIn('unger1998does', citations)
+
+    def test_save_matches_writer(self):
+        citations = Citations.load('citations.bib',
+                                   package='qiime2.core.testing')
+        citations['extra|key:0|0'] = cite.CitationRecord(
+            'misc', {'title': 'Something else', 'note': 'n'})
+
+        entries = []
+        for key, citation in citations.items():
+            entry = citation.fields.copy()
+            entry['ID'] = key
+            entry['ENTRYTYPE'] = citation.type
+            entries.append(entry)
+        db = bp.bibdatabase.BibDatabase()
+        db.entries = entries
+        writer = bp.bwriter.BibTexWriter()
+        writer.order_entries_by = tuple(citations.keys())
+        expected = bp.dumps(db, writer=writer)
+
+        for _ in range(2):
+            fh = io.StringIO()
+            citations.save(fh)
+            self.assertEqual(fh.getvalue(), expected)
+
+        citations.save(self.fp)
+        with open(self.fp) as fh:
+            self.assertEqual(fh.read(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,9 +6,16 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import errno
 import os
+import pathlib
+import shutil
+import stat
+import tempfile
 import unittest
+import unittest.mock as mock
 
+import qiime2.core.path as qpath
 from qiime2.core.path import OutPath
 
 
@@ -38,5 +45,264 @@ class TestOutPath(unittest.TestCase):
         self.assertFalse(os.path.isfile(path))
 
 
+class TestClone(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.src = pathlib.Path(self.test_dir.name) / 'src'
+        (self.src / 'nested').mkdir(parents=True)
+        (self.src / 'a.txt').write_text('a')
+        (self.src / 'nested' / 'b.txt').write_text('b')
+        self.dst = pathlib.Path(self.test_dir.name) / 'dst'
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def assertCloned(self, linked):
+        for relpath in 'a.txt', 'nested/b.txt':
+            src, dst = self.src / relpath, self.dst / relpath
+            self.assertEqual(dst.read_text(), src.read_text())
+            self.assertEqual(os.path.samefile(str(src), str(dst)), linked)
+
+    def test_clone_tree_copy(self):
+        with mock.patch.object(qpath, '_reflink', return_value=False):
+            strategy = qpath.clone_tree(self.src, self.dst)
+
+        self.assertEqual(strategy, qpath.COPY)
+        self.assertCloned(linked=False)
+
+    def test_clone_tree_hardlink_immutable(self):
+        with mock.patch.object(qpath, '_reflink', return_value=False):
+            strategy = qpath.clone_tree(self.src, self.dst, immutable=True)
+
+        self.assertEqual(strategy, qpath.HARDLINK)
+        self.assertCloned(linked=True)
+
+    def test_clone_tree_prefers_reflink(self):
+        def reflink(src, dst):
+            with open(src) as src_fh, open(dst, 'w') as dst_fh:
+                dst_fh.write(src_fh.read())
+            return True
+
+        with mock.patch.object(qpath, '_reflink', side_effect=reflink):
+            strategy = qpath.clone_tree(self.src, self.dst, immutable=True)
+
+        self.assertEqual(strategy, qpath.REFLINK)
+        self.assertCloned(linked=False)
+
+    def test_clone_tree_fresh(self):
+        for relpath in 'a.txt', 'nested/b.txt':
+            os.chmod(str(self.src / relpath), 0o444)
+
+        for reflink in (True, False):
+            def _reflink(src, dst):
+                if reflink:
+                    shutil.copyfile(src, dst)
+                return reflink
+
+            with mock.patch.object(qpath, '_reflink', side_effect=_reflink):
+                strategy = qpath.clone_tree(self.src, self.dst,
+                                            immutable=True, fresh=True)
+
+            self.assertEqual(strategy,
+                             qpath.REFLINK if reflink else qpath.COPY)
+            self.assertCloned(linked=False)
+            for relpath in 'a.txt', 'nested/b.txt':
+                mode = stat.S_IMODE((self.dst / relpath).stat().st_mode)
+                self.assertEqual(mode, 0o666 & ~qpath._UMASK)
+            shutil.rmtree(str(self.dst))
+
+    def test_clone_tree_existing_destination(self):
+        self.dst.mkdir()
+        (self.dst / 'c.txt').write_text('c')
+
+        qpath.clone_tree(self.src, self.dst)
+
+        self.assertCloned(linked=False)
+        self.assertEqual((self.dst / 'c.txt').read_text(), 'c')
+
+    def test_clone_tree_empty(self):
+        empty = pathlib.Path(self.test_dir.name) / 'empty'
+        empty.mkdir()
+
+        self.assertIsNone(qpath.clone_tree(empty, self.dst))
+        self.assertTrue(self.dst.is_dir())
+
+    def test_clone_tree_missing(self):
+        with self.assertRaises(FileNotFoundError):
+            qpath.clone_tree(self.src / 'missing', self.dst)
+
+    def test_clone_file(self):
+        self.dst.mkdir()
+
+        strategy = qpath.clone(self.src / 'a.txt', self.dst)
+
+        self.assertIn(strategy, (qpath.REFLINK, qpath.COPY))
+        self.assertEqual((self.dst / 'a.txt').read_text(), 'a')
+
+    def test_clone_file_overwrites_hardlink(self):
+        self.dst.mkdir()
+        (self.src / 'new.txt').write_text('new')
+
+        for immutable in (True, False):
+            os.link(str(self.src / 'a.txt'), str(self.dst / 'a.txt'))
+
+            qpath.clone_file(self.src / 'new.txt', self.dst / 'a.txt',
+                             immutable=immutable)
+
+            self.assertEqual((self.dst / 'a.txt').read_text(), 'new')
+            self.assertEqual((self.src / 'a.txt').read_text(), 'a')
+            os.unlink(str(self.dst / 'a.txt'))
+
+    def test_reflink_keeps_hardlinked_destination(self):
+        self.dst.mkdir()
+        os.link(str(self.src / 'a.txt'), str(self.dst / 'a.txt'))
+        (self.src / 'new.txt').write_text('new')
+
+        cloned = qpath._reflink(str(self.src / 'new.txt'),
+                                str(self.dst / 'a.txt'))
+
+        # Whether or not this filesystem supports reflinks, the file shared
+        # through the hardlink is untouched and no temporary file is left.
+        self.assertEqual((self.dst / 'a.txt').read_text(),
+                         'new' if cloned else 'a')
+        self.assertEqual((self.src / 'a.txt').read_text(), 'a')
+        self.assertEqual(os.listdir(str(self.dst)), ['a.txt'])
+
+
+class TestScratchManager(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.primary = os.path.join(self.test_dir.name, 'primary')
+        self.spill = os.path.join(self.test_dir.name, 'spill')
+        self.env = {'QIIME2_SCRATCH': os.pathsep.join([self.primary,
+                                                       self.spill])}
+        self.scratch = qpath.ScratchManager()
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_default_root(self):
+        with mock.patch.dict(os.environ, clear=True):
+            self.assertEqual(self.scratch.roots('archive'),
+                             [tempfile.gettempdir()])
+
+    def test_kind_roots(self):
+        self.env['QIIME2_PROVENANCE_SCRATCH'] = self.spill
+        with mock.patch.dict(os.environ, self.env):
+            self.assertEqual(self.scratch.roots('provenance'), [self.spill])
+            self.assertEqual(self.scratch.roots('archive'),
+                             [self.primary, self.spill])
+            self.assertEqual(self.scratch.roots(None),
+                             [self.primary, self.spill])
+
+    def test_paths_created_in_root(self):
+        with mock.patch.dict(os.environ, self.env), \
+                mock.patch.object(qpath, '_SCRATCH', self.scratch):
+            archive = qpath.ArchivePath()
+            out = OutPath()
+
+            self.assertEqual(os.path.dirname(str(archive)), self.primary)
+            self.assertEqual(os.path.dirname(str(out)), self.primary)
+            self.assertTrue(
+                os.path.basename(str(archive)).startswith('qiime2-archive-'))
+
+    def test_spill_when_over_budget(self):
+        self.env['QIIME2_SCRATCH_BUDGET'] = '10'
+        with mock.patch.dict(os.environ, self.env):
+            first = self.scratch.mkdtemp('archive')
+            self.assertEqual(os.path.dirname(first), self.primary)
+            self.assertEqual(self.scratch.usage(self.primary), 0)
+
+            with open(os.path.join(first, 'data'), 'wb') as fh:
+                fh.write(b'x' * 10)
+            self.assertEqual(self.scratch.usage(self.primary), 0)
+            self.scratch.update(first)
+            self.assertEqual(self.scratch.usage(self.primary), 10)
+
+            second = self.scratch.mkdtemp('archive')
+            self.assertEqual(os.path.dirname(second), self.spill)
+
+    def test_choosing_root_does_not_walk(self):
+        self.env['QIIME2_SCRATCH_BUDGET'] = '10'
+        with mock.patch.dict(os.environ, self.env):
+            first = self.scratch.mkdtemp('archive')
+            with open(os.path.join(first, 'data'), 'wb') as fh:
+                fh.write(b'x' * 4)
+            self.scratch.update(first)
+
+            with mock.patch.object(os, 'walk') as walk:
+                self.scratch.mkdtemp('archive')
+                self.scratch.mkdtemp('archive')
+            walk.assert_not_called()
+
+            # Measuring again only counts the difference
+            with open(os.path.join(first, 'more'), 'wb') as fh:
+                fh.write(b'x' * 2)
+            self.scratch.update(first)
+            self.assertEqual(self.scratch.usage(self.primary), 6)
+
+    def test_update_without_budget(self):
+        with mock.patch.dict(os.environ, self.env):
+            path = self.scratch.mkdtemp('archive')
+            with open(os.path.join(path, 'data'), 'wb') as fh:
+                fh.write(b'x' * 10)
+            self.scratch.update(path)
+        self.assertEqual(self.scratch.usage(self.primary), 0)
+
+    def test_out_of_space(self):
+        self.env['QIIME2_SCRATCH_BUDGET'] = '0'
+        with mock.patch.dict(os.environ, self.env):
+            with self.assertRaisesRegex(qpath.ScratchSpaceError,
+                                        'No scratch space'):
+                self.scratch.mkdtemp('archive')
+
+    def test_reserve(self):
+        self.env['QIIME2_SCRATCH_RESERVE'] = str(2**62)
+        with mock.patch.dict(os.environ, self.env):
+            with self.assertRaises(qpath.ScratchSpaceError) as cm:
+                self.scratch.mkstemp('output')
+        self.assertEqual(cm.exception.errno, errno.ENOSPC)
+
+    def test_release_on_destruct(self):
+        self.env['QIIME2_SCRATCH_BUDGET'] = '10'
+        with mock.patch.dict(os.environ, self.env), \
+                mock.patch.object(qpath, '_SCRATCH', self.scratch):
+            path = qpath.ArchivePath()
+            (path / 'data').write_bytes(b'x' * 10)
+            path._update_usage()
+            self.assertEqual(self.scratch.usage(self.primary), 10)
+
+            path._destructor()
+            self.assertEqual(self.scratch.usage(self.primary), 0)
+            self.assertEqual(
+                os.path.dirname(str(qpath.ArchivePath())), self.primary)
+
+
+class TestMove(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.src = pathlib.Path(self.test_dir.name) / 'src'
+        self.src.mkdir()
+        (self.src / 'a.txt').write_text('a')
+        self.dst = pathlib.Path(self.test_dir.name) / 'dst'
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_move(self):
+        self.assertEqual(qpath.move(self.src, self.dst), qpath.RENAME)
+        self.assertFalse(self.src.exists())
+        self.assertEqual((self.dst / 'a.txt').read_text(), 'a')
+
+    def test_move_across_filesystems(self):
+        exdev = OSError(errno.EXDEV, 'Invalid cross-device link')
+        with mock.patch.object(qpath.os, 'rename', side_effect=exdev):
+            strategy = qpath.move(self.src, self.dst)
+
+        self.assertIn(strategy, (qpath.REFLINK, qpath.COPY))
+        self.assertFalse(self.src.exists())
+        self.assertEqual((self.dst / 'a.txt').read_text(), 'a')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -11,6 +11,8 @@ import tempfile
 import pathlib
 import collections
 import datetime
+import hashlib
+import io
 import dateutil.relativedelta as relativedelta
 
 import qiime2.core.util as util
@@ -253,8 +255,51 @@ class TestMD5SumDirectory(unittest.TestCase):
                 ('bar/foo.baz', 'dcc0975b66728be0315abae5968379cb')
             ]))
 
+    def test_workers(self):
+        for i in range(20):
+            self.make_file(str(i).encode(), '%02d' % i)
+
+        serial = util.md5sum_directory(self.test_path, workers=1)
+        parallel = util.md5sum_directory(self.test_path, workers=4)
+
+        self.assertEqual(list(serial.items()), list(parallel.items()))
+        self.assertEqual(serial['10'], 'd3d9446802a44259755d38e6d163e820')
+
+    def test_other_algorithm(self):
+        self.make_file(b'anything at all', 'foo.baz')
+
+        self.assertEqual(
+            util.checksum_directory(self.test_path, 'blake2b'),
+            collections.OrderedDict([
+                ('foo.baz', hashlib.blake2b(b'anything at all').hexdigest())
+            ]))
+
 
 class TestChecksumFormat(unittest.TestCase):
+    def test_checksum_file_md5(self):
+        checksums = collections.OrderedDict([
+            ('b', 'c4ca4238a0b923820dcc509a6f75849b'),
+            ('a/file\nname', 'c81e728d9d4c2f636f067f89cc14862c')])
+        fh = io.StringIO()
+        util.write_checksum_file(fh, checksums)
+
+        # Plain md5sum format, without a header
+        self.assertEqual(fh.getvalue().splitlines()[0],
+                         'c4ca4238a0b923820dcc509a6f75849b  b')
+        fh.seek(0)
+        algorithm, observed = util.read_checksum_file(fh)
+        self.assertEqual(algorithm, 'md5')
+        self.assertEqual(list(observed.items()), list(checksums.items()))
+
+    def test_checksum_file_other_algorithm(self):
+        checksums = collections.OrderedDict([('b', 'abcd')])
+        fh = io.StringIO()
+        util.write_checksum_file(fh, checksums, 'blake2b')
+
+        self.assertEqual(fh.getvalue(), '#algorithm: blake2b\nabcd  b\n')
+        fh.seek(0)
+        self.assertEqual(util.read_checksum_file(fh), ('blake2b', checksums))
+
     def test_to_simple(self):
         line = util.to_checksum_format('this/is/a/filepath',
                                        'd9724aeba59d8cea5265f698b2c19684')
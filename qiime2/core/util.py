@@ -6,11 +6,11 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import concurrent.futures
 import contextlib
 import warnings
 import hashlib
 import os
-import io
 import collections
 
 import decorator
@@ -95,26 +95,88 @@ def duration_time(relative_delta):
         return '0 %s' % attrs[-1]
 
 
-def md5sum(filepath):
-    md5 = hashlib.md5()
+# Large reads keep the per-call overhead of hashing (and releasing the GIL)
+# negligible compared to the hashing itself.
+_CHECKSUM_BUFFER_SIZE = 2 ** 20
+
+
+def checksum(filepath, algorithm='md5'):
+    digest = hashlib.new(algorithm)
     with open(str(filepath), mode='rb') as fh:
-        for chunk in iter(lambda: fh.read(io.DEFAULT_BUFFER_SIZE), b""):
-            md5.update(chunk)
-    return md5.hexdigest()
+        for chunk in iter(lambda: fh.read(_CHECKSUM_BUFFER_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def md5sum(filepath):
+    return checksum(filepath, 'md5')
 
 
-def md5sum_directory(directory):
+def checksum_directory(directory, algorithm='md5', workers=None):
+    """Checksum every visible file in `directory`.
+
+    Returns an OrderedDict of relative path to hex digest, ordered by a
+    sorted walk of the directory. Files are hashed concurrently on `workers`
+    threads (None will use one per CPU, 1 hashes in the calling thread).
+
+    """
     directory = str(directory)
-    sums = collections.OrderedDict()
+    paths = []
     for root, dirs, files in os.walk(directory, topdown=True):
         dirs[:] = sorted([d for d in dirs if not d[0] == '.'])
         for file in sorted(files):
             if file[0] == '.':
                 continue
 
-            path = os.path.join(root, file)
-            sums[os.path.relpath(path, start=directory)] = md5sum(path)
-    return sums
+            paths.append(os.path.join(root, file))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    def checksum_path(path):
+        return checksum(path, algorithm)
+
+    if workers == 1 or len(paths) < 2:
+        digests = list(map(checksum_path, paths))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers) as executor:
+            digests = list(executor.map(checksum_path, paths))
+
+    return collections.OrderedDict(
+        (os.path.relpath(path, start=directory), digest)
+        for path, digest in zip(paths, digests))
+
+
+def md5sum_directory(directory, workers=None):
+    return checksum_directory(directory, 'md5', workers=workers)
+
+
+# Checksum files use the GNU coreutils format (which is implicitly md5). Any
+# other algorithm is recorded in a header line, which can never be mistaken
+# for a checksum line as those start with a hex digit or a backslash.
+_CHECKSUM_HEADER = '#algorithm: '
+
+
+def write_checksum_file(fh, checksums, algorithm='md5'):
+    if algorithm != 'md5':
+        fh.write(_CHECKSUM_HEADER + algorithm + '\n')
+    for item in checksums.items():
+        fh.write(to_checksum_format(*item))
+        fh.write('\n')
+
+
+def read_checksum_file(fh):
+    """Return (algorithm, checksums) of a checksum file."""
+    algorithm = 'md5'
+    checksums = collections.OrderedDict()
+    for line in fh:
+        if line.startswith(_CHECKSUM_HEADER):
+            algorithm = line[len(_CHECKSUM_HEADER):].strip()
+            continue
+        filepath, checksum = from_checksum_format(line)
+        checksums[filepath] = checksum
+    return algorithm, checksums
 
 
 def to_checksum_format(filepath, checksum):
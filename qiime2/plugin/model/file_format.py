@@ -8,6 +8,8 @@
 
 import abc
 
+import qiime2.core.path as qpath
+
 from .base import FormatBase, ValidationError, _check_validation_level
 
 
@@ -52,3 +54,15 @@ class BinaryFileFormat(_FileFormat):
     def open(self):
         mode = 'rb' if self._mode == 'r' else 'r+b'
         return self.path.open(mode=mode)
+
+    def mmap(self):
+        """Return a read-only memoryview of the file's contents.
+
+        The file is memory-mapped rather than read, so only the pages which
+        are used are loaded.
+
+        """
+        if self._mode != 'r':
+            raise TypeError("Cannot memory-map %r while it is being written."
+                            % self)
+        return qpath.map_file(self.path)
@@ -59,5 +59,41 @@ class TestTextFileFormat(unittest.TestCase):
             self.assertEqual(b'S', fh.read(1))
 
 
+class TestBinaryFileFormat(unittest.TestCase):
+    PAYLOAD = bytes(range(256)) * 100
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_mmap(self):
+        path = os.path.join(self.test_dir.name, 'file')
+        with open(path, 'wb') as fh:
+            fh.write(self.PAYLOAD)
+
+        ff = model.BinaryFileFormat(path, mode='r')
+        view = ff.mmap()
+
+        self.assertIsInstance(view, memoryview)
+        self.assertTrue(view.readonly)
+        self.assertEqual(view.tobytes(), self.PAYLOAD)
+
+    def test_mmap_empty(self):
+        path = os.path.join(self.test_dir.name, 'file')
+        open(path, 'wb').close()
+
+        ff = model.BinaryFileFormat(path, mode='r')
+
+        self.assertEqual(ff.mmap().tobytes(), b'')
+
+    def test_mmap_write_mode(self):
+        ff = model.BinaryFileFormat()
+
+        with self.assertRaisesRegex(TypeError, 'memory-map'):
+            ff.mmap()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -23,7 +23,7 @@ SemanticTypeRecord = collections.namedtuple(
     'SemanticTypeRecord', ['semantic_type', 'plugin'])
 FormatRecord = collections.namedtuple('FormatRecord', ['format', 'plugin'])
 ViewRecord = collections.namedtuple(
-    'ViewRecord', ['name', 'view', 'plugin', 'citations'])
+    'ViewRecord', ['name', 'view', 'plugin', 'citations', 'cache', 'sizeof'])
 TypeFormatRecord = collections.namedtuple(
     'TypeFormatRecord', ['type_expression', 'format', 'plugin'])
 
@@ -90,12 +90,35 @@ class Plugin:
 
         self.register_views(*formats, citations=citations)
 
-    def register_views(self, *views, citations=None):
+    def register_views(self, *views, citations=None, cache=None,
+                       sizeof=None):
+        """Register view types.
+
+        `cache` allows views of an artifact to be kept in memory and reused
+        by later calls to `Artifact.view` (see ``QIIME2_VIEW_CACHE_BUDGET``).
+        It is either 'immutable', for views which are never modified so the
+        same object can be shared, or 'copy', for views which are cheap to
+        copy with `copy.deepcopy` so each caller gets their own. By default
+        views are never cached.
+
+        `sizeof` is a function returning the number of bytes a view holds in
+        memory, for views the cache cannot measure itself (builtin scalars and
+        containers, and pandas objects). Views which cannot be measured are
+        not cached.
+
+        """
         if citations is None:
             citations = ()
         else:
             citations = tuple(citations)
 
+        if cache not in (None, 'immutable', 'copy'):
+            raise ValueError("View cache must be 'immutable' or 'copy', not "
+                             "%r." % cache)
+        if sizeof is not None and cache is None:
+            raise ValueError("The size of a view is only used when it is "
+                             "cached, so `sizeof` requires `cache`.")
+
         for view in views:
             if not isinstance(view, type):
                 raise TypeError("%r should be a class." % view)
@@ -103,6 +126,9 @@ class Plugin:
             is_format = False
             if issubclass(view, FormatBase):
                 is_format = True
+                if cache is not None:
+                    raise TypeError("Formats refer to files on disk, so %r "
+                                    "cannot be cached." % view)
 
             name = get_view_name(view)
             if name in self.views:
@@ -110,7 +136,8 @@ class Plugin:
                                 "plugin." % name)
 
             self.views[name] = ViewRecord(
-                name=name, view=view, plugin=self, citations=citations)
+                name=name, view=view, plugin=self, citations=citations,
+                cache=cache, sizeof=sizeof)
 
             if is_format:
                 self.formats[name] = FormatRecord(format=view, plugin=self)
@@ -223,7 +250,8 @@ class PluginMethods(PluginActions):
     def register_function(self, function, inputs, parameters, outputs, name,
                           description, input_descriptions=None,
                           parameter_descriptions=None,
-                          output_descriptions=None, citations=None):
+                          output_descriptions=None, citations=None,
+                          deterministic=True):
         if citations is None:
             citations = ()
         else:
@@ -233,7 +261,8 @@ class PluginMethods(PluginActions):
                                          self._package, name, description,
                                          input_descriptions,
                                          parameter_descriptions,
-                                         output_descriptions, citations)
+                                         output_descriptions, citations,
+                                         deterministic)
         self[method.id] = method
 
 
@@ -242,7 +271,8 @@ class PluginVisualizers(PluginActions):
 
     def register_function(self, function, inputs, parameters, name,
                           description, input_descriptions=None,
-                          parameter_descriptions=None, citations=None):
+                          parameter_descriptions=None, citations=None,
+                          deterministic=True):
         if citations is None:
             citations = ()
         else:
@@ -253,7 +283,7 @@ class PluginVisualizers(PluginActions):
                                                  description,
                                                  input_descriptions,
                                                  parameter_descriptions,
-                                                 citations)
+                                                 citations, deterministic)
         self[visualizer.id] = visualizer
 
 
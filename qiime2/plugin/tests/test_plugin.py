@@ -12,7 +12,9 @@ import unittest
 import qiime2.plugin
 import qiime2.sdk
 
+from qiime2.core.testing.format import MappingFormat
 from qiime2.core.testing.util import get_dummy_plugin
+from qiime2.core.util import get_view_name
 
 
 class TestPlugin(unittest.TestCase):
@@ -135,6 +137,31 @@ class TestPlugin(unittest.TestCase):
 
     # TODO test registration of directory formats.
 
+    def test_views(self):
+        self.assertEqual(self.plugin.views[get_view_name(int)].cache,
+                         'immutable')
+        self.assertIsNone(self.plugin.views['IntSequenceFormat'].cache)
+
+    def test_register_views_cache(self):
+        plugin = qiime2.plugin.Plugin(
+            name='local-dummy-plugin', version='0.0.0-dev',
+            website='https://github.com/qiime2/qiime2',
+            package='qiime2.core.testing')
+
+        plugin.register_views(list, cache='copy')
+        self.assertEqual(plugin.views[get_view_name(list)].cache, 'copy')
+        self.assertIsNone(plugin.views[get_view_name(list)].sizeof)
+
+        plugin.register_views(set, cache='immutable', sizeof=len)
+        self.assertIs(plugin.views[get_view_name(set)].sizeof, len)
+        with self.assertRaisesRegex(ValueError, 'requires `cache`'):
+            plugin.register_views(tuple, sizeof=len)
+
+        with self.assertRaisesRegex(ValueError, "'immutable' or 'copy'"):
+            plugin.register_views(dict, cache='shared')
+        with self.assertRaisesRegex(TypeError, 'cannot be cached'):
+            plugin.register_views(MappingFormat, cache='immutable')
+
     def test_types(self):
         types = self.plugin.types.keys()
 
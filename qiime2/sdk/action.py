@@ -7,38 +7,129 @@
 # ----------------------------------------------------------------------------
 
 import abc
+import atexit
 import concurrent.futures
+import importlib
 import inspect
+import multiprocessing
+import os
 import tempfile
 import textwrap
-import itertools
+import threading
 
 import decorator
 
 import qiime2.sdk
 import qiime2.core.type as qtype
 import qiime2.core.archive as archive
+import qiime2.core.path
+from qiime2.core.archive.cache import ResultCache
 from qiime2.core.util import LateBindingAttribute, DropFirstParameter, tuplize
 
 
-def _subprocess_apply(action, args, kwargs):
-    # Preprocess input artifacts as we've got pickled clones which shouldn't
-    # self-destruct.
-    for arg in itertools.chain(args, kwargs.values()):
-        if isinstance(arg, qiime2.sdk.Artifact):
-            # We can't rely on the subprocess preventing atexit hooks as the
-            # destructor is also called when the artifact goes out of scope
-            # (which happens).
-            arg._destructor.detach()
+def _to_handles(value):
+    # Results cross the process boundary as handles to their extracted
+    # archives, which are shared in place instead of being pickled.
+    if isinstance(value, qiime2.sdk.Result):
+        return value._handoff()
+    if type(value) in (list, set):
+        return type(value)(_to_handles(v) for v in value)
+    return value
 
-    results = action(*args, **kwargs)
-    for r in results:
-        # The destructor doesn't keep its detatched state when sent back to the
-        # main process. Something about the context-manager from ctx seems to
-        # cause a GC of the artifacts before the process actually ends, so we
-        # do need to detach these. The specifics are not understood.
-        r._destructor.detach()
-    return results
+
+def _from_handles(value, owned=False):
+    if isinstance(value, archive.ArchiveHandle):
+        return qiime2.sdk.Result._attach(value, owned=owned)
+    if type(value) in (list, set):
+        return type(value)(_from_handles(v, owned) for v in value)
+    return value
+
+
+def _discard_handles(handles):
+    # Outputs which a worker released but which nobody will attach
+    for handle in handles:
+        qiime2.core.path.ArchivePath(handle.path)._destructor()
+
+
+def _subprocess_apply(package, action_id, args, kwargs):
+    # The action is looked up by name instead of being pickled.
+    action = importlib.import_module(package).__plugin__.actions[action_id]
+
+    # The inputs still belong to the parent, which keeps them alive until
+    # this returns.
+    args = [_from_handles(arg) for arg in args]
+    kwargs = {name: _from_handles(value) for name, value in kwargs.items()}
+
+    handles = []
+    for result in action(*args, **kwargs):
+        handles.append(result._handoff())
+        # The parent takes over the outputs' directories
+        result._archiver.release()
+    return handles
+
+
+def _initialize_worker():
+    # Load the plugins once per worker instead of once per call.
+    qiime2.sdk.PluginManager()
+
+
+class _WorkerPool:
+    """The process pool shared by every call to `Action.asynchronous`.
+
+    Workers are started as they are needed, up to ``QIIME2_ASYNC_WORKERS``
+    (one per CPU by default) at a time, and are reused by later calls. Calls
+    beyond that wait for a worker to become free. The pool is shut down when
+    the interpreter exits.
+
+    Workers are spawned rather than forked, as forking a process with other
+    threads running (e.g. pipeline steps or archive compression) can leave
+    the child holding locks which nothing will ever release.
+
+    """
+    WORKERS_ENVVAR = 'QIIME2_ASYNC_WORKERS'
+    START_METHOD = 'spawn'
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def max_workers(self):
+        workers = os.environ.get(self.WORKERS_ENVVAR)
+        if workers:
+            return int(workers)
+        return os.cpu_count() or 1
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context(self.START_METHOD),
+                    initializer=_initialize_worker)
+            try:
+                return self._executor.submit(fn, *args)
+            except concurrent.futures.process.BrokenProcessPool:
+                # A worker died, which breaks the whole pool, so start over
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        return self.submit(fn, *args)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+_WORKER_POOL = _WorkerPool()
+atexit.register(_WORKER_POOL.shutdown)
+if hasattr(os, 'register_at_fork'):
+    # The pool belongs to the parent, a forked child makes its own
+    os.register_at_fork(after_in_child=_WORKER_POOL._reset)
 
 
 class Action(metaclass=abc.ABCMeta):
@@ -72,7 +163,8 @@ class Action(metaclass=abc.ABCMeta):
 
     # Private constructor
     @classmethod
-    def _init(cls, callable, signature, package, name, description, citations):
+    def _init(cls, callable, signature, package, name, description, citations,
+              deterministic=True):
         """
 
         Parameters
@@ -84,23 +176,29 @@ class Action(metaclass=abc.ABCMeta):
             Human-readable name for this action.
         description : str
             Human-readable description for this action.
+        deterministic : bool
+            Whether the same inputs and parameters always produce the same
+            outputs, which allows the results to be reused from the cache
+            configured by ``QIIME2_RESULT_CACHE``.
 
         """
         self = cls.__new__(cls)
-        self.__init(callable, signature, package, name, description, citations)
+        self.__init(callable, signature, package, name, description, citations,
+                    deterministic)
         return self
 
     # This "extra private" constructor is necessary because `Action` objects
     # can be initialized from a static (classmethod) context or on an
     # existing instance (see `_init` and `__setstate__`, respectively).
     def __init(self, callable, signature, package, name, description,
-               citations):
+               citations, deterministic=True):
         self._callable = callable
         self.signature = signature
         self.package = package
         self.name = name
         self.description = description
         self.citations = citations
+        self.deterministic = deterministic
 
         self.id = callable.__name__
         self._dynamic_call = self._get_callable_wrapper()
@@ -143,7 +241,8 @@ class Action(metaclass=abc.ABCMeta):
             'package': self.package,
             'name': self.name,
             'description': self.description,
-            'citations': self.citations
+            'citations': self.citations,
+            'deterministic': self.deterministic
         }
 
     def __setstate__(self, state):
@@ -205,10 +304,26 @@ class Action(metaclass=abc.ABCMeta):
                     parameter = callable_args[name] = user_input[name]
                     provenance.add_parameter(name, spec.qiime_type, parameter)
 
-                # Record and transform inputs
+                # Record inputs
+                for name in self.signature.inputs:
+                    provenance.add_input(name, user_input[name])
+
+                # Reuse the results of an identical call
+                cache = None
+                if self.deterministic:
+                    cache = ResultCache.from_environment()
+                if cache is not None:
+                    key = cache.key(provenance)
+                    cached = cache.get(key, qiime2.sdk.Result.load)
+                    if cached is not None:
+                        outputs = self._alias_cached(scope, cached,
+                                                     output_types, provenance)
+                        return qiime2.sdk.Results(
+                            self.signature.outputs.keys(), outputs)
+
+                # Transform inputs
                 for name, spec in self.signature.inputs.items():
                     artifact = user_input[name]
-                    provenance.add_input(name, artifact)
                     if artifact is None:
                         callable_args[name] = None
                     elif spec.has_view_type():
@@ -236,6 +351,9 @@ class Action(metaclass=abc.ABCMeta):
                         "outputs defined in signature: %d != %d" %
                         (len(outputs), len(self.signature.outputs)))
 
+                if cache is not None:
+                    cache.put(key, outputs)
+
                 # Wrap in a Results object mapping output name to value so
                 # users have access to outputs by name or position.
                 return qiime2.sdk.Results(self.signature.outputs.keys(),
@@ -246,6 +364,22 @@ class Action(metaclass=abc.ABCMeta):
         self._set_wrapper_name(bound_callable, self.id)
         return bound_callable
 
+    def _alias_cached(self, scope, cached, output_types, provenance):
+        # Like a pipeline, the outputs are aliases of the results they reuse,
+        # so provenance still records this call.
+        results = []
+        for result, name in zip(cached, output_types):
+            scope.add_reference(result)
+            prov = provenance.fork(name, result)
+            scope.add_reference(prov)
+
+            aliased_result = result._alias(prov)
+            scope.add_parent_reference(aliased_result)
+
+            results.append(aliased_result)
+
+        return tuple(results)
+
     def _get_callable_wrapper(self):
         # This is a "root" level invocation (not a nested call within a
         # pipeline), so no special factory is needed.
@@ -271,12 +405,45 @@ class Action(metaclass=abc.ABCMeta):
             # function's signature.
             args = args[1:]
 
-            pool = concurrent.futures.ProcessPoolExecutor(max_workers=1)
-            future = pool.submit(_subprocess_apply, self, args, kwargs)
-            # TODO: pool.shutdown(wait=False) caused the child process to
-            # hang unrecoverably. This seems to be a bug in Python 3.7
-            # It's probably best to gut concurrent.futures entirely, so we're
-            # ignoring the resource leakage for the moment.
+            handoff = _WORKER_POOL.submit(
+                _subprocess_apply, self.package, self.id,
+                [_to_handles(arg) for arg in args],
+                {name: _to_handles(value) for name, value in kwargs.items()})
+            # The worker uses the inputs in place, so they have to outlive it
+            inputs = args, kwargs
+            future = concurrent.futures.Future()
+
+            def adopt(handoff):
+                nonlocal inputs
+                inputs = None
+                if handoff.cancelled():
+                    return
+                if handoff.exception() is not None:
+                    if future.set_running_or_notify_cancel():
+                        future.set_exception(handoff.exception())
+                    return
+
+                handles = handoff.result()
+                if not future.set_running_or_notify_cancel():
+                    # Cancelled while the worker was running
+                    _discard_handles(handles)
+                    return
+                try:
+                    outputs = [qiime2.sdk.Result._attach(handle, owned=True)
+                               for handle in handles]
+                except Exception as e:
+                    _discard_handles(handles)
+                    future.set_exception(e)
+                    return
+                future.set_result(qiime2.sdk.Results(
+                    self.signature.outputs.keys(), outputs))
+
+            def cancel(future):
+                if future.cancelled():
+                    handoff.cancel()
+
+            future.add_done_callback(cancel)
+            handoff.add_done_callback(adopt)
             return future
 
         async_wrapper = self._rewrite_wrapper_signature(async_wrapper)
@@ -400,13 +567,13 @@ class Method(Action):
     @classmethod
     def _init(cls, callable, inputs, parameters, outputs, package, name,
               description, input_descriptions, parameter_descriptions,
-              output_descriptions, citations):
+              output_descriptions, citations, deterministic=True):
         signature = qtype.MethodSignature(callable, inputs, parameters,
                                           outputs, input_descriptions,
                                           parameter_descriptions,
                                           output_descriptions)
         return super()._init(callable, signature, package, name, description,
-                             citations)
+                             citations, deterministic)
 
 
 class Visualizer(Action):
@@ -438,12 +605,13 @@ class Visualizer(Action):
 
     @classmethod
     def _init(cls, callable, inputs, parameters, package, name, description,
-              input_descriptions, parameter_descriptions, citations):
+              input_descriptions, parameter_descriptions, citations,
+              deterministic=True):
         signature = qtype.VisualizerSignature(callable, inputs, parameters,
                                               input_descriptions,
                                               parameter_descriptions)
         return super()._init(callable, signature, package, name, description,
-                             citations)
+                             citations, deterministic)
 
 
 class Pipeline(Action):
@@ -456,7 +624,8 @@ class Pipeline(Action):
 
     def _callable_executor_(self, scope, view_args, output_types, provenance):
         outputs = self._callable(scope.ctx, **view_args)
-        outputs = tuplize(outputs)
+        # Steps may still be running (see Context), so wait for them
+        outputs = qiime2.sdk.context.resolve(tuplize(outputs))
 
         for output in outputs:
             if not isinstance(output, qiime2.sdk.Result):
@@ -498,8 +667,10 @@ class Pipeline(Action):
                                             outputs, input_descriptions,
                                             parameter_descriptions,
                                             output_descriptions)
+        # The steps of a pipeline are cached individually, so the pipeline
+        # itself never is (it may call non-deterministic steps).
         return super()._init(callable, signature, package, name, description,
-                             citations)
+                             citations, deterministic=False)
 
 
 markdown_source_template = """
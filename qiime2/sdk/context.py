@@ -6,13 +6,90 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import collections
+import concurrent.futures
+import functools
+import os
+
 import qiime2.sdk
 
 
+class DeferredResult:
+    """A result of a pipeline step which may still be running.
+
+    Any use of it (other than passing it to another step) waits for the step
+    and then behaves like the Result itself: attributes, comparisons, hashing
+    (so set and dict membership) and isinstance checks are all those of the
+    Result.
+
+    """
+    def __init__(self, future, index):
+        self._future = future
+        self._index = index
+
+    def _result(self):
+        return self._future.result()[self._index]
+
+    @property
+    def __class__(self):
+        # isinstance falls back to `__class__` when the type doesn't match
+        return type(self._result())
+
+    def __getattr__(self, name):
+        return getattr(self._result(), name)
+
+    def __eq__(self, other):
+        return self._result() == resolve(other)
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __hash__(self):
+        return hash(self._result())
+
+    def __repr__(self):
+        if not self._future.done():
+            return '<deferred result>'
+        return repr(self._result())
+
+
+def resolve(value):
+    """Replace any DeferredResult in `value` with its Result.
+
+    Lists, tuples, sets, dicts and Results are resolved recursively.
+
+    """
+    if type(value) is DeferredResult:
+        return value._result()
+    if type(value) in (list, tuple, set, frozenset):
+        return type(value)(resolve(v) for v in value)
+    if type(value) in (dict, collections.OrderedDict):
+        return type(value)((resolve(k), resolve(v)) for k, v in value.items())
+    if type(value) is qiime2.sdk.Results:
+        return qiime2.sdk.Results(value._fields, resolve(tuple(value)))
+    return value
+
+
 class Context:
+    """The state of an application of an action.
+
+    When ``QIIME2_PIPELINE_WORKERS`` is more than one, the steps of a
+    pipeline (the actions from `get_action`) are run on that many threads:
+    each step is started straight away and returns DeferredResults, waiting
+    for its own inputs first. Only the outermost pipeline does this, steps
+    which are pipelines themselves run their own steps one at a time.
+
+    """
+    WORKERS_ENVVAR = 'QIIME2_PIPELINE_WORKERS'
+
     def __init__(self, parent=None):
         self._parent = parent
         self._scope = None
+        self._workers = 1
+        if parent is None:
+            self._workers = int(os.environ.get(self.WORKERS_ENVVAR) or 1)
+        self._executor = None
+        self._pending = []
 
     def get_action(self, plugin: str, action: str):
         """Return a function matching the callable API of an action.
@@ -36,7 +113,31 @@ class Context:
         # parent. This allows scope cleanup to happen recursively.
         # A factory is necessary so that independent applications of the
         # returned callable recieve their own Context objects.
-        return action_obj._bind(lambda: Context(parent=self))
+        bound = action_obj._bind(lambda: Context(parent=self))
+        if self._workers <= 1:
+            return bound
+
+        @functools.wraps(bound)
+        def deferred(*args, **kwargs):
+            future = self._submit(bound, *args, **kwargs)
+            return qiime2.sdk.Results(
+                action_obj.signature.outputs.keys(),
+                [DeferredResult(future, idx) for idx in
+                 range(len(action_obj.signature.outputs))])
+
+        return deferred
+
+    def _submit(self, bound, *args, **kwargs):
+        def step():
+            return bound(*resolve(args),
+                         **{k: resolve(v) for k, v in kwargs.items()})
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._workers)
+        future = self._executor.submit(step)
+        self._pending.append(future)
+        return future
 
     def make_artifact(self, type, view, view_type=None):
         """Return a new artifact from a given view.
@@ -44,6 +145,9 @@ class Context:
         This artifact is automatically tracked and cleaned by the pipeline
         context.
         """
+        # Steps may still be running (see Context), so wait for any of their
+        # results in the view
+        view = resolve(view)
         artifact = qiime2.sdk.Artifact.import_data(type, view, view_type)
         # self._scope WILL be defined at this point, as pipelines always enter
         # a scope before deferring to plugin code. (Otherwise cleanup wouldn't
@@ -65,7 +169,20 @@ class Context:
         return self._scope
 
     def __exit__(self, exc_type, exc_value, exc_tb):
-        if exc_type is not None:
+        error = None
+        if self._executor is not None:
+            # Every step has to finish (and hand its results to this scope)
+            # before the scope can be cleaned up.
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            # Steps are only ever called before anything else goes wrong, so
+            # one at a time, the first step to fail would have raised first
+            # (even if nothing used its results).
+            error = next((f.exception() for f in self._pending
+                          if f.exception() is not None), None)
+            self._pending = []
+
+        if exc_type is not None or error is not None:
             # Something went wrong, teardown everything
             self._scope.destroy()
         else:
@@ -76,6 +193,9 @@ class Context:
                 for ref in parent_refs:
                     self._parent._scope.add_reference(ref)
 
+        if error is not None:
+            raise error
+
 
 class Scope:
     def __init__(self, ctx):
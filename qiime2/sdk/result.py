@@ -7,10 +7,15 @@
 # ----------------------------------------------------------------------------
 
 import os
-import shutil
 import collections
-import distutils.dir_util
+import concurrent.futures
+import copy
+import itertools
 import pathlib
+import sys
+import threading
+
+import pandas as pd
 
 import qiime2.metadata
 import qiime2.plugin
@@ -33,6 +38,120 @@ ResultMetadata = collections.namedtuple('ResultMetadata',
                                         ['uuid', 'type', 'format'])
 
 
+_SCALARS = (type(None), bool, int, float, complex, str, bytes)
+
+
+def _deep_sizeof(view):
+    """Return the bytes held by `view` and its contents, None if unknown."""
+    if isinstance(view, pd.DataFrame):
+        return int(view.memory_usage(deep=True).sum())
+    if isinstance(view, (pd.Series, pd.Index)):
+        return int(view.memory_usage(deep=True))
+    if isinstance(view, _SCALARS):
+        return sys.getsizeof(view)
+
+    if isinstance(view, (list, tuple, set, frozenset)):
+        items = view
+    elif isinstance(view, dict):
+        items = itertools.chain.from_iterable(view.items())
+    else:
+        return None
+
+    total = sys.getsizeof(view)
+    for item in items:
+        size = _deep_sizeof(item)
+        if size is None:
+            return None
+        total += size
+    return total
+
+
+class _ViewCache:
+    """Views of artifacts kept in memory for `Artifact.view`.
+
+    Only view types which a plugin registered with a `cache` policy are kept
+    (see `Plugin.register_views`): 'immutable' views are shared by every
+    caller, and 'copy' views are copied for each caller (and when stored), so
+    no caller can modify what the others see. Views are keyed by the
+    artifact's UUID, as the data of a UUID never changes.
+
+    The cache is configured by the environment: ``QIIME2_VIEW_CACHE_BUDGET``
+    is the number of bytes of views to keep before the least recently used
+    are evicted. Without it nothing is cached. Views are measured with their
+    registered `sizeof`, or by `_deep_sizeof`; views which can't be measured
+    are never kept.
+
+    """
+    BUDGET_ENVVAR = 'QIIME2_VIEW_CACHE_BUDGET'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._total = 0
+
+    @property
+    def budget(self):
+        budget = os.environ.get(self.BUDGET_ENVVAR)
+        return int(budget) if budget else None
+
+    def _record(self, view_type):
+        return qiime2.sdk.PluginManager().views.get(
+            util.get_view_name(view_type))
+
+    def policy(self, view_type):
+        """Return how `view_type` is cached, None if it isn't."""
+        if not self.budget:
+            return None
+        return getattr(self._record(view_type), 'cache', None)
+
+    def sizeof(self, view_type, view):
+        """Return the bytes held by `view`, None if they can't be known."""
+        sizeof = getattr(self._record(view_type), 'sizeof', None)
+        if sizeof is None:
+            sizeof = _deep_sizeof
+        return sizeof(view)
+
+    def _hand_out(self, view, policy):
+        if policy == 'copy':
+            return copy.deepcopy(view)
+        return view
+
+    def get(self, uuid, view_type, policy):
+        """Return a cached view, raising KeyError if there isn't one."""
+        key = (uuid, view_type)
+        with self._lock:
+            view, _ = self._entries[key]
+            self._entries.move_to_end(key)
+        return self._hand_out(view, policy)
+
+    def put(self, uuid, view_type, view, policy):
+        budget = self.budget
+        if budget is None:
+            return
+        size = self.sizeof(view_type, view)
+        if size is None or size > budget:
+            return
+
+        key = (uuid, view_type)
+        view = self._hand_out(view, policy)
+        with self._lock:
+            if key in self._entries:
+                self._total -= self._entries.pop(key)[1]
+            self._entries[key] = (view, size)
+            self._total += size
+            while self._total > budget:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._total -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total = 0
+
+
+_VIEW_CACHE = _ViewCache()
+
+
 class Result:
     """Base class for QIIME 2 result classes (Artifact and Visualization).
 
@@ -56,24 +175,108 @@ class Result:
         return ResultMetadata(*archive.Archiver.peek(filepath))
 
     @classmethod
-    def extract(cls, filepath, output_dir):
-        """Unzip contents of Artifacts and Visualizations."""
-        return archive.Archiver.extract(filepath, output_dir)
+    def peek_many(cls, filepaths, workers=None):
+        """Peek at many results concurrently.
+
+        Parameters
+        ----------
+        filepaths : iterable of str
+            Paths of the results to peek at.
+        workers : int, optional
+            Number of threads to peek with, None will use one per CPU.
+
+        Returns
+        -------
+        list
+            In the same order as `filepaths`, the ResultMetadata of each
+            result or the exception raised when peeking at it.
+
+        """
+        def peek(filepath):
+            try:
+                return cls.peek(filepath)
+            except Exception as e:
+                return e
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers) as executor:
+            return list(executor.map(peek, filepaths))
+
+    @classmethod
+    def validate_archive(cls, filepath, workers=1):
+        """Check the integrity of a saved result without loading it.
+
+        Every member is hashed directly from the archive and compared to the
+        archive's checksums, using `workers` threads (None will use one per
+        CPU).
+
+        Returns
+        -------
+        ChecksumDiff
+            The `added`, `removed`, and `changed` files, all of which are
+            empty when the archive is intact.
+
+        """
+        return archive.Archiver.validate_archive(filepath, workers=workers)
+
+    @classmethod
+    def extract(cls, filepath, output_dir, pattern=None):
+        """Unzip contents of Artifacts and Visualizations.
+
+        When `pattern` is provided, only the files whose path relative to
+        the archive's root directory matches the glob (e.g.
+        ``'data/sample-1_*.fastq.gz'``) are extracted.
+
+        """
+        return archive.Archiver.extract(filepath, output_dir, pattern=pattern)
+
+    @classmethod
+    def rehydrate(cls, filepath, destination, workers=1):
+        """Make a self-contained copy of a thin archive for sharing.
+
+        The data which the archive at `filepath` left in the blob store is
+        embedded in the copy saved to `destination`.
+
+        """
+        archive.Archiver.rehydrate(filepath, destination, workers=workers)
+
+    @classmethod
+    def load(cls, filepath, lazy=False):
+        """Factory for loading Artifacts and Visualizations.
+
+        When `lazy` is True, only the archive's metadata is extracted up
+        front. The data and provenance stay in the zip at `filepath` until
+        something needs a real path to them, so `filepath` must not be
+        modified or removed while the result is in use.
+
+        """
+        archiver = archive.Archiver.load(filepath, lazy=lazy)
+        return cls._from_archiver(archiver, 'filepath %r' % filepath)
 
     @classmethod
-    def load(cls, filepath):
-        """Factory for loading Artifacts and Visualizations."""
-        archiver = archive.Archiver.load(filepath)
+    def _attach(cls, handle, owned=False):
+        """Open a result which another process handed off (see `_handoff`).
+
+        When `owned` is True, the other process must have released it and
+        the new result takes over its directory.
+
+        """
+        archiver = archive.Archiver.attach(handle, owned=owned)
+        return cls._from_archiver(archiver, 'archive %r' % handle.path)
 
+    @classmethod
+    def _from_archiver(cls, archiver, source):
         if Artifact._is_valid_type(archiver.type):
             result = Artifact.__new__(Artifact)
         elif Visualization._is_valid_type(archiver.type):
             result = Visualization.__new__(Visualization)
         else:
             raise TypeError(
-                "Cannot load filepath %r into an Artifact or Visualization "
+                "Cannot load %s into an Artifact or Visualization "
                 "because type %r is not supported."
-                % (filepath, archiver.type))
+                % (source, archiver.type))
 
         if type(result) is not cls and cls is not Result:
             raise TypeError(
@@ -124,17 +327,24 @@ class Result:
         # different type that happens to have a `.uuid` property. We want to
         # ensure (as best as we can) that the UUIDs we are comparing are linked
         # to the same type of QIIME 2 object.
+        # `__class__` rather than `type` so that a DeferredResult (see
+        # qiime2.sdk.context) compares as the Result it stands for.
         return (
-            type(self) == type(other) and
+            type(self) == other.__class__ and
             self.uuid == other.uuid
         )
 
     def __ne__(self, other):
         return not (self == other)
 
-    def export_data(self, output_dir):
-        distutils.dir_util.copy_tree(
-            str(self._archiver.data_dir), str(output_dir))
+    def export_data(self, output_dir, pattern=None):
+        """Copy the result's data into `output_dir`.
+
+        When `pattern` is provided, only the files whose path relative to
+        the data directory matches the glob are exported.
+
+        """
+        self._archiver.export_data(output_dir, pattern=pattern)
         # Return None for now, although future implementations that include
         # format tranformations may return the invoked transformers
         return None
@@ -143,19 +353,44 @@ class Result:
     def _destructor(self):
         return self._archiver._destructor
 
-    def save(self, filepath):
+    def _handoff(self):
+        return self._archiver.handoff()
+
+    def save(self, filepath, workers=1, compresslevel=None, align=(),
+             thin=False):
+        """Save to `filepath`, adding the extension if it is missing.
+
+        `workers` is the number of threads used to compress the archive's
+        members, None will use one per CPU. `compresslevel` is the deflate
+        level (0-9) of the members, None will use zlib's default. `align` are
+        globs (relative to the data directory) of files to store uncompressed
+        and page-aligned, so they can be memory-mapped from the saved file.
+        When `thin` is True, the data is added to the blob store configured
+        by ``QIIME2_BLOB_STORE`` instead of the saved file, which can then
+        only be loaded where that store is available (see `rehydrate`).
+
+        """
+        blob_store = None
+        if thin:
+            blob_store = archive.BlobStore.from_environment()
+            if blob_store is None:
+                raise ValueError("Cannot save a thin archive without a blob "
+                                 "store (set %s)."
+                                 % archive.BlobStore.ROOT_ENVVAR)
+
         if not filepath.endswith(self.extension):
             filepath += self.extension
-        self._archiver.save(filepath)
+        self._archiver.save(filepath, workers=workers,
+                            compresslevel=compresslevel, align=align,
+                            blob_store=blob_store)
         return filepath
 
     def _alias(self, provenance_capture):
         def clone_original(into):
-            # directory is empty, this function is meant to fix that, so we
-            # can rmdir so that copytree is happy
-            into.rmdir()
-            shutil.copytree(str(self._archiver.data_dir), str(into),
-                            copy_function=os.link)  # Use hardlinks
+            # Both copies of the data are owned by the framework and are never
+            # modified, so they can share storage.
+            return qiime2.core.path.clone_tree(self._archiver.data_dir, into,
+                                               immutable=True)
 
         cls = type(self)
         alias = cls.__new__(cls)
@@ -279,17 +514,33 @@ class Artifact(Result):
             raise TypeError(
                 "Artifact %r cannot be viewed as QIIME 2 Metadata." % self)
 
+        policy = _VIEW_CACHE.policy(view_type)
+        if policy is not None and recorder is None:
+            try:
+                return _VIEW_CACHE.get(self.uuid, view_type, policy)
+            except KeyError:
+                pass
+
         from_type = transform.ModelType.from_view_type(self.format)
         to_type = transform.ModelType.from_view_type(view_type)
 
         transformation = from_type.make_transformation(to_type,
                                                        recorder=recorder)
+        if policy is not None and recorder is not None:
+            # The transformation is recorded either way, it just doesn't need
+            # to run again.
+            try:
+                return _VIEW_CACHE.get(self.uuid, view_type, policy)
+            except KeyError:
+                pass
         result = transformation(self._archiver.data_dir)
 
         if view_type is qiime2.Metadata:
             result._add_artifacts([self])
 
         to_type.set_user_owned(result, True)
+        if policy is not None:
+            _VIEW_CACHE.put(self.uuid, view_type, result, policy)
         return result
 
     def has_metadata(self):
@@ -328,10 +579,8 @@ class Visualization(Result):
 
     @classmethod
     def _from_data_dir(cls, data_dir, provenance_capture):
-        # shutil.copytree doesn't allow the destination directory to exist.
         def data_initializer(destination):
-            return distutils.dir_util.copy_tree(
-                str(data_dir), str(destination))
+            return qiime2.core.path.clone_tree(data_dir, destination)
 
         viz = cls.__new__(cls)
         viz._archiver = archive.Archiver.from_data(
@@ -359,4 +608,5 @@ class Visualization(Result):
 
     def _repr_html_(self):
         from qiime2.jupyter import make_html
-        return make_html(str(self._archiver.path))
+        # Accessing the root directory mounts anything left in the zip.
+        return make_html(str(self._archiver.root_dir.parent))
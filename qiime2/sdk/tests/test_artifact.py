@@ -10,8 +10,10 @@ import collections
 import os
 import tempfile
 import unittest
+import unittest.mock as mock
 import uuid
 import pathlib
+import sys
 
 import pandas as pd
 
@@ -19,12 +21,15 @@ import qiime2.plugin
 import qiime2.core.type
 from qiime2 import Metadata
 from qiime2.sdk import Artifact
-from qiime2.sdk.result import ResultMetadata
+from qiime2.sdk.result import (ResultMetadata, _ViewCache, _VIEW_CACHE,
+                               _deep_sizeof)
 from qiime2.plugin.model import ValidationError
 import qiime2.core.archive as archive
+import qiime2.core.transform as transform
 
 from qiime2.core.testing.type import IntSequence1, FourInts, Mapping, SingleInt
-from qiime2.core.testing.util import get_dummy_plugin, ArchiveTestingMixin
+from qiime2.core.testing.util import (get_dummy_plugin, ArchiveTestingMixin,
+                                      get_environment_member)
 
 
 class TestArtifact(unittest.TestCase, ArchiveTestingMixin):
@@ -106,7 +111,8 @@ class TestArtifact(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertArchiveMembers(fp, root_dir, expected)
@@ -168,7 +174,8 @@ class TestArtifact(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertArchiveMembers(fp1, root_dir, expected)
@@ -185,7 +192,8 @@ class TestArtifact(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertArchiveMembers(fp2, root_dir, expected)
@@ -210,6 +218,29 @@ class TestArtifact(unittest.TestCase, ArchiveTestingMixin):
         self.assertEqual(artifact1.view(list),
                          artifact2.view(list))
 
+    def test_save_thin_and_rehydrate(self):
+        fp = os.path.join(self.test_dir.name, 'thin.qza')
+        full_fp = os.path.join(self.test_dir.name, 'full.qza')
+        store = os.path.join(self.test_dir.name, 'blobs')
+        artifact = Artifact.import_data(FourInts, [-1, 42, 0, 43])
+
+        with mock.patch.dict(os.environ, {}, clear=True):
+            with self.assertRaisesRegex(ValueError, 'QIIME2_BLOB_STORE'):
+                artifact.save(fp, thin=True)
+
+        with mock.patch.dict(os.environ, {'QIIME2_BLOB_STORE': store}), \
+                mock.patch.object(archive.BlobStore, 'MIN_SIZE', 0):
+            artifact.save(fp, thin=True)
+            self.assertEqual(Artifact.load(fp).view(list), [-1, 42, 0, 43])
+            Artifact.rehydrate(fp, full_fp)
+
+        self.assertEqual(Artifact.validate_archive(fp), ({}, {}, {}))
+        with mock.patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(Artifact.load(full_fp).view(list),
+                             [-1, 42, 0, 43])
+            with self.assertRaisesRegex(ValueError, 'thin archive'):
+                Artifact.load(fp)
+
     def test_load_with_archive_filepath_modified(self):
         # Save an artifact for use in the following test case.
         fp = os.path.join(self.test_dir.name, 'artifact.qza')
@@ -259,7 +290,8 @@ class TestArtifact(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertExtractedArchiveMembers(output_dir, root_dir, expected)
@@ -538,6 +570,122 @@ class TestArtifact(unittest.TestCase, ArchiveTestingMixin):
                                     'as QIIME 2 Metadata'):
             A.view(Metadata)
 
+    def test_view_cache(self):
+        self.addCleanup(_VIEW_CACHE.clear)
+        A = Artifact.import_data('SingleInt', 42)
+        B = Artifact.import_data('SingleInt', 43)
+        C = Artifact.import_data('IntSequence1', [1, 2])
+
+        # Nothing is cached without a budget
+        self.assertEqual(A.view(int), 42)
+        self.assertEqual(len(_VIEW_CACHE._entries), 0)
+
+        with mock.patch.dict(os.environ, {'QIIME2_VIEW_CACHE_BUDGET': '1024'}):
+            self.assertEqual(A.view(int), 42)
+            self.assertEqual(B.view(int), 43)
+            # Only views which are declared cacheable are cached
+            self.assertEqual(C.view(list), [1, 2])
+            self.assertEqual(set(_VIEW_CACHE._entries),
+                             {(A.uuid, int), (B.uuid, int)})
+
+            with mock.patch.object(transform.ModelType, 'make_transformation',
+                                   side_effect=AssertionError('transformed')):
+                self.assertEqual(A.view(int), 42)
+                self.assertEqual(B.view(int), 43)
+
+    def test_view_cache_records_transformations(self):
+        self.addCleanup(_VIEW_CACHE.clear)
+        A = Artifact.import_data('SingleInt', 42)
+        with mock.patch.dict(os.environ, {'QIIME2_VIEW_CACHE_BUDGET': '1024'}):
+            A.view(int)
+            recorder = mock.Mock()
+            self.assertEqual(A._view(int, recorder), 42)
+        self.assertEqual(recorder.call_count, 1)
+
+    def test_view_cache_policies(self):
+        cache = _ViewCache()
+        view = [1, 2, 3]
+        with mock.patch.dict(os.environ, {'QIIME2_VIEW_CACHE_BUDGET': '1024'}):
+            cache.put('a', list, view, 'copy')
+            view.append(4)
+            copied = cache.get('a', list, 'copy')
+            self.assertEqual(copied, [1, 2, 3])
+            copied.append(5)
+            self.assertEqual(cache.get('a', list, 'copy'), [1, 2, 3])
+
+            cache.put('b', list, view, 'immutable')
+            self.assertIs(cache.get('b', list, 'immutable'), view)
+
+        with self.assertRaises(KeyError):
+            cache.get('c', list, 'copy')
+
+    def test_view_cache_evicts_least_recently_used(self):
+        cache = _ViewCache()
+        views = {name: list(range(10)) for name in 'abc'}
+        budget = str(_deep_sizeof(views['a']) * 2)
+        with mock.patch.dict(os.environ, {'QIIME2_VIEW_CACHE_BUDGET': budget}):
+            cache.put('a', list, views['a'], 'immutable')
+            cache.put('b', list, views['b'], 'immutable')
+            cache.get('a', list, 'immutable')
+            cache.put('c', list, views['c'], 'immutable')
+
+            self.assertIs(cache.get('a', list, 'immutable'), views['a'])
+            self.assertIs(cache.get('c', list, 'immutable'), views['c'])
+            with self.assertRaises(KeyError):
+                cache.get('b', list, 'immutable')
+
+            # Views larger than the whole budget are never kept
+            cache.put('d', list, list(range(100)), 'immutable')
+            with self.assertRaises(KeyError):
+                cache.get('d', list, 'immutable')
+
+    def test_view_cache_measures_contents(self):
+        cache = _ViewCache()
+        small = [0]
+        large = ['x' * 2048]
+        self.assertLess(sys.getsizeof(large), 1024)
+        with mock.patch.dict(os.environ, {'QIIME2_VIEW_CACHE_BUDGET': '1024'}):
+            cache.put('a', list, small, 'immutable')
+            cache.put('b', list, large, 'immutable')
+
+            self.assertIs(cache.get('a', list, 'immutable'), small)
+            with self.assertRaises(KeyError):
+                cache.get('b', list, 'immutable')
+
+            # Views which can't be measured are never kept
+            cache.put('c', object, object(), 'immutable')
+            with self.assertRaises(KeyError):
+                cache.get('c', object, 'immutable')
+
+    def test_deep_sizeof(self):
+        df = pd.DataFrame({'a': ['x' * 100, 'y' * 100]})
+        self.assertEqual(_deep_sizeof(df),
+                         df.memory_usage(deep=True).sum())
+        self.assertEqual(_deep_sizeof(df['a']),
+                         df['a'].memory_usage(deep=True))
+
+        nested = {'a': [1, 'bc'], 'b': (2.0, None)}
+        self.assertEqual(
+            _deep_sizeof(nested),
+            sys.getsizeof(nested) + sys.getsizeof('a') + sys.getsizeof('b') +
+            sys.getsizeof(nested['a']) + sys.getsizeof(1) +
+            sys.getsizeof('bc') + sys.getsizeof(nested['b']) +
+            sys.getsizeof(2.0) + sys.getsizeof(None))
+
+        self.assertIsNone(_deep_sizeof(object()))
+        self.assertIsNone(_deep_sizeof([1, object()]))
+
+    def test_view_cache_registered_sizeof(self):
+        cache = _ViewCache()
+        record = mock.Mock(cache='immutable', sizeof=lambda view: 4096)
+        with mock.patch.object(_ViewCache, '_record', return_value=record), \
+                mock.patch.dict(os.environ,
+                                {'QIIME2_VIEW_CACHE_BUDGET': '1024'}):
+            self.assertEqual(cache.sizeof(list, [1]), 4096)
+            cache.put('a', list, [1], 'immutable')
+            with self.assertRaises(KeyError):
+                cache.get('a', list, 'immutable')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -9,12 +9,21 @@
 import collections
 import concurrent.futures
 import inspect
+import multiprocessing
+import os
+import tempfile
 import unittest
+import unittest.mock as mock
 import uuid
 
+import yaml
+
 import qiime2.plugin
+from qiime2.core.archive import ProvenanceLoader
+from qiime2.core.archive.cache import ResultCache
 from qiime2.core.type import MethodSignature, Int
 from qiime2.sdk import Artifact, Method, Results
+from qiime2.sdk.action import _WORKER_POOL, _subprocess_apply
 
 from qiime2.core.testing.method import (concatenate_ints, merge_mappings,
                                         split_ints, params_only_method,
@@ -415,6 +424,56 @@ class TestMethod(unittest.TestCase):
 
         self.assertEqual(result.view(list), list(range(1, 14)))
 
+    def test_call_with_result_cache(self):
+        split_ints = self.plugin.methods['split_ints']
+        self.assertTrue(split_ints.deterministic)
+        artifact = Artifact.import_data(IntSequence1, [0, 42, -2, 43, 6])
+
+        with tempfile.TemporaryDirectory(prefix='qiime2-test-temp-') as tmp:
+            with mock.patch.dict(os.environ, {'QIIME2_RESULT_CACHE': tmp}):
+                first = split_ints(artifact)
+                with mock.patch.object(Method, '_callable_executor_') as ex:
+                    second = split_ints(artifact)
+                ex.assert_not_called()
+            self.assertEqual(len(ResultCache(tmp).entries()), 1)
+
+            for name, cached, reused in zip(('left', 'right'), first,
+                                            second):
+                self.assertNotEqual(reused.uuid, cached.uuid)
+                self.assertEqual(reused.type, IntSequence1)
+                self.assertEqual(reused.view(list), cached.view(list))
+
+                prov_dir = reused._archiver.provenance_dir
+                with (prov_dir / 'action' / 'action.yaml').open() as fh:
+                    action = yaml.load(fh, Loader=ProvenanceLoader)['action']
+                self.assertEqual(action['output-name'], name)
+                self.assertEqual(action['alias-of'], str(cached.uuid))
+                self.assertEqual(action['inputs'][0]['ints'],
+                                 str(artifact.uuid))
+                self.assertTrue(
+                    (prov_dir / 'artifacts' / str(cached.uuid)).exists())
+
+    def test_call_with_result_cache_miss(self):
+        split_ints = self.plugin.methods['split_ints']
+        artifact = Artifact.import_data(IntSequence1, [0, 42, -2, 43, 6])
+        other = Artifact.import_data(IntSequence1, [0, 42, -2, 43, 6])
+
+        with tempfile.TemporaryDirectory(prefix='qiime2-test-temp-') as tmp:
+            with mock.patch.dict(os.environ, {'QIIME2_RESULT_CACHE': tmp}):
+                split_ints(artifact)
+                # Different inputs are a different call
+                split_ints(other)
+                self.assertEqual(len(ResultCache(tmp).entries()), 2)
+
+                # Non-deterministic actions are never cached
+                with mock.patch.object(split_ints, 'deterministic', False):
+                    with mock.patch.object(
+                            Method, '_callable_executor_',
+                            wraps=split_ints._callable_executor_) as ex:
+                        split_ints(artifact)
+                    self.assertEqual(ex.call_count, 1)
+                self.assertEqual(len(ResultCache(tmp).entries()), 2)
+
     def test_asynchronous(self):
         concatenate_ints = self.plugin.methods['concatenate_ints']
 
@@ -463,6 +522,115 @@ class TestMethod(unittest.TestCase):
         self.assertEqual(result.view(list),
                          [10, 20, 0, 42, 43, 99, -22, 55, 1])
 
+    def test_asynchronous_shares_pool(self):
+        split_ints = self.plugin.methods['split_ints']
+        artifact = Artifact.import_data(IntSequence1, [0, 42, -2, 43, 6])
+
+        futures = [split_ints.asynchronous(artifact) for _ in range(3)]
+        executor = _WORKER_POOL._executor
+        self.assertIsNotNone(executor)
+        for future in futures:
+            left, right = future.result()
+            self.assertEqual(left.view(list), [0, 42])
+
+        split_ints.asynchronous(artifact).result()
+        self.assertIs(_WORKER_POOL._executor, executor)
+
+        _WORKER_POOL.shutdown()
+        self.assertIsNone(_WORKER_POOL._executor)
+        # A new pool is started when needed
+        left, right = split_ints.asynchronous(artifact).result()
+        self.assertEqual(right.view(list), [-2, 43, 6])
+
+    def test_asynchronous_workers_are_spawned(self):
+        # Forking while other threads hold locks can deadlock the workers
+        split_ints = self.plugin.methods['split_ints']
+        artifact = Artifact.import_data(IntSequence1, [0, 42, -2, 43, 6])
+
+        with mock.patch('multiprocessing.get_context',
+                        wraps=multiprocessing.get_context) as get_context:
+            _WORKER_POOL.shutdown()
+            left, right = split_ints.asynchronous(artifact).result()
+
+        get_context.assert_called_once_with('spawn')
+        self.assertEqual(left.view(list), [0, 42])
+
+    def test_asynchronous_hands_off_archives(self):
+        split_ints = self.plugin.methods['split_ints']
+        artifact = Artifact.import_data(IntSequence1, [0, 42, -2, 43, 6])
+
+        # Neither the action nor the artifacts are pickled
+        with mock.patch.object(Artifact, '__reduce_ex__',
+                               side_effect=TypeError('pickled')), \
+                mock.patch.object(Method, '__getstate__',
+                                  side_effect=TypeError('pickled')):
+            left, right = split_ints.asynchronous(artifact).result()
+
+        self.assertEqual(left.view(list), [0, 42])
+        self.assertEqual(right.view(list), [-2, 43, 6])
+
+        # The worker's outputs now belong to this process
+        path = str(left._archiver.path)
+        self.assertTrue(os.path.exists(path))
+        left._destructor()
+        self.assertFalse(os.path.exists(path))
+
+        # The input was only borrowed
+        self.assertEqual(artifact.view(list), [0, 42, -2, 43, 6])
+
+    def test_asynchronous_attach_error(self):
+        split_ints = self.plugin.methods['split_ints']
+        artifact = Artifact.import_data(IntSequence1, [0, 42, -2, 43, 6])
+        handles = []
+
+        def attach(handle, owned=False):
+            handles.append(handle)
+            raise ValueError('attach failed')
+
+        with mock.patch('qiime2.sdk.Result._attach', side_effect=attach):
+            future = split_ints.asynchronous(artifact)
+            with self.assertRaisesRegex(ValueError, 'attach failed'):
+                future.result()
+
+        self.assertEqual(len(handles), 1)
+        self.assertFalse(os.path.exists(handles[0].path))
+
+    def test_asynchronous_cancel(self):
+        split_ints = self.plugin.methods['split_ints']
+        artifact = Artifact.import_data(IntSequence1, [0, 42, -2, 43, 6])
+        handoff = concurrent.futures.Future()
+
+        with mock.patch.object(_WORKER_POOL, 'submit', return_value=handoff):
+            future = split_ints.asynchronous(artifact)
+        self.assertTrue(future.cancel())
+        self.assertTrue(handoff.cancelled())
+
+    def test_asynchronous_cancel_while_running(self):
+        split_ints = self.plugin.methods['split_ints']
+        artifact = Artifact.import_data(IntSequence1, [0, 42, -2, 43, 6])
+        handoff = concurrent.futures.Future()
+        handoff.set_running_or_notify_cancel()
+
+        with mock.patch.object(_WORKER_POOL, 'submit', return_value=handoff):
+            future = split_ints.asynchronous(artifact)
+        self.assertTrue(future.cancel())
+
+        # The worker finishes anyway, and its outputs are thrown away
+        handles = _subprocess_apply(split_ints.package, split_ints.id,
+                                    [artifact._handoff()], {})
+        for handle in handles:
+            self.assertTrue(os.path.exists(handle.path))
+        handoff.set_result(handles)
+
+        for handle in handles:
+            self.assertFalse(os.path.exists(handle.path))
+
+    def test_async_max_workers(self):
+        with mock.patch.dict(os.environ, {'QIIME2_ASYNC_WORKERS': '3'}):
+            self.assertEqual(_WORKER_POOL.max_workers, 3)
+        with mock.patch.dict(os.environ, {'QIIME2_ASYNC_WORKERS': ''}):
+            self.assertEqual(_WORKER_POOL.max_workers, os.cpu_count() or 1)
+
     def test_async_with_multiple_outputs(self):
         split_ints = self.plugin.methods['split_ints']
 
@@ -6,7 +6,9 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import os
 import unittest
+import unittest.mock as mock
 import inspect
 
 import pandas as pd
@@ -200,5 +202,109 @@ class TestPipeline(unittest.TestCase):
                 call(self.int_sequence, break_from='no-action')
 
 
+class TestConcurrentPipeline(TestPipeline):
+    # Everything behaves the same when the steps run concurrently
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(
+            os.environ, {qiime2.sdk.Context.WORKERS_ENVVAR: '4'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_deferred_steps(self):
+        ctx = qiime2.sdk.Context()
+        with ctx:
+            split_ints = ctx.get_action('dummy_plugin', 'split_ints')
+            left, right = split_ints(self.int_sequence)
+            self.assertIsInstance(left, qiime2.sdk.context.DeferredResult)
+
+            # Inputs may be deferred
+            most_common_viz = ctx.get_action('dummy_plugin',
+                                             'most_common_viz')
+            viz, = most_common_viz(right)
+
+            self.assertEqual(left.view(list), [1])
+            self.assertEqual(viz.type, Visualization)
+
+    def test_deferred_behaves_like_result(self):
+        ctx = qiime2.sdk.Context()
+        with ctx:
+            split_ints = ctx.get_action('dummy_plugin', 'split_ints')
+            left, right = split_ints(self.int_sequence)
+            left_result = left._result()
+
+            self.assertIsInstance(left, qiime2.Artifact)
+            self.assertIsInstance(left, qiime2.sdk.Result)
+            self.assertNotIsInstance(left, qiime2.Visualization)
+
+            self.assertEqual(left, left_result)
+            self.assertEqual(left_result, left)
+            self.assertEqual(left, left)
+            self.assertNotEqual(left, right)
+            self.assertNotEqual(left_result, right)
+            self.assertEqual(hash(left), hash(left_result))
+
+            self.assertIn(left, {left_result})
+            self.assertIn(left_result, {left})
+            self.assertEqual({left: 'left'}[left_result], 'left')
+            self.assertEqual({left_result: 'left'}[left], 'left')
+            self.assertEqual(len({left, left_result, right}), 2)
+
+    def test_resolve_nested(self):
+        resolve = qiime2.sdk.context.resolve
+        ctx = qiime2.sdk.Context()
+        with ctx:
+            split_ints = ctx.get_action('dummy_plugin', 'split_ints')
+            results = split_ints(self.int_sequence)
+            left, right = results
+            left_result, right_result = left._result(), right._result()
+
+            resolved = resolve({'left': [left], 'right': (right, {right})})
+            self.assertEqual(resolved, {'left': [left_result],
+                                        'right': (right_result,
+                                                  {right_result})})
+            self.assertIs(type(resolved['left'][0]), qiime2.Artifact)
+            self.assertIs(type(resolved['right'][0]), qiime2.Artifact)
+
+            resolved = resolve(results)
+            self.assertIsInstance(resolved, qiime2.sdk.Results)
+            self.assertEqual(resolved._fields, results._fields)
+            self.assertIs(type(resolved.left), qiime2.Artifact)
+            self.assertIs(resolved.left, left_result)
+
+    def test_step_arguments_are_resolved(self):
+        ctx = qiime2.sdk.Context()
+        with ctx:
+            split_ints = ctx.get_action('dummy_plugin', 'split_ints')
+            left, right = split_ints(self.int_sequence)
+
+            def step(*args, **kwargs):
+                return args, kwargs
+
+            args, kwargs = ctx._submit(step, {'left': left},
+                                       ints=[right]).result()
+
+        self.assertIs(type(args[0]['left']), qiime2.Artifact)
+        self.assertIs(type(kwargs['ints'][0]), qiime2.Artifact)
+
+    def test_make_artifact_resolves_view(self):
+        ctx = qiime2.sdk.Context()
+        with ctx:
+            split_ints = ctx.get_action('dummy_plugin', 'split_ints')
+            left, _ = split_ints(self.int_sequence)
+
+            with mock.patch.object(qiime2.sdk.Artifact,
+                                   'import_data') as import_data:
+                ctx.make_artifact(Mapping, {'left': left})
+
+        view = import_data.call_args[0][1]
+        self.assertIs(type(view['left']), qiime2.Artifact)
+
+    def test_nested_contexts_are_sequential(self):
+        ctx = qiime2.sdk.Context()
+        self.assertEqual(ctx._workers, 4)
+        self.assertEqual(qiime2.sdk.Context(parent=ctx)._workers, 1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -9,6 +9,7 @@
 import os
 import tempfile
 import unittest
+import zipfile
 import pathlib
 
 import qiime2.core.type
@@ -18,7 +19,8 @@ import qiime2.core.archive as archive
 import qiime2.core.exceptions as exceptions
 
 from qiime2.core.testing.type import FourInts
-from qiime2.core.testing.util import get_dummy_plugin, ArchiveTestingMixin
+from qiime2.core.testing.util import (get_dummy_plugin, ArchiveTestingMixin,
+                                      get_environment_member)
 from qiime2.core.testing.visualizer import mapping_viz
 
 
@@ -64,6 +66,19 @@ class TestResult(unittest.TestCase, ArchiveTestingMixin):
         self.assertEqual(artifact.uuid, saved_artifact.uuid)
         self.assertEqual(artifact.view(list), [-1, 42, 0, 43])
 
+    def test_load_artifact_lazy(self):
+        saved_artifact = Artifact.import_data(FourInts, [-1, 42, 0, 43])
+        fp = os.path.join(self.test_dir.name, 'artifact.qza')
+        saved_artifact.save(fp)
+
+        artifact = Result.load(fp, lazy=True)
+
+        self.assertIsInstance(artifact, Artifact)
+        self.assertEqual(artifact.type, FourInts)
+        self.assertEqual(artifact.uuid, saved_artifact.uuid)
+        self.assertEqual(artifact.view(list), [-1, 42, 0, 43])
+        self.assertEqual(artifact.citations, saved_artifact.citations)
+
     def test_load_visualization(self):
         saved_visualization = Visualization._from_data_dir(
              self.data_dir, self.make_provenance_capture())
@@ -99,11 +114,60 @@ class TestResult(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertExtractedArchiveMembers(output_dir, root_dir, expected)
 
+    def test_extract_pattern(self):
+        fp = os.path.join(self.test_dir.name, 'artifact.qza')
+        artifact = Artifact.import_data(FourInts, [-1, 42, 0, 43])
+        artifact.save(fp)
+
+        root_dir = str(artifact.uuid)
+        output_dir = pathlib.Path(self.test_dir.name) / 'artifact-extract-test'
+        result_dir = Result.extract(fp, output_dir=output_dir,
+                                    pattern='data/nested/*')
+        self.assertEqual(result_dir, str(output_dir / root_dir))
+
+        self.assertExtractedArchiveMembers(
+            output_dir, root_dir,
+            {'data/nested/file3.txt', 'data/nested/file4.txt'})
+
+        with self.assertRaisesRegex(ValueError, 'No members.*match'):
+            Result.extract(fp, output_dir=output_dir / 'empty',
+                           pattern='data/*.fastq.gz')
+
+    def test_export_data_pattern(self):
+        fp = os.path.join(self.test_dir.name, 'artifact.qza')
+        Artifact.import_data(FourInts, [-1, 42, 0, 43]).save(fp)
+
+        for lazy in True, False:
+            artifact = Artifact.load(fp, lazy=lazy)
+            output_dir = pathlib.Path(self.test_dir.name) / str(lazy)
+
+            artifact.export_data(str(output_dir), pattern='*file[23].txt')
+
+            self.assertEqual(
+                {str(p.relative_to(output_dir))
+                 for p in output_dir.glob('**/*') if p.is_file()},
+                {'file2.txt', 'nested/file3.txt'})
+            with (output_dir / 'nested' / 'file3.txt').open() as fh:
+                self.assertEqual(fh.read(), '0\n')
+            # Exporting a subset doesn't extract the data.
+            self.assertEqual(artifact._archiver.is_lazy, lazy)
+
+            with self.assertRaisesRegex(ValueError, 'No files.*match'):
+                artifact.export_data(str(output_dir), pattern='nope')
+
+        artifact.export_data(str(output_dir / 'all'))
+        self.assertEqual(
+            {str(p.relative_to(output_dir / 'all'))
+             for p in (output_dir / 'all').glob('**/*') if p.is_file()},
+            {'file1.txt', 'file2.txt', 'nested/file3.txt',
+             'nested/file4.txt'})
+
     def test_extract_visualization(self):
         fp = os.path.join(self.test_dir.name, 'visualization.qzv')
         visualization = Visualization._from_data_dir(
@@ -124,7 +188,8 @@ class TestResult(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertExtractedArchiveMembers(output_dir, root_dir, expected)
@@ -154,6 +219,31 @@ class TestResult(unittest.TestCase, ArchiveTestingMixin):
         self.assertEqual(metadata.uuid, str(visualization.uuid))
         self.assertIsNone(metadata.format)
 
+    def test_peek_many(self):
+        artifact = Artifact.import_data(FourInts, [0, 0, 42, 1000])
+        artifact_fp = artifact.save(
+            os.path.join(self.test_dir.name, 'artifact.qza'))
+        visualization = Visualization._from_data_dir(
+             self.data_dir, self.make_provenance_capture())
+        visualization_fp = visualization.save(
+            os.path.join(self.test_dir.name, 'visualization.qzv'))
+        not_zip_fp = os.path.join(self.test_dir.name, 'not-a-zip.qza')
+        with open(not_zip_fp, 'w') as fh:
+            fh.write('not a zip')
+        missing_fp = os.path.join(self.test_dir.name, 'missing.qza')
+
+        observed = Result.peek_many(
+            [artifact_fp, not_zip_fp, visualization_fp, missing_fp],
+            workers=2)
+
+        self.assertEqual(len(observed), 4)
+        self.assertEqual(observed[0], Result.peek(artifact_fp))
+        self.assertIsInstance(observed[1], ValueError)
+        self.assertIn('not a QIIME archive', str(observed[1]))
+        self.assertEqual(observed[2], Result.peek(visualization_fp))
+        self.assertIsInstance(observed[3], ValueError)
+        self.assertIn('does not exist', str(observed[3]))
+
     def test_save_artifact_auto_extension(self):
         artifact = Artifact.import_data(FourInts, [0, 0, 42, 1000])
 
@@ -254,6 +344,20 @@ class TestResult(unittest.TestCase, ArchiveTestingMixin):
                                     r'extra\.file'):
             visualization.validate()
 
+    def test_validate_archive(self):
+        artifact = Artifact.import_data('IntSequence1', [1, 2, 3, 4])
+        fp = artifact.save(os.path.join(self.test_dir.name, 'artifact.qza'))
+
+        self.assertEqual(Result.validate_archive(fp), ({}, {}, {}))
+
+        with zipfile.ZipFile(fp, mode='a') as zf:
+            zf.writestr('%s/extra.file' % artifact.uuid, 'uh oh')
+
+        diff = Result.validate_archive(fp, workers=2)
+        self.assertEqual(list(diff.added), ['extra.file'])
+        self.assertEqual(diff.removed, {})
+        self.assertEqual(diff.changed, {})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -20,7 +20,8 @@ import qiime2.core.archive as archive
 
 from qiime2.core.testing.visualizer import (
     mapping_viz, most_common_viz, multi_html_viz)
-from qiime2.core.testing.util import ArchiveTestingMixin
+from qiime2.core.testing.util import (ArchiveTestingMixin,
+                                      get_environment_member)
 
 
 class TestVisualization(unittest.TestCase, ArchiveTestingMixin):
@@ -85,7 +86,8 @@ class TestVisualization(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertArchiveMembers(fp, root_dir, expected)
@@ -124,7 +126,8 @@ class TestVisualization(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertArchiveMembers(fp1, root_dir, expected)
@@ -139,7 +142,8 @@ class TestVisualization(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertArchiveMembers(fp2, root_dir, expected)
@@ -215,7 +219,8 @@ class TestVisualization(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertExtractedArchiveMembers(output_dir, root_dir, expected)
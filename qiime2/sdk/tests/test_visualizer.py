@@ -22,7 +22,8 @@ from qiime2.sdk import Artifact, Visualization, Visualizer, Results
 from qiime2.core.testing.visualizer import (most_common_viz, mapping_viz,
                                             params_only_viz, no_input_viz)
 from qiime2.core.testing.type import IntSequence1, IntSequence2, Mapping
-from qiime2.core.testing.util import get_dummy_plugin, ArchiveTestingMixin
+from qiime2.core.testing.util import (get_dummy_plugin, ArchiveTestingMixin,
+                                      get_environment_member)
 
 
 class TestVisualizer(unittest.TestCase, ArchiveTestingMixin):
@@ -248,6 +249,7 @@ class TestVisualizer(unittest.TestCase, ArchiveTestingMixin):
             'provenance/VERSION',
             'provenance/citations.bib',
             'provenance/action/action.yaml',
+            get_environment_member(),
             'provenance/artifacts/%s/metadata.yaml' % artifact1.uuid,
             'provenance/artifacts/%s/VERSION' % artifact1.uuid,
             'provenance/artifacts/%s/citations.bib' % artifact1.uuid,
@@ -297,6 +299,7 @@ class TestVisualizer(unittest.TestCase, ArchiveTestingMixin):
             'provenance/VERSION',
             'provenance/citations.bib',
             'provenance/action/action.yaml',
+            get_environment_member(),
             'provenance/artifacts/%s/metadata.yaml' % artifact.uuid,
             'provenance/artifacts/%s/VERSION' % artifact.uuid,
             'provenance/artifacts/%s/citations.bib' % artifact.uuid,
@@ -327,7 +330,8 @@ class TestVisualizer(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertArchiveMembers(filepath, root_dir, expected)
@@ -353,7 +357,8 @@ class TestVisualizer(unittest.TestCase, ArchiveTestingMixin):
             'provenance/metadata.yaml',
             'provenance/VERSION',
             'provenance/citations.bib',
-            'provenance/action/action.yaml'
+            'provenance/action/action.yaml',
+            get_environment_member()
         }
 
         self.assertArchiveMembers(filepath, root_dir, expected)
@@ -399,6 +404,7 @@ class TestVisualizer(unittest.TestCase, ArchiveTestingMixin):
             'provenance/VERSION',
             'provenance/citations.bib',
             'provenance/action/action.yaml',
+            get_environment_member(),
             'provenance/artifacts/%s/metadata.yaml' % artifact1.uuid,
             'provenance/artifacts/%s/VERSION' % artifact1.uuid,
             'provenance/artifacts/%s/citations.bib' % artifact1.uuid,